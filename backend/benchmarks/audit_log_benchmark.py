@@ -0,0 +1,69 @@
+#
+# Measures audit log append throughput, and replay, verification and tally rebuild rates over a memory-mapped log.
+#
+# $ python -m benchmarks.audit_log_benchmark [--events N]
+#
+
+import argparse
+import os
+import tempfile
+import time
+
+from main.store.audit_log import (
+    AuditEvent,
+    AuditLog,
+    AuditLogReader,
+    ballot_subject,
+)
+
+
+def rate(events: int, seconds: float) -> str:
+    return "{0:>12,.0f} events/s  ({1:.2f} s)".format(events / seconds, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit log write and replay rates")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    subjects = [ballot_subject(str(index)) for index in range(1024)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "audit.log")
+
+        audit_log = AuditLog.configure(path)
+        start = time.perf_counter()
+        for index in range(args.events):
+            audit_log.append(
+                AuditEvent.BALLOT_COUNTED, subjects[index % 1024], index % 8 + 1
+            )
+        AuditLog.configure(None)
+        print(
+            "append + batched fsync   " + rate(args.events, time.perf_counter() - start)
+        )
+
+        with AuditLogReader(path) as reader:
+            start = time.perf_counter()
+            reader.verify()
+            print(
+                "verify                   "
+                + rate(len(reader), time.perf_counter() - start)
+            )
+
+            start = time.perf_counter()
+            reader.rebuild_counts()
+            print(
+                "rebuild tally            "
+                + rate(len(reader), time.perf_counter() - start)
+            )
+
+            start = time.perf_counter()
+            for _ in reader.replay():
+                pass
+            print(
+                "replay (Python records)  "
+                + rate(len(reader), time.perf_counter() - start)
+            )
+
+
+if __name__ == "__main__":
+    main()
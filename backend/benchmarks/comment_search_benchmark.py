@@ -0,0 +1,112 @@
+#
+# Compares searching ballot comments through the full-text index with scanning every comment in Python, as callers of
+# get_all_non_empty_ballot_comments had to.
+#
+# $ python -m benchmarks.comment_search_benchmark [--ballots N]
+#
+
+import argparse
+import random
+import re
+import time
+
+from main.api import balloting
+from main.store.data_registry import VotingStore
+
+WORDS = (
+    "the a and was were at for in of to my our polling station staff kind helpful quick slow queue wait hours "
+    "minutes parking ramp access form pen booth privacy curtain volunteer coffee rain sun morning evening"
+).split()
+PHRASES = [
+    "machine broken",
+    "long line",
+    "machine jammed",
+    "ballot ran out",
+    "no parking",
+]
+QUERIES = ["machine broken", "long line", "parking", "privacy curtain", "volunteer"]
+
+
+def populate(ballots: int, comment_share: float):
+    store = VotingStore.get_instance()
+    store.add_candidate("Candidate")
+
+    rng = random.Random(0)
+
+    def comment():
+        if rng.random() >= comment_share:
+            return None
+        words = rng.choices(WORDS, k=rng.randint(4, 24))
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(PHRASES))
+        return " ".join(words)
+
+    with store.connection:
+        store.connection.executemany(
+            """INSERT INTO ballots (ballot_number, candidate_id, comment) VALUES (?, ?, ?)""",
+            ((str(index), "1", comment()) for index in range(ballots)),
+        )
+
+
+def scan(query: str, limit: int):
+    """
+    The linear scan: every word of the query must appear in the comment
+    """
+    words = [re.compile(r"\b{0}".format(re.escape(word))) for word in query.split()]
+    matches = [
+        comment
+        for comment in balloting.get_all_ballot_comments()
+        if all(word.search(comment.lower()) for word in words)
+    ]
+    return matches[:limit]
+
+
+def best_of(runs: int, function) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search vs Python scan")
+    parser.add_argument("--ballots", type=int, default=200_000)
+    parser.add_argument("--comment-share", type=float, default=0.3)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    populate(args.ballots, args.comment_share)
+    print(
+        "ballots: {0:,}, with comments and indexed in {1:.1f} s".format(
+            args.ballots, time.perf_counter() - start
+        )
+    )
+
+    print("{0:<18} {1:>12} {2:>12} {3:>10}".format("query", "index", "scan", "matches"))
+    for query in QUERIES:
+        indexed = best_of(
+            args.runs, lambda: balloting.search_ballot_comments(query, args.limit)
+        )
+        scanned = best_of(args.runs, lambda: scan(query, args.limit))
+        matches = 0
+        page = balloting.search_ballot_comments(query, balloting.MAX_SEARCH_LIMIT)
+        while True:
+            matches += len(page.comments)
+            if page.next_cursor is None:
+                break
+            page = balloting.search_ballot_comments(
+                query, balloting.MAX_SEARCH_LIMIT, page.next_cursor
+            )
+        print(
+            "{0:<18} {1:>9.2f} ms {2:>9.1f} ms {3:>10,}".format(
+                query, indexed * 1000, scanned * 1000, matches
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#
+# Measures per-priority latency of the crypto executor under a mixed casting / issuance / reporting load, and how much
+# of the machine's cores crypto actually used.
+#
+# $ python -m benchmarks.crypto_executor_benchmark [--workers N] [--tasks N] [--concurrency N]
+#
+
+import argparse
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from main.crypto import primitives
+from main.crypto.executor import CryptoExecutor, Priority
+
+KEY = bytes(range(64))
+
+# Share of each kind of task in the load: casting checks a ballot, issuance hashes a new one and encrypts a name,
+# reporting decrypts a name
+MIX = [Priority.CASTING] * 4 + [Priority.ISSUANCE] * 2 + [Priority.REPORTING] * 4
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_task(executor: CryptoExecutor, priority: Priority, hashed: bytes, name: str):
+    if priority == Priority.CASTING:
+        executor.run(priority, primitives.bcrypt_check, b"111111111", hashed)
+    elif priority == Priority.ISSUANCE:
+        executor.run(priority, primitives.bcrypt_hash, b"111111111")
+    else:
+        executor.run(priority, primitives.aes_siv_decrypt, KEY, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crypto executor latency by priority")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    executor = CryptoExecutor.configure(args.workers)
+    print("pool warm-up            {0:.2f} s".format(time.perf_counter() - start))
+
+    hashed = primitives.bcrypt_hash(b"111111111")
+    name = primitives.aes_siv_encrypt(KEY, "Adam")
+    work = [random.choice(MIX) for _ in range(args.tasks)]
+    latencies: Dict[Priority, List[float]] = defaultdict(list)
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not work:
+                    return
+                priority = work.pop()
+            task_start = time.perf_counter()
+            run_task(executor, priority, hashed, name)
+            with lock:
+                latencies[priority].append(time.perf_counter() - task_start)
+
+    # Worker processes are children of this one, so their CPU time shows up in the children fields of os.times once
+    # the pool is shut down
+    times_before = os.times()
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+    CryptoExecutor.configure(0)
+    times_after = os.times()
+
+    print(
+        "{0} tasks in {1:.2f} s = {2:,.0f} tasks/s".format(
+            args.tasks, wall_seconds, args.tasks / wall_seconds
+        )
+    )
+    for priority in Priority:
+        samples = latencies[priority]
+        if samples:
+            print(
+                "{0:<10} n={1:<5} p50 {2:>8.1f} ms  p99 {3:>8.1f} ms".format(
+                    priority.name,
+                    len(samples),
+                    1000 * percentile(samples, 0.5),
+                    1000 * percentile(samples, 0.99),
+                )
+            )
+
+    cpu_seconds = sum(
+        after - before for before, after in zip(times_before[:4], times_after[:4])
+    )
+    cores = os.cpu_count() or 1
+    print(
+        "core utilization        {0:.0%} of {1} cores".format(
+            cpu_seconds / wall_seconds / cores, cores
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
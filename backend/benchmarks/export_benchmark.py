@@ -0,0 +1,49 @@
+#
+# Compares fetching ballots row by row through sqlite3 with the columnar export, and measures tallying straight from
+# the memory-mapped export.
+#
+# $ python -m benchmarks.export_benchmark [--ballots N] [--candidates N]
+#
+
+import argparse
+import tempfile
+import time
+
+from main.store.data_registry import VotingStore
+from main.store.export import ElectionExport, export_election
+
+from .tally_benchmark import populate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Row-by-row fetch vs columnar export")
+    parser.add_argument("--ballots", type=int, default=1_000_000)
+    parser.add_argument("--candidates", type=int, default=8)
+    args = parser.parse_args()
+
+    populate(args.ballots, args.candidates)
+    store = VotingStore.get_instance()
+
+    start = time.perf_counter()
+    rows = store.connection.execute(
+        """SELECT candidate_id, comment FROM ballots"""
+    ).fetchall()
+    print("row-by-row fetch    {0:.3f} s".format(time.perf_counter() - start))
+    del rows
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        export_election(directory, store)
+        print("columnar export     {0:.3f} s".format(time.perf_counter() - start))
+
+        start = time.perf_counter()
+        tally = ElectionExport(directory).tally()
+        print(
+            "tally from export   {0:.3f} s  ({1:,} ballots)".format(
+                time.perf_counter() - start, tally.total_votes
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#
+# Reports `python -X importtime` numbers, and the number of modules imported, for each public entry point of the
+# backend. Every entry point is imported in a fresh interpreter, so the numbers are cold-import costs.
+#
+# $ python -m benchmarks.import_time_benchmark [--top N]
+#
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = [
+    "main.api.balloting",
+    "main.api.registry",
+    "main.store.data_registry",
+    "main.store.fixtures",
+    "main.api.backend_rest_api",
+]
+
+# Dependencies that must only be imported on first use
+LAZY_DEPENDENCIES = ["bcrypt", "Crypto", "jsons", "numpy"]
+
+
+def lazy_dependencies_in(modules: Iterable[str]) -> List[str]:
+    """
+    The modules that belong to one of the LAZY_DEPENDENCIES
+    """
+    return sorted(
+        {
+            name
+            for name in modules
+            for dependency in LAZY_DEPENDENCIES
+            if name == dependency or name.startswith(dependency + ".")
+        }
+    )
+
+
+class ImportTimeReport:
+    """
+    The parsed output of `python -X importtime` for one entry point
+    """
+
+    def __init__(self, entry_point: str, modules: List[Tuple[str, int, int]]):
+        self.entry_point = entry_point
+        # (module name, self microseconds, cumulative microseconds), in import order
+        self.modules = modules
+
+    @property
+    def cumulative_us(self) -> int:
+        return sum(
+            cumulative
+            for name, _, cumulative in self.modules
+            if name == self.entry_point
+        )
+
+    @property
+    def imported_modules(self) -> Dict[str, int]:
+        return {name: cumulative for name, _, cumulative in self.modules}
+
+    def lazy_dependencies_imported(self) -> List[str]:
+        return lazy_dependencies_in(self.imported_modules)
+
+
+def measure_import_time(entry_point: str) -> ImportTimeReport:
+    """
+    Imports entry_point in a fresh interpreter with -X importtime and parses the result
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + entry_point],
+        cwd=BACKEND_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return ImportTimeReport(entry_point, modules)
+
+
+def imported_modules(entry_point: str) -> List[str]:
+    """
+    Imports entry_point in a fresh interpreter, and returns the modules that importing it added to sys.modules
+    """
+    stdout = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "before = set(sys.modules)\n"
+            "import {0}\n"
+            "print('\\n'.join(sorted(set(sys.modules) - before)))".format(entry_point),
+        ],
+        cwd=BACKEND_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    return stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cold import time of every backend entry point"
+    )
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    for entry_point in ENTRY_POINTS:
+        report = measure_import_time(entry_point)
+        print(
+            "{0:<30} {1:>8.1f} ms {2:>5} modules  lazy deps imported: {3}".format(
+                entry_point,
+                report.cumulative_us / 1000,
+                len(imported_modules(entry_point)),
+                ", ".join(report.lazy_dependencies_imported()) or "none",
+            )
+        )
+        heaviest = sorted(report.modules, key=lambda module: module[1], reverse=True)
+        for name, self_us, _ in heaviest[: args.top]:
+            print("    {0:<40} {1:>8.1f} ms self".format(name, self_us / 1000))
+
+
+if __name__ == "__main__":
+    main()
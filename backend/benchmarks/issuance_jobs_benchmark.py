@@ -0,0 +1,65 @@
+#
+# Measures issuing ballots for a queue of voters one at a time with balloting.issue_ballot, and through the issuance job
+# system (main/api/issuance_jobs.py) with a few worker counts: how long submitting takes, and the throughput until every
+# ballot is issued.
+#
+# $ python -m benchmarks.issuance_jobs_benchmark [--voters N] [--workers 1 2 4 8]
+#
+
+import argparse
+import time
+
+from main.api import balloting, registry
+from main.api.issuance_jobs import IssuanceJobs, JobStatus
+from main.objects.voter import Voter
+from main.store.data_registry import VotingStore
+
+
+def register_voters(voters: int):
+    VotingStore.refresh_instance()
+    national_ids = ["{0:09d}".format(index) for index in range(voters)]
+    for national_id in national_ids:
+        registry.register_voter(Voter("Voter", "Name", national_id))
+
+    return national_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ballot issuance job throughput")
+    parser.add_argument("--voters", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    national_ids = register_voters(args.voters)
+    start = time.perf_counter()
+    for national_id in national_ids:
+        assert balloting.issue_ballot(national_id) is not None
+    elapsed = time.perf_counter() - start
+    print("{0:<20} {1:>13} {2:>18}".format("", "call blocks", "throughput"))
+    print(
+        "{0:<20} {1:>10.1f} us {2:>8.1f} ballots/s".format(
+            "issue_ballot", elapsed / args.voters * 1e6, args.voters / elapsed
+        )
+    )
+
+    for workers in args.workers:
+        national_ids = register_voters(args.voters)
+        jobs = IssuanceJobs.configure(workers)
+        start = time.perf_counter()
+        job_ids = [jobs.submit(national_id) for national_id in national_ids]
+        submitted = time.perf_counter() - start
+        for job_id in job_ids:
+            assert jobs.poll(job_id, wait_seconds=60).status == JobStatus.ISSUED
+        elapsed = time.perf_counter() - start
+        print(
+            "{0:<20} {1:>10.1f} us {2:>8.1f} ballots/s".format(
+                "jobs, {0} workers".format(workers),
+                submitted / args.voters * 1e6,
+                args.voters / elapsed,
+            )
+        )
+        IssuanceJobs.configure(0)
+
+
+if __name__ == "__main__":
+    main()
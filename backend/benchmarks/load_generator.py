@@ -0,0 +1,454 @@
+#
+# Puts production-like load on the REST API and reports throughput and latency.
+#
+# A synthetic electorate is registered and issued two ballots per voter in bulk, through a seed file (see
+# main/store/fixtures.py). Requests to /api/count_ballot and /api/get_all_candidates are then sent on an open-loop
+# schedule: arrival times are fixed up front from the target rate, and latency is measured from the time a request was
+# due rather than from the time it was actually sent, so a stalled server can't hide its own queueing delay
+# (coordinated omission). Latencies are recorded in an HDR-style log-linear histogram.
+#
+# Against the Flask test client, in this process:
+#
+# $ python -m benchmarks.load_generator --voters 100 --rate 5 --duration 20
+#
+# Against a local server, write the electorate's seed first, start the server on it, then drive it:
+#
+# $ python -m benchmarks.load_generator --voters 100 --write-seed /tmp/load-seed.json
+# $ VOTING_STORE_SEED=/tmp/load-seed.json COUNT_BALLOT_RATE_PER_CLIENT=1000000 \
+#       FLASK_APP=main/api/backend_rest_api.py flask run
+# $ python -m benchmarks.load_generator --seed /tmp/load-seed.json --url http://127.0.0.1:5000
+#
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from main.objects.ballot import generate_ballot_number
+from main.objects.voter import BallotStatus, Voter
+from main.store import fixtures
+
+VALID = "valid"
+MISMATCHED = "mismatched"
+DUPLICATE = "duplicate"
+INVALIDATED = "invalidated"
+CANDIDATES = "get_all_candidates"
+
+# The BallotStatus each kind of ballot should get back. Shed (503) and rate limited (429) requests are reported apart.
+EXPECTED_STATUS = {
+    VALID: BallotStatus.BALLOT_COUNTED,
+    MISMATCHED: BallotStatus.VOTER_BALLOT_MISMATCH,
+    DUPLICATE: BallotStatus.FRAUD_COMMITTED,
+    INVALIDATED: BallotStatus.INVALID_BALLOT,
+}
+DEFAULT_MIX = "valid=70,mismatched=10,duplicate=10,invalidated=10"
+
+
+class LatencyHistogram:
+    """
+    An HDR-style latency histogram. Values are kept in log-linear buckets with significant_bits bits of precision, so
+    any recorded value can be read back within a relative error of 2^-significant_bits, in memory that only grows with
+    the logarithm of the largest value.
+    """
+
+    def __init__(self, significant_bits: int = 7):
+        self.significant_bits = significant_bits
+        # lowest value of a bucket, in microseconds -> count
+        self._buckets: Counter = Counter()
+        self.count = 0
+        self.max_microseconds = 0
+        self._lock = threading.Lock()
+
+    def _shift(self, microseconds: int) -> int:
+        return max(0, microseconds.bit_length() - self.significant_bits)
+
+    def record(self, seconds: float):
+        microseconds = max(0, int(seconds * 1e6))
+        shift = self._shift(microseconds)
+        with self._lock:
+            self._buckets[(microseconds >> shift) << shift] += 1
+            self.count += 1
+            self.max_microseconds = max(self.max_microseconds, microseconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        with self._lock:
+            self._buckets.update(other._buckets)
+            self.count += other.count
+            self.max_microseconds = max(self.max_microseconds, other.max_microseconds)
+
+    def value_at_percentile(self, percentile: float) -> float:
+        """
+        Returns the highest value, in seconds, that is equivalent to the value at the given percentile
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = max(1, int(round(percentile / 100 * self.count)))
+            seen = 0
+            for lowest in sorted(self._buckets):
+                seen += self._buckets[lowest]
+                if seen >= rank:
+                    highest = lowest + (1 << self._shift(lowest)) - 1
+                    return min(highest, self.max_microseconds) / 1e6
+
+            return self.max_microseconds / 1e6
+
+    def render(self, percentiles=(50, 75, 90, 99, 99.9, 99.99, 100)) -> str:
+        return "\n".join(
+            "  {0:>7}%  {1:>10.2f} ms".format(
+                percentile, 1000 * self.value_at_percentile(percentile)
+            )
+            for percentile in percentiles
+        )
+
+
+def build_electorate(
+    voters: int, candidates: int, invalidated_share: float, rng: random.Random
+) -> dict:
+    """
+    Builds a seed with the given number of candidates and voters, with two ballots issued to each voter. The second
+    ballot of a share of the voters is invalidated. Ballots are issued concurrently, as bcrypt releases the GIL.
+    """
+    electorate = [
+        Voter("Voter{0}".format(index), "Load", "{0:09d}".format(900_000_000 + index))
+        for index in range(voters)
+    ]
+    seed = fixtures.build_seed(
+        ["Candidate {0}".format(index) for index in range(candidates)],
+        electorate,
+        ballots_per_voter=0,
+    )
+
+    national_ids = [voter.national_id for voter in electorate for _ in range(2)]
+    with ThreadPoolExecutor(os.cpu_count() or 1) as pool:
+        ballot_numbers = list(pool.map(generate_ballot_number, national_ids))
+    seed["ballots"] = [
+        {"voter_national_id": national_id, "ballot_number": ballot_number}
+        for national_id, ballot_number in zip(national_ids, ballot_numbers)
+    ]
+    seed["invalidated_ballots"] = [
+        ballot_numbers[2 * index + 1]
+        for index in range(voters)
+        if rng.random() < invalidated_share
+    ]
+
+    return seed
+
+
+class Electorate:
+    """
+    Hands out the voters and ballots for each kind of request, and tracks who has voted
+    """
+
+    def __init__(self, seed: dict, rng: random.Random):
+        self._rng = rng
+        self._lock = threading.Lock()
+        # national id -> [first ballot, second ballot]
+        ballots: Dict[str, List[str]] = defaultdict(list)
+        for ballot in seed["ballots"]:
+            ballots[ballot["voter_national_id"]].append(ballot["ballot_number"])
+        self.ballots = dict(ballots)
+
+        invalidated = set(seed.get("invalidated_ballots", []))
+        self.invalidated = [
+            national_id
+            for national_id, numbers in self.ballots.items()
+            if numbers[1] in invalidated
+        ]
+        self.fresh = [
+            national_id
+            for national_id, numbers in self.ballots.items()
+            if numbers[1] not in invalidated
+        ]
+        rng.shuffle(self.fresh)
+        self.voted: List[str] = []
+
+    def next_ballot(self, kind: str) -> Tuple[str, Optional[Tuple[str, str]]]:
+        """
+        Returns the kind of ballot actually handed out, and its (voter national id, ballot number). A kind falls back to
+        another when the electorate can't supply it, e.g. duplicates before anyone has voted.
+        """
+        with self._lock:
+            if kind == DUPLICATE and self.voted:
+                national_id = self._rng.choice(self.voted)
+                return kind, (national_id, self.ballots[national_id][1])
+            if kind == INVALIDATED and self.invalidated:
+                national_id = self._rng.choice(self.invalidated)
+                return kind, (national_id, self.ballots[national_id][1])
+            # Mismatches don't change anyone's status. Voters with an invalidated ballot never vote, so they are
+            # preferred: a fresh voter could have voted by the time the mismatch is processed.
+            pool = self.invalidated if len(self.invalidated) >= 2 else self.fresh
+            if kind == MISMATCHED and len(pool) >= 2:
+                owner, other = self._rng.sample(pool, 2)
+                return kind, (other, self.ballots[owner][0])
+            if self.fresh:
+                national_id = self.fresh.pop()
+                return VALID, (national_id, self.ballots[national_id][0])
+
+            return CANDIDATES, None
+
+    def mark_voted(self, national_id: str):
+        with self._lock:
+            self.voted.append(national_id)
+
+
+class TestClientTransport:
+    """
+    Sends requests through the Flask test client, with the store seeded in this process
+    """
+
+    def __init__(self, seed_path: str):
+        os.environ["VOTING_STORE_SEED"] = seed_path
+        # Every request comes from the same address, so per-client rate limiting would only measure the limiter
+        os.environ.setdefault("COUNT_BALLOT_RATE_PER_CLIENT", "1000000")
+        os.environ.setdefault("COUNT_BALLOT_BURST_PER_CLIENT", "1000000")
+        from main.api.backend_rest_api import app
+
+        self._app = app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self._app.test_client()
+        return self._local.client
+
+    def get(self, path: str) -> Tuple[int, str]:
+        response = self._client().get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post(self, path: str, body: dict) -> Tuple[int, str]:
+        response = self._client().post(path, json=body)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpTransport:
+    """
+    Sends requests to a running server, over one keep-alive connection per thread
+    """
+
+    def __init__(self, url: str):
+        self._url = urlsplit(url)
+        self._local = threading.local()
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None):
+        import http.client
+
+        if not hasattr(self._local, "connection"):
+            self._local.connection = http.client.HTTPConnection(
+                self._url.hostname, self._url.port or 80, timeout=60
+            )
+        connection = self._local.connection
+        try:
+            connection.request(
+                method,
+                path,
+                body=None if body is None else json.dumps(body),
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            return response.status, response.read().decode("utf-8")
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            del self._local.connection
+            raise
+
+    def get(self, path: str) -> Tuple[int, str]:
+        return self._request("GET", path)
+
+    def post(self, path: str, body: dict) -> Tuple[int, str]:
+        return self._request("POST", path, body)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for entry in mix.split(","):
+        kind, weight = entry.split("=")
+        if kind not in EXPECTED_STATUS:
+            raise ValueError("Unknown ballot kind: {0}".format(kind))
+        weights[kind] = float(weight)
+    return weights
+
+
+def run_load(
+    transport,
+    electorate: Electorate,
+    candidate_ids: List[str],
+    rate: float,
+    duration: float,
+    mix: Dict[str, float],
+    candidates_share: float,
+    connections: int,
+    poisson: bool,
+    rng: random.Random,
+) -> dict:
+    """
+    Sends requests on an open-loop schedule for duration seconds, and returns per-kind histograms and outcomes
+    """
+    histograms: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+    outcomes: Dict[str, Counter] = defaultdict(Counter)
+    outcomes_lock = threading.Lock()
+    kinds, weights = zip(*mix.items())
+
+    def send(kind: str, ballot: Optional[Tuple[str, str]], due: float):
+        try:
+            if ballot is None:
+                status_code, body = transport.get("/api/get_all_candidates")
+                outcome = "ok" if status_code == 200 else str(status_code)
+            else:
+                national_id, ballot_number = ballot
+                status_code, body = transport.post(
+                    "/api/count_ballot",
+                    {
+                        "ballot_number": ballot_number,
+                        "chosen_candidate_id": rng.choice(candidate_ids),
+                        "voter_comments": "",
+                        "voter_national_id": national_id,
+                    },
+                )
+                if status_code in (429, 503):
+                    outcome = "shed {0}".format(status_code)
+                elif EXPECTED_STATUS[kind].value in body:
+                    outcome = "ok"
+                    if kind == VALID:
+                        electorate.mark_voted(national_id)
+                else:
+                    outcome = "unexpected {0}".format(status_code)
+        except Exception as exception:
+            outcome = "error {0}".format(type(exception).__name__)
+        # Measured from when the request was due, not from when it was sent
+        histograms[kind].record(time.perf_counter() - due)
+        with outcomes_lock:
+            outcomes[kind][outcome] += 1
+
+    pool = ThreadPoolExecutor(connections)
+    start = time.perf_counter()
+    due = start
+    sent = 0
+    while due < start + duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        if rng.random() < candidates_share:
+            kind, ballot = CANDIDATES, None
+        else:
+            kind, ballot = electorate.next_ballot(rng.choices(kinds, weights)[0])
+        pool.submit(send, kind, ballot, due)
+        sent += 1
+        due += rng.expovariate(rate) if poisson else 1 / rate
+
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "sent": sent,
+        "elapsed": elapsed,
+        "histograms": histograms,
+        "outcomes": outcomes,
+    }
+
+
+def report(results: dict, rate: float):
+    print(
+        "sent {0} requests in {1:.1f} s: {2:.1f} req/s completed (target {3:.1f} req/s)".format(
+            results["sent"],
+            results["elapsed"],
+            results["sent"] / results["elapsed"],
+            rate,
+        )
+    )
+
+    count_ballot = LatencyHistogram()
+    for kind in [VALID, MISMATCHED, DUPLICATE, INVALIDATED, CANDIDATES]:
+        histogram = results["histograms"].get(kind)
+        if histogram is None:
+            continue
+        if kind != CANDIDATES:
+            count_ballot.merge(histogram)
+        print(
+            "{0:<20} n={1:<6} p50 {2:>9.1f} ms  p99 {3:>9.1f} ms  max {4:>9.1f} ms  {5}".format(
+                kind,
+                histogram.count,
+                1000 * histogram.value_at_percentile(50),
+                1000 * histogram.value_at_percentile(99),
+                1000 * histogram.value_at_percentile(100),
+                dict(results["outcomes"][kind]),
+            )
+        )
+
+    print("/api/count_ballot latency, from due time:")
+    print(count_ballot.render())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator")
+    parser.add_argument("--voters", type=int, default=100)
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5.0, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weights of ballot kinds")
+    parser.add_argument("--candidates-share", type=float, default=0.2)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals")
+    parser.add_argument("--url", help="A running server. Defaults to the test client.")
+    parser.add_argument("--seed", help="Reuse an electorate written by --write-seed")
+    parser.add_argument("--write-seed", help="Write the electorate's seed and exit")
+    parser.add_argument("--random-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.random_seed)
+    mix = parse_mix(args.mix)
+
+    if args.seed:
+        with open(args.seed) as seed_file:
+            seed = json.load(seed_file)
+        seed_path = args.seed
+    else:
+        start = time.perf_counter()
+        seed = build_electorate(
+            args.voters,
+            args.candidates,
+            mix.get(INVALIDATED, 0) / sum(mix.values()),
+            rng,
+        )
+        print(
+            "issued {0} ballots in {1:.1f} s".format(
+                len(seed["ballots"]), time.perf_counter() - start
+            )
+        )
+        seed_path = args.write_seed or os.path.join(
+            tempfile.mkdtemp(), "load-seed.json"
+        )
+        fixtures.write_seed(seed, seed_path)
+        if args.write_seed:
+            print("Wrote {0}".format(seed_path))
+            return
+
+    transport = HttpTransport(args.url) if args.url else TestClientTransport(seed_path)
+    # The first request seeds the store, so it is kept out of the measurement
+    transport.get("/")
+
+    results = run_load(
+        transport,
+        Electorate(seed, rng),
+        [str(index + 1) for index in range(len(seed["candidates"]))],
+        args.rate,
+        args.duration,
+        mix,
+        args.candidates_share,
+        args.connections,
+        args.poisson,
+        rng,
+    )
+    report(results, args.rate)
+
+
+if __name__ == "__main__":
+    main()
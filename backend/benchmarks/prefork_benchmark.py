@@ -0,0 +1,182 @@
+#
+# Measures ballot casting throughput of the pre-fork server (main/api/prefork.py) as workers are added. For each worker
+# count, a server is started on a fresh shared store seeded with the same electorate, and every voter casts their
+# ballot once, from concurrent clients. Casting is bcrypt-bound, so throughput should grow close to linearly with the
+# number of workers, up to the number of cores.
+#
+# Another set of voters then cast both of their ballots at once, so that the two casts race in different workers; the
+# store must still count exactly one ballot per voter.
+#
+# $ python -m benchmarks.prefork_benchmark [--workers 1,2,4] [--voters N] [--racing-voters N]
+#
+
+import argparse
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from benchmarks.load_generator import HttpTransport, build_electorate
+from main.store import fixtures
+
+SERVER_START_TIMEOUT_SECONDS = 60
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(seed_path: str, database: str, workers: int, port: int):
+    env = dict(
+        os.environ,
+        VOTING_STORE_DATABASE=database,
+        VOTING_STORE_SEED=seed_path,
+        # Every request comes from the same address, so per-client rate limiting would only measure the limiter
+        COUNT_BALLOT_RATE_PER_CLIENT="1000000",
+        COUNT_BALLOT_BURST_PER_CLIENT="1000000",
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "main.api.prefork",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    transport = HttpTransport("http://127.0.0.1:{0}".format(port))
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while True:
+        try:
+            if transport.get("/")[0] == 200:
+                return server, transport
+        except OSError:
+            pass
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            raise RuntimeError("The pre-fork server didn't start")
+        time.sleep(0.1)
+
+
+def cast(transport: HttpTransport, ballot: Tuple[str, str]) -> int:
+    national_id, ballot_number = ballot
+    status, _ = transport.post(
+        "/api/count_ballot",
+        {
+            "ballot_number": ballot_number,
+            "chosen_candidate_id": "1",
+            "voter_comments": "",
+            "voter_national_id": national_id,
+        },
+    )
+    return status
+
+
+def run(
+    seed_path: str,
+    ballots: List[Tuple[str, str]],
+    racing_ballots: List[Tuple[str, str]],
+    workers: int,
+    concurrency: int,
+) -> Tuple[float, int, int]:
+    """
+    :returns: The casting throughput in ballots per second, the number of ballots counted, and the number of ballots
+              counted out of the racing ones
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "voting-store.sqlite3")
+        server, transport = start_server(seed_path, database, workers, free_port())
+        try:
+            with ThreadPoolExecutor(concurrency) as pool:
+                start = time.perf_counter()
+                statuses = list(
+                    pool.map(lambda ballot: cast(transport, ballot), ballots)
+                )
+                seconds = time.perf_counter() - start
+                racing_statuses = list(
+                    pool.map(lambda ballot: cast(transport, ballot), racing_ballots)
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+        connection = sqlite3.connect(database)
+        (stored_ballots,) = connection.execute(
+            "SELECT COUNT(*) FROM ballots"
+        ).fetchone()
+        connection.close()
+
+    expected_ballots = len(ballots) + len(racing_ballots) // 2
+    if stored_ballots != expected_ballots:
+        raise AssertionError(
+            "{0} ballots stored for {1} voters".format(stored_ballots, expected_ballots)
+        )
+
+    return len(ballots) / seconds, statuses.count(202), racing_statuses.count(202)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork casting throughput")
+    parser.add_argument(
+        "--workers",
+        default=",".join(
+            str(2**power) for power in range((os.cpu_count() or 1).bit_length())
+        ),
+        help="Comma-separated worker counts",
+    )
+    parser.add_argument("--voters", type=int, default=64)
+    parser.add_argument("--racing-voters", type=int, default=16)
+    args = parser.parse_args()
+    worker_counts = [int(workers) for workers in args.workers.split(",")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        seed_path = os.path.join(directory, "seed.json")
+        seed = build_electorate(
+            args.voters + args.racing_voters, 8, 0.0, random.Random(0)
+        )
+        fixtures.write_seed(seed, seed_path)
+        # Two ballots are issued to each voter, one after the other
+        all_ballots = [
+            (ballot["voter_national_id"], ballot["ballot_number"])
+            for ballot in seed["ballots"]
+        ]
+        ballots = all_ballots[: 2 * args.voters : 2]
+        racing_ballots = all_ballots[2 * args.voters :]
+
+        print("cores: {0}".format(os.cpu_count()))
+        baseline = None
+        for workers in worker_counts:
+            throughput, counted, racing_counted = run(
+                seed_path, ballots, racing_ballots, workers, 2 * max(worker_counts)
+            )
+            baseline = baseline or throughput
+            print(
+                "{0:>3} workers  {1:>7.1f} ballots/s  speedup {2:>5.2f}x  "
+                "counted {3}/{4}  racing voters counted {5}/{6}".format(
+                    workers,
+                    throughput,
+                    throughput / baseline,
+                    counted,
+                    len(ballots),
+                    racing_counted,
+                    args.racing_voters,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
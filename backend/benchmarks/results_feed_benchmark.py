@@ -0,0 +1,84 @@
+#
+# Fans the results feed out to many subscribers, and checks that delivery only reads the store's ballot counters, once per
+# interval, however many subscribers there are.
+#
+# $ python -m benchmarks.results_feed_benchmark [--subscribers N] [--ballots N]
+#
+
+import argparse
+import statistics
+import threading
+import time
+
+from main.api.results_feed import ResultsFeed
+from main.store.data_registry import VotingStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Results feed fan-out")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--ballots", type=int, default=10_000)
+    parser.add_argument("--interval", type=float, default=0.1)
+    args = parser.parse_args()
+
+    store = VotingStore.get_instance()
+    for index in range(8):
+        store.add_candidate("Candidate {0}".format(index))
+
+    feed = ResultsFeed(store, args.interval)
+    feed.start()
+    statements = []
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    ready = threading.Barrier(args.subscribers + 1)
+
+    def subscriber():
+        events = feed.subscribe(None, heartbeat_seconds=1)
+        next(events)  # the snapshot
+        ready.wait()
+        turnout = 0
+        while turnout < args.ballots:
+            event = next(events)
+            if event is None:
+                continue
+            turnout = event.turnout
+        with latencies_lock:
+            latencies.append(time.perf_counter() - published_at)
+
+    threads = [
+        threading.Thread(target=subscriber, daemon=True)
+        for _ in range(args.subscribers)
+    ]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+
+    published_at = time.perf_counter()
+    with store.connection:
+        store.connection.executemany(
+            """INSERT INTO ballots (ballot_number, candidate_id, comment) VALUES (?, ?, '')""",
+            (
+                ("ballot-{0}".format(index), str(index % 8 + 1))
+                for index in range(args.ballots)
+            ),
+        )
+    store.connection.set_trace_callback(statements.append)
+    for thread in threads:
+        thread.join()
+
+    print("subscribers: {0:,}, ballots: {1:,}".format(args.subscribers, args.ballots))
+    print(
+        "last delta delivered to every subscriber after {0:.1f} ms (median {1:.1f} ms)".format(
+            max(latencies) * 1000, statistics.median(latencies) * 1000
+        )
+    )
+    print(
+        "SQL statements executed during fan-out: {0} (every {1} s)".format(
+            len(statements), args.interval
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#
+# Compares the cost of serializing REST responses with jsons, as the endpoints used to, and with the explicit encoders
+# of main/api/serialization.py, per call and per request through a Flask test client.
+#
+# $ python -m benchmarks.serialization_benchmark [--candidates N]
+#
+
+import argparse
+import json
+import timeit
+
+import jsons
+from flask_api import FlaskAPI
+
+from main.api import registry, serialization
+from main.objects.voter import BallotStatus
+from main.store.data_registry import VotingStore
+
+
+def per_call_us(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def build_app(candidates, ballot_status) -> FlaskAPI:
+    """
+    An app with each response served both ways, so that requests measure serialization and not the rest of the API
+    """
+    app = FlaskAPI(__name__)
+
+    @app.route("/jsons/candidates")
+    def jsons_candidates():
+        return jsons.dumps(candidates)
+
+    @app.route("/explicit/candidates")
+    def explicit_candidates():
+        return serialization.candidates_response(
+            candidates, serialization.WIRE_FORMAT_V1
+        )
+
+    @app.route("/jsons/status")
+    def jsons_status():
+        return {"status": jsons.dumps(ballot_status.value)}, 409
+
+    @app.route("/explicit/status")
+    def explicit_status():
+        return serialization.ballot_status_response(
+            ballot_status, serialization.WIRE_FORMAT_V1, 409
+        )
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="jsons vs explicit encoders")
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    VotingStore.refresh_instance()
+    for index in range(args.candidates):
+        registry.register_candidate("Candidate {0}".format(index))
+    candidates = registry.get_all_candidates()
+    ballot_status = BallotStatus.VOTER_BALLOT_MISMATCH
+    client = build_app(candidates, ballot_status).test_client()
+
+    rows = [
+        (
+            "candidates, per call",
+            args.number,
+            lambda: jsons.dumps(candidates),
+            lambda: serialization.encode_candidates(candidates),
+        ),
+        (
+            "ballot status, per call",
+            args.number,
+            lambda: json.dumps({"status": jsons.dumps(ballot_status.value)}),
+            lambda: serialization.encode_ballot_status(
+                ballot_status, serialization.WIRE_FORMAT_V1
+            ),
+        ),
+        (
+            "candidates, per request",
+            args.number // 10,
+            lambda: client.get("/jsons/candidates"),
+            lambda: client.get("/explicit/candidates"),
+        ),
+        (
+            "ballot status, per request",
+            args.number // 10,
+            lambda: client.get("/jsons/status"),
+            lambda: client.get("/explicit/status"),
+        ),
+    ]
+
+    print("{0} candidates".format(args.candidates))
+    print("{0:<28} {1:>12} {2:>12} {3:>8}".format("", "jsons", "explicit", "speedup"))
+    for name, number, with_jsons, explicit in rows:
+        jsons_us = per_call_us(with_jsons, number)
+        explicit_us = per_call_us(explicit, number)
+        print(
+            "{0:<28} {1:>9.1f} us {2:>9.1f} us {3:>7.1f}x".format(
+                name, jsons_us, explicit_us, jsons_us / explicit_us
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#
+# Measures time-to-first-request of the REST API for each seeding mode. Every sample runs in a fresh interpreter, so
+# import time and seeding time are both included.
+#
+# $ python -m benchmarks.startup_benchmark [--runs N]
+#
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST_SCRIPT = """
+import time
+start = time.perf_counter()
+from main.api.backend_rest_api import app
+imported = time.perf_counter()
+response = app.test_client().get("/api/get_all_candidates")
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(imported - start, done - start)
+"""
+
+
+def time_to_first_request(seed: str) -> tuple:
+    env = dict(os.environ, VOTING_STORE_SEED=seed)
+    env.pop("NAME_ENCRYPTION_KEY_AES_SIV", None)
+    output = subprocess.run(
+        [sys.executable, "-c", FIRST_REQUEST_SCRIPT],
+        cwd=BACKEND_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    import_seconds, first_request_seconds = output.strip().splitlines()[-1].split()
+    return float(import_seconds), float(first_request_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time-to-first-request for each seeding mode"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{0:<10} {1:>12} {2:>22}".format("seed", "import (ms)", "first request (ms)"))
+    for seed in ["populate", "fixture", "none"]:
+        samples = [time_to_first_request(seed) for _ in range(args.runs)]
+        print(
+            "{0:<10} {1:>12.1f} {2:>22.1f}".format(
+                seed,
+                statistics.median(sample[0] for sample in samples) * 1000,
+                statistics.median(sample[1] for sample in samples) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
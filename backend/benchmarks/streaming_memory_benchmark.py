@@ -0,0 +1,111 @@
+#
+# Measures how much a process's peak RSS grows while it reads every voter, fraud voter and ballot comment, with the bulk
+# reads (get_all_voters, get_fraud_voters, get_all_non_empty_ballot_comments) and with their iter_* variants, as the
+# roll grows. The roll is written to a database file, so the database itself isn't counted, and each measurement runs
+# in a fresh process.
+#
+# $ python -m benchmarks.streaming_memory_benchmark [--voters 25000 50000 100000 200000]
+#
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from main.store.data_registry import VotingStore
+
+# Every tenth voter is flagged for fraud, and every voter has cast a ballot with a comment
+FRAUD_EVERY = 10
+# About the length of an encrypted name
+NAME_LENGTH = 120
+
+READS = {
+    "bulk": lambda store: (
+        len(store.get_all_voters())
+        + len(store.get_fraud_voters())
+        + len(store.get_all_non_empty_ballot_comments())
+    ),
+    "iter": lambda store: (
+        sum(1 for _ in store.iter_voters())
+        + sum(1 for _ in store.iter_fraud_voters())
+        + sum(1 for _ in store.iter_non_empty_ballot_comments())
+    ),
+}
+
+
+def populate(path: str, voters: int):
+    """
+    Writes a roll of synthetic voters, and their ballots, to a database file
+    """
+    store = VotingStore.open_database(path)
+    with store.connection:
+        store.connection.executemany(
+            """INSERT INTO voters (first_name, last_name, national_id, voted, fraud_commited) VALUES (?, ?, ?, true, ?)""",
+            (
+                (
+                    "f{0:0{1}d}".format(index, NAME_LENGTH - 1),
+                    "l{0:0{1}d}".format(index, NAME_LENGTH - 1),
+                    "{0:064d}".format(index),
+                    index % FRAUD_EVERY == 0,
+                )
+                for index in range(voters)
+            ),
+        )
+        store.connection.executemany(
+            """INSERT INTO ballots (ballot_number, candidate_id, comment) VALUES (?, '1', ?)""",
+            (
+                ("ballot-{0}".format(index), "comment {0}".format(index))
+                for index in range(voters)
+            ),
+        )
+    store.connection.close()
+
+
+def measure(path: str, read: str):
+    """
+    Runs in the child process: prints the rows read and the growth of the peak RSS, in KiB
+    """
+    store = VotingStore.open_database(path)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rows = READS[read](store)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(rows, after - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of bulk vs streaming reads")
+    parser.add_argument(
+        "--voters", type=int, nargs="+", default=[25_000, 50_000, 100_000, 200_000]
+    )
+    parser.add_argument("--measure", nargs=2, metavar=("DATABASE", "READ"))
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    print("{0:>10} {1:>14} {2:>14}".format("voters", "bulk", "iter"))
+    with tempfile.TemporaryDirectory() as directory:
+        for voters in args.voters:
+            path = os.path.join(directory, "roll-{0}.sqlite3".format(voters))
+            populate(path, voters)
+            growth = {}
+            for read in READS:
+                output = subprocess.run(
+                    [sys.executable, "-m", __spec__.name, "--measure", path, read],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout.split()
+                growth[read] = int(output[1])
+            print(
+                "{0:>10,} {1:>10,} KiB {2:>10,} KiB".format(
+                    voters, growth["bulk"], growth["iter"]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
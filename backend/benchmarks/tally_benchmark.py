@@ -0,0 +1,67 @@
+#
+# Compares the SQL aggregation in VotingStore.get_top_candidate with the bincount tally engine.
+#
+# $ python -m benchmarks.tally_benchmark [--ballots N] [--candidates N]
+#
+
+import argparse
+import random
+import time
+
+from main.store import tally_engine
+from main.store.data_registry import VotingStore
+
+
+def populate(ballots: int, candidates: int):
+    store = VotingStore.get_instance()
+    for index in range(candidates):
+        store.add_candidate("Candidate {0}".format(index))
+
+    rng = random.Random(0)
+    with store.connection:
+        store.connection.executemany(
+            """INSERT INTO ballots (ballot_number, candidate_id, comment) VALUES (?, ?, ?)""",
+            (
+                (str(index), str(rng.randint(1, candidates)), None)
+                for index in range(ballots)
+            ),
+        )
+
+
+def best_of(runs: int, function) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQL vs bincount tallying")
+    parser.add_argument("--ballots", type=int, default=1_000_000)
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    populate(args.ballots, args.candidates)
+    store = VotingStore.get_instance()
+
+    sql = best_of(args.runs, store.get_top_candidate)
+    load = best_of(args.runs, lambda: tally_engine.load_candidate_ids(store))
+    candidate_ids = tally_engine.load_candidate_ids(store)
+    candidates = store.get_all_candidates()
+    count = best_of(
+        args.runs, lambda: tally_engine.tally_candidate_ids(candidate_ids, candidates)
+    )
+    engine = best_of(args.runs, lambda: tally_engine.compute_tally(store))
+
+    print("ballots: {0:,}".format(args.ballots))
+    print("{0:<32} {1:>10.1f} ms".format("SQL get_top_candidate", sql * 1000))
+    print("{0:<32} {1:>10.1f} ms".format("engine: load column", load * 1000))
+    print("{0:<32} {1:>10.1f} ms".format("engine: bincount (loaded)", count * 1000))
+    print("{0:<32} {1:>10.1f} ms".format("engine: compute_tally", engine * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#
+# Measures the voting flow - verify_ballot, then count_ballot for the same voter and ballot - with and without the
+# ballot verification cache (main/api/verification_cache.py), and reports the cache's hit rate and the time it saved.
+#
+# $ python -m benchmarks.verification_cache_benchmark [--voters N]
+#
+
+import argparse
+import statistics
+import time
+
+from main.api import balloting, registry
+from main.api.verification_cache import (
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL_SECONDS,
+    VerificationCache,
+)
+from main.objects.ballot import Ballot
+from main.objects.voter import BallotStatus, Voter
+from main.store.data_registry import VotingStore
+
+
+def run(voters: int, max_entries: int):
+    """
+    :returns: The latency of each verify-then-count flow, in seconds, and the cache used
+    """
+    VotingStore.refresh_instance()
+    cache = VerificationCache.configure(max_entries, DEFAULT_TTL_SECONDS)
+    registry.register_candidate("Candidate")
+    ballots = []
+    for index in range(voters):
+        voter = Voter("Voter", str(index), "{0:09d}".format(index))
+        registry.register_voter(voter)
+        ballots.append((voter.national_id, balloting.issue_ballot(voter.national_id)))
+
+    latencies = []
+    for national_id, ballot_number in ballots:
+        start = time.perf_counter()
+        assert balloting.verify_ballot(national_id, ballot_number)
+        status = balloting.count_ballot(Ballot(ballot_number, "1", ""), national_id)
+        latencies.append(time.perf_counter() - start)
+        assert status == BallotStatus.BALLOT_COUNTED
+
+    return latencies, cache
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Verify-then-count with and without the verification cache"
+    )
+    parser.add_argument("--voters", type=int, default=20)
+    args = parser.parse_args()
+
+    for label, max_entries in [("no cache", 0), ("cache", DEFAULT_MAX_ENTRIES)]:
+        latencies, cache = run(args.voters, max_entries)
+        print(
+            "{0:<9} median {1:>7.1f} ms per flow  hit rate {2:>4.0%}  saved {3:>6.2f} s".format(
+                label,
+                statistics.median(latencies) * 1000,
+                cache.hit_rate,
+                cache.seconds_saved,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
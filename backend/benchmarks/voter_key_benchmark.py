@@ -0,0 +1,110 @@
+#
+# Measures the national id obfuscation saved by passing a VoterKey through a request, instead of obfuscating the raw
+# national id again in every store call.
+#
+# $ python -m benchmarks.voter_key_benchmark [--requests N]
+#
+
+import argparse
+import time
+
+import main.objects.voter as voter_module
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter, VoterKey
+from main.store.data_registry import VotingStore
+
+
+class CountingObfuscation:
+    """
+    Wraps obfuscate_national_id to count how many times it runs
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self._obfuscate = voter_module.obfuscate_national_id
+
+    def __call__(self, national_id: str) -> str:
+        self.calls += 1
+        return self._obfuscate(national_id)
+
+
+def national_ids(requests: int):
+    return [
+        "{0:03d}-{1:02d}-{2:04d}".format(i % 1000, i % 100, i) for i in range(requests)
+    ]
+
+
+def count_ballot_by_national_id(store: VotingStore, national_id: str, index: int):
+    # The store calls of a counted ballot, followed by a duplicate that is flagged as fraud
+    store.get_voter_by_national_id(national_id)
+    store.add_ballot(Ballot("by-id-{0}".format(index), "1", None), national_id)
+    store.get_voter_by_national_id(national_id)
+    store.fraud_voter(national_id)
+
+
+def count_ballot_by_key(store: VotingStore, national_id: str, index: int):
+    key = VoterKey(national_id)
+    store.get_voter_by_key(key)
+    store.add_ballot_by_key(Ballot("by-key-{0}".format(index), "1", None), key)
+    store.get_voter_by_key(key)
+    store.fraud_voter_by_key(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Obfuscation saved by VoterKey")
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    ids = national_ids(args.requests)
+    store = VotingStore.get_instance()
+    store.load_fixture(
+        ["Candidate"],
+        [
+            voter_module.MinimalVoter(
+                "", "", voter_module.obfuscate_national_id(i), False, False
+            )
+            for i in ids
+        ],
+    )
+
+    start = time.perf_counter()
+    for national_id in ids:
+        voter_module.obfuscate_national_id(national_id)
+    per_hash = (time.perf_counter() - start) / args.requests
+    print("obfuscate_national_id       {0:.2f} us".format(per_hash * 1e6))
+
+    counter = CountingObfuscation()
+    voter_module.obfuscate_national_id = counter
+    try:
+        for name, request in [
+            ("by national id", count_ballot_by_national_id),
+            ("by VoterKey", count_ballot_by_key),
+        ]:
+            counter.calls = 0
+            start = time.perf_counter()
+            for index, national_id in enumerate(ids):
+                request(store, national_id, index)
+            elapsed = time.perf_counter() - start
+            print(
+                "{0:<16} {1:.1f} hashes/request  {2:.2f} us/request".format(
+                    name, counter.calls / args.requests, elapsed / args.requests * 1e6
+                )
+            )
+    finally:
+        voter_module.obfuscate_national_id = counter._obfuscate
+
+    # Registration checks the status and then adds the voter, obfuscating the national id once per step without a key
+    voter = Voter("Adam", "Smith", "111111111")
+    counter = CountingObfuscation()
+    voter_module.obfuscate_national_id = counter
+    try:
+        key = VoterKey(voter.national_id)
+        store.get_voter_by_key(key)
+        store.add_voter(voter, key)
+        print("register_voter   {0} hash/request (was 2)".format(counter.calls))
+    finally:
+        voter_module.obfuscate_national_id = counter._obfuscate
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#
+# This file guards the admin endpoints (/api/admin/issuance_jobs, /api/admin/profile and /api/metrics). Each one is
+# tied to a token read from the environment: the endpoint only exists while its token is set, and only serves requests
+# carrying it as a bearer token. Tokens are compared in constant time.
+#
+
+import hmac
+import os
+from typing import Optional
+
+
+def enabled(token_env: str) -> bool:
+    """
+    :param: token_env The environment variable holding the endpoint's admin token
+    :returns: Boolean TRUE if the admin token is set, so the endpoint exists. Boolean FALSE otherwise.
+    """
+    return bool(os.getenv(token_env))
+
+
+def is_authorized(authorization: Optional[str], token_env: str) -> bool:
+    """
+    Checks an Authorization header against an admin token. Always False while the token isn't set.
+
+    :param: authorization The Authorization header of the request, if any
+    :param: token_env The environment variable holding the endpoint's admin token
+    """
+    token = os.getenv(token_env)
+    if not token or not authorization or not authorization.startswith("Bearer "):
+        return False
+
+    return hmac.compare_digest(
+        authorization[len("Bearer ") :].encode("utf-8"), token.encode("utf-8")
+    )
@@ -0,0 +1,243 @@
+#
+# This file is the admission control for the REST API. Each guarded endpoint has a bounded number of requests in
+# flight and a bounded queue in front of them; when the queue is full, requests are shed immediately with a 503 and a
+# Retry-After header instead of piling up behind the bcrypt-bound workers. Crypto-heavy endpoints are also rate limited
+# per client with a token bucket.
+#
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, Optional
+
+from . import metrics
+
+# Smoothing factor of the moving average of service times, used to estimate Retry-After
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is refused by admission control
+    """
+
+    def __init__(self, reason: str, retry_after_seconds: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class RateLimited(Overloaded):
+    """
+    Raised when a client has made more requests than its rate limit allows, as opposed to the server being overloaded
+    """
+
+    def __init__(self, retry_after_seconds: float):
+        super().__init__("rate limited", retry_after_seconds)
+
+
+class AdmissionController:
+    """
+    Limits the number of requests to an endpoint that run at once, with a bounded queue of waiting requests. Waiting
+    requests are admitted in the order they arrived: a request that finishes hands its slot straight to the oldest one.
+
+    >>> controller = AdmissionController("count_ballot", max_in_flight=4, max_queue=8)
+    >>> with controller.admit():   # raises Overloaded if the queue is full, or the wait times out
+    ...     ...
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout_seconds: float = 2.0,
+    ):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+
+        self.in_flight = 0
+        self._average_service_seconds = 0.0
+        self._lock = threading.Lock()
+        # An event per waiting request, oldest first, set when the request is handed a slot
+        self._waiters: deque = deque()
+
+        metrics.register_gauge(
+            "admission.{0}.in_flight".format(name), lambda: self.in_flight
+        )
+        metrics.register_gauge(
+            "admission.{0}.queue_depth".format(name), lambda: self.queue_depth
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def retry_after_seconds(self) -> float:
+        """
+        Estimates how long it will take for the current queue to drain
+        """
+        backlog = self.in_flight + self.queue_depth
+        return backlog * self._average_service_seconds / max(self.max_in_flight, 1)
+
+    def _shed(self, reason: str):
+        metrics.increment("admission.{0}.shed".format(self.name))
+        raise Overloaded(reason, self.retry_after_seconds())
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                waiter = None
+            else:
+                if len(self._waiters) >= self.max_queue:
+                    self._shed("queue full")
+                waiter = threading.Event()
+                self._waiters.append(waiter)
+
+        if waiter is not None and not waiter.wait(self.queue_timeout_seconds):
+            with self._lock:
+                # Unless the slot was handed over just as the wait timed out
+                if not waiter.is_set():
+                    self._waiters.remove(waiter)
+                    self._shed("timed out in queue")
+
+        metrics.increment("admission.{0}.admitted".format(self.name))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            service_seconds = time.perf_counter() - start
+            with self._lock:
+                self._average_service_seconds += SERVICE_TIME_SMOOTHING * (
+                    service_seconds - self._average_service_seconds
+                )
+                if self._waiters:
+                    # The slot goes to the oldest waiting request, so in_flight stays the same
+                    self._waiters.popleft().set()
+                else:
+                    self.in_flight -= 1
+
+
+class TokenBucketLimiter:
+    """
+    A per-client token bucket: each client may make burst requests at once, refilled at rate_per_second. Only the
+    max_clients most recently seen clients are tracked.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_second: float,
+        burst: int,
+        max_clients: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        # client id -> (tokens, last refill time)
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client_id: str):
+        """
+        Takes a token for the client.
+
+        :raises: RateLimited if the client has no tokens left
+        """
+        now = self._clock()
+        with self._lock:
+            tokens, last_refill = self._buckets.pop(client_id, (self.burst, now))
+            tokens = min(
+                self.burst, tokens + (now - last_refill) * self.rate_per_second
+            )
+            if tokens >= 1:
+                self._buckets[client_id] = (tokens - 1, now)
+            else:
+                self._buckets[client_id] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        if tokens < 1:
+            metrics.increment("admission.{0}.rate_limited".format(self.name))
+            raise RateLimited((1 - tokens) / max(self.rate_per_second, 1e-9))
+
+
+def admission_controlled(
+    controller: AdmissionController,
+    limiter: Optional[TokenBucketLimiter] = None,
+    client_id: Callable[[], str] = lambda: "",
+):
+    """
+    Decorates a view so that it goes through admission control. Refused requests get a 503 (or a 429 when the client is
+    rate limited) with a Retry-After header, without running the view.
+
+    :param: controller The admission controller of the endpoint
+    :param: limiter An optional per-client rate limiter
+    :param: client_id Returns the id of the client making the current request
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def guarded(*args, **kwargs):
+            try:
+                if limiter is not None:
+                    limiter.acquire(client_id())
+                with controller.admit():
+                    return view(*args, **kwargs)
+            except Overloaded as overloaded:
+                status_code = 429 if isinstance(overloaded, RateLimited) else 503
+                return (
+                    {"status": overloaded.reason},
+                    status_code,
+                    {
+                        "Retry-After": str(
+                            max(1, math.ceil(overloaded.retry_after_seconds))
+                        )
+                    },
+                )
+
+        return guarded
+
+    return decorator
+
+
+def controller_from_env(
+    name: str, default_max_in_flight: int, default_max_queue: int
+) -> AdmissionController:
+    """
+    Builds the admission controller of an endpoint, with limits overridable by <NAME>_MAX_IN_FLIGHT,
+    <NAME>_MAX_QUEUE and <NAME>_QUEUE_TIMEOUT_SECONDS environment variables.
+    """
+    prefix = name.upper()
+    return AdmissionController(
+        name,
+        int(os.getenv(prefix + "_MAX_IN_FLIGHT", default_max_in_flight)),
+        int(os.getenv(prefix + "_MAX_QUEUE", default_max_queue)),
+        float(os.getenv(prefix + "_QUEUE_TIMEOUT_SECONDS", 2.0)),
+    )
+
+
+def limiter_from_env(
+    name: str, default_rate_per_second: float, default_burst: int
+) -> TokenBucketLimiter:
+    """
+    Builds the per-client rate limiter of an endpoint, overridable by <NAME>_RATE_PER_CLIENT and <NAME>_BURST_PER_CLIENT
+    environment variables.
+    """
+    prefix = name.upper()
+    return TokenBucketLimiter(
+        name,
+        float(os.getenv(prefix + "_RATE_PER_CLIENT", default_rate_per_second)),
+        int(os.getenv(prefix + "_BURST_PER_CLIENT", default_burst)),
+    )
@@ -8,14 +8,39 @@
 # $ flask run
 #
 
-import jsons
-from flask import request
+import os
+import threading
+
+from flask import Response, request
 from flask_api import FlaskAPI, status
 from flask_cors import CORS
 
+from ..crypto.executor import CryptoExecutor, CryptoQueueFull
+from ..detection.redaction_pipeline import (
+    MAX_REDACTION_FAILURES,
+    CommentRedactionPool,
+)
 from ..objects.ballot import Ballot
-from ..objects.voter import BallotStatus, Voter
-from . import balloting, registry
+from ..objects.voter import BallotStatus
+from ..store import fixtures, reencryption
+from ..store.data_registry import VotingStore
+from . import (
+    admin_auth,
+    balloting,
+    idempotency,
+    issuance_jobs,
+    metrics,
+    profiling,
+    registry,
+    results_feed,
+    serialization,
+)
+from .admission import admission_controlled, controller_from_env, limiter_from_env
+
+SEED_ENV = "VOTING_STORE_SEED"
+SEED_FIXTURE = "fixture"
+SEED_POPULATE = "populate"
+SEED_NONE = "none"
 
 app = FlaskAPI(__name__)
 CORS(
@@ -23,6 +48,72 @@ CORS(
     resources={r"/api/*": {"origins": ["http://localhost:*", "http://127.0.0.1:*"]}},
 )
 
+_seed_lock = threading.Lock()
+_database_seeded = False
+# Started once the store is seeded, if a name encryption key rotation is under way
+_name_reencryption_job = None
+
+# count_ballot is bcrypt-bound, so it gets about one request in flight per core and a short queue
+_cpu_count = os.cpu_count() or 1
+count_ballot_admission = controller_from_env("count_ballot", _cpu_count, 4 * _cpu_count)
+count_ballot_rate_limit = limiter_from_env("count_ballot", 5.0, 20)
+get_all_candidates_admission = controller_from_env("get_all_candidates", 64, 256)
+search_ballot_comments_admission = controller_from_env("search_ballot_comments", 16, 64)
+# Clients refused because the crypto executor's queue is full are asked to come back after this long
+CRYPTO_QUEUE_FULL_RETRY_AFTER_SECONDS = 1
+# Retries of count_ballot with the same Idempotency-Key get the first attempt's status back
+count_ballot_idempotency = idempotency.cache_from_env("count_ballot", 100_000, 3600.0)
+
+# Read without CryptoExecutor.get_instance, which would start the worker pool
+metrics.register_gauge(
+    "crypto.queue_depth",
+    lambda: getattr(CryptoExecutor.crypto_executor_instance, "queue_depth", None),
+)
+metrics.register_gauge(
+    "crypto.busy_workers",
+    lambda: getattr(CryptoExecutor.crypto_executor_instance, "busy_workers", None),
+)
+metrics.register_gauge(
+    "comment_redaction.backlog",
+    lambda: VotingStore.get_instance().count_quarantined_comments(),
+)
+metrics.register_gauge(
+    "comment_redaction.set_aside",
+    lambda: VotingStore.get_instance().count_set_aside_comments(MAX_REDACTION_FAILURES),
+)
+metrics.register_gauge(
+    "comment_redaction.redacted",
+    lambda: getattr(
+        CommentRedactionPool.comment_redaction_pool_instance, "redacted", None
+    ),
+)
+metrics.register_gauge(
+    "comment_redaction.failed",
+    lambda: getattr(
+        CommentRedactionPool.comment_redaction_pool_instance, "failed", None
+    ),
+)
+metrics.register_gauge(
+    "keyring.names_reencrypted",
+    lambda: _name_reencryption_job.reencrypted if _name_reencryption_job else 0,
+)
+
+
+def client_address() -> str:
+    return request.remote_addr or ""
+
+
+@app.errorhandler(CryptoQueueFull)
+def crypto_queue_full(error: CryptoQueueFull):
+    """
+    Sheds requests that find the crypto executor's queue full, the way admission control does
+    """
+    return (
+        {"status": str(error)},
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(CRYPTO_QUEUE_FULL_RETRY_AFTER_SECONDS)},
+    )
+
 
 @app.route("/")
 def ping():
@@ -30,6 +121,7 @@ def ping():
 
 
 @app.route("/api/count_ballot", methods=["POST"])
+@admission_controlled(count_ballot_admission, count_ballot_rate_limit, client_address)
 def count_ballot():
     req_data = request.get_json()
     ballot_number = req_data["ballot_number"]
@@ -38,20 +130,212 @@ def count_ballot():
     voter_national_id = req_data["voter_national_id"]
 
     ballot = Ballot(ballot_number, chosen_candidate_id, voter_comments)
-    result = balloting.count_ballot(ballot, voter_national_id)
-    return (
-        {"status": jsons.dumps(result.value)},
+    try:
+        version = serialization.requested_version(
+            request.headers.get(serialization.API_VERSION_HEADER)
+        )
+        idempotency_key = idempotency.validate_key(
+            request.headers.get(idempotency.IDEMPOTENCY_KEY_HEADER)
+        )
+        if idempotency_key is None:
+            result, replayed = balloting.count_ballot(ballot, voter_national_id), False
+        else:
+            fingerprint = idempotency.fingerprint(
+                ballot_number,
+                chosen_candidate_id,
+                voter_comments,
+                voter_national_id,
+            )
+            result, replayed = count_ballot_idempotency.run(
+                idempotency_key,
+                fingerprint,
+                lambda: balloting.count_ballot(
+                    ballot,
+                    voter_national_id,
+                    count_ballot_idempotency.shared_record(
+                        idempotency_key, fingerprint
+                    ),
+                ),
+            )
+    except ValueError as error:
+        return {"status": str(error)}, status.HTTP_400_BAD_REQUEST
+    except idempotency.IdempotencyKeyReused as error:
+        return {"status": str(error)}, 422
+
+    return serialization.ballot_status_response(
+        result,
+        version,
         (
             status.HTTP_202_ACCEPTED
             if result == BallotStatus.BALLOT_COUNTED
             else status.HTTP_409_CONFLICT
         ),
+        {"Idempotent-Replayed": "true"} if replayed else None,
     )
 
 
 @app.route("/api/get_all_candidates")
+@admission_controlled(get_all_candidates_admission)
 def get_all_candidates():
-    return jsons.dumps(registry.get_all_candidates())
+    try:
+        version = serialization.requested_version(
+            request.headers.get(serialization.API_VERSION_HEADER)
+        )
+    except ValueError as error:
+        return {"status": str(error)}, status.HTTP_400_BAD_REQUEST
+
+    return serialization.candidates_response(registry.get_all_candidates(), version)
+
+
+@app.route("/api/ballot_comments/search")
+@admission_controlled(search_ballot_comments_admission)
+def search_ballot_comments():
+    """
+    Searches the redacted ballot comments. Takes the query in q, and optionally limit and the cursor of the previous
+    page.
+    """
+    try:
+        page = balloting.search_ballot_comments(
+            request.args.get("q", ""),
+            int(request.args.get("limit", balloting.DEFAULT_SEARCH_LIMIT)),
+            request.args.get("cursor"),
+        )
+    except ValueError as error:
+        return {"error": str(error)}, status.HTTP_400_BAD_REQUEST
+
+    return {"comments": page.comments, "next_cursor": page.next_cursor}
+
+
+@app.route("/api/admin/issuance_jobs", methods=["POST"])
+def submit_issuance_job():
+    """
+    Submits a job issuing a ballot to the voter with the national_id given as JSON, and returns its job_id right away.
+    Only exists if ISSUANCE_ADMIN_TOKEN is set, and requires it as a bearer token.
+    """
+    if not admin_auth.enabled(issuance_jobs.ISSUANCE_ADMIN_TOKEN):
+        return {"error": "Not found"}, status.HTTP_404_NOT_FOUND
+    if not admin_auth.is_authorized(
+        request.headers.get("Authorization"), issuance_jobs.ISSUANCE_ADMIN_TOKEN
+    ):
+        return {"error": "Unauthorized"}, status.HTTP_401_UNAUTHORIZED
+
+    req_data = request.get_json(silent=True) or {}
+    if not isinstance(req_data.get("national_id"), str):
+        return {"error": "national_id is required"}, status.HTTP_400_BAD_REQUEST
+    try:
+        job_id = issuance_jobs.IssuanceJobs.get_instance().submit(
+            req_data["national_id"]
+        )
+    except issuance_jobs.IssuanceQueueFull as error:
+        return {"error": str(error)}, status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return {"job_id": job_id}, status.HTTP_202_ACCEPTED
+
+
+@app.route("/api/admin/issuance_jobs/<job_id>")
+def poll_issuance_job(job_id: str):
+    """
+    Gets the status of an issuance job, and its ballot_number once issued. Waits up to wait seconds for a pending job to
+    finish. The ballot_number is only returned once; later polls get the "collected" status.
+    """
+    if not admin_auth.enabled(issuance_jobs.ISSUANCE_ADMIN_TOKEN):
+        return {"error": "Not found"}, status.HTTP_404_NOT_FOUND
+    if not admin_auth.is_authorized(
+        request.headers.get("Authorization"), issuance_jobs.ISSUANCE_ADMIN_TOKEN
+    ):
+        return {"error": "Unauthorized"}, status.HTTP_401_UNAUTHORIZED
+
+    try:
+        wait_seconds = float(request.args.get("wait", 0))
+    except ValueError as error:
+        return {"error": str(error)}, status.HTTP_400_BAD_REQUEST
+    result = issuance_jobs.IssuanceJobs.get_instance().poll(job_id, wait_seconds)
+    if result is None:
+        return {"error": "No such job"}, status.HTTP_404_NOT_FOUND
+
+    return {"status": result.status.value, "ballot_number": result.ballot_number}
+
+
+@app.route("/api/turnout")
+def get_turnout():
+    """
+    Gets the turnout counts, and the ballots cast in each of the last minutes (60 by default, or minutes)
+    """
+    try:
+        turnout = balloting.get_turnout(
+            int(request.args.get("minutes", balloting.DEFAULT_TURNOUT_MINUTES))
+        )
+    except ValueError as error:
+        return {"error": str(error)}, status.HTTP_400_BAD_REQUEST
+
+    return {
+        "registered": turnout.registered,
+        "voted": turnout.voted,
+        "fraud_flagged": turnout.fraud_flagged,
+        "ballots_per_minute": [
+            {"minute": minute, "ballots": ballots}
+            for minute, ballots in turnout.ballots_per_minute
+        ],
+    }
+
+
+@app.route("/api/metrics")
+def get_metrics():
+    """
+    Gets the current value of every counter and gauge. Only exists if METRICS_ADMIN_TOKEN is set, and requires it as a
+    bearer token.
+    """
+    if not admin_auth.enabled(metrics.METRICS_ADMIN_TOKEN):
+        return {"error": "Not found"}, status.HTTP_404_NOT_FOUND
+    if not admin_auth.is_authorized(
+        request.headers.get("Authorization"), metrics.METRICS_ADMIN_TOKEN
+    ):
+        return {"error": "Unauthorized"}, status.HTTP_401_UNAUTHORIZED
+
+    return metrics.snapshot()
+
+
+@app.route("/api/admin/profile", methods=["POST"])
+def profile():
+    """
+    Profiles the server for a number of seconds, and returns the summary of the capture. Takes seconds, mode and memory
+    as JSON. Only exists if PROFILING_ADMIN_TOKEN is set, and requires it as a bearer token.
+    """
+    if not admin_auth.enabled(profiling.PROFILING_ADMIN_TOKEN):
+        return {"error": "Not found"}, status.HTTP_404_NOT_FOUND
+    if not admin_auth.is_authorized(
+        request.headers.get("Authorization"), profiling.PROFILING_ADMIN_TOKEN
+    ):
+        return {"error": "Unauthorized"}, status.HTTP_401_UNAUTHORIZED
+
+    req_data = request.get_json(silent=True) or {}
+    try:
+        return profiling.capture(
+            app,
+            float(req_data.get("seconds", 10)),
+            req_data.get("mode", profiling.SAMPLING),
+            bool(req_data.get("memory", False)),
+        )
+    except ValueError as error:
+        return {"error": str(error)}, status.HTTP_400_BAD_REQUEST
+    except profiling.CaptureInProgress as error:
+        return {"error": str(error)}, status.HTTP_409_CONFLICT
+
+
+@app.route("/api/results/stream")
+def stream_results():
+    """
+    Streams per-candidate tally deltas and turnout as Server-Sent Events. Reconnecting clients resume from the
+    Last-Event-ID header (or the last_event_id query parameter).
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+        "last_event_id"
+    )
+    return Response(
+        results_feed.stream_results(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 def populate_database():
@@ -59,28 +343,17 @@ def populate_database():
     This method is for you as a developer. This is where you can add more candidates for the election,
     register voters for the election and issue ballots. This method is strictly for your convenience, and
     is not part of the rubric for the final project.
+
+    This goes through the registry API one voter at a time, so it is slow. By default the server loads the pre-serialized
+    seed in main/store/seed.json instead; set VOTING_STORE_SEED=populate to use this method.
     """
 
     # Adding Candidates for the election. These should be reflected in the frontend.
-    registry.register_candidate("Joseph Klimek")
-    registry.register_candidate("Rose Hervey")
-    registry.register_candidate("Yeong Qi")
-    registry.register_candidate("Karthik Banerjee")
-    registry.register_candidate("Courtney Yu")
-    registry.register_candidate("Hugo Jennings")
-    registry.register_candidate("Maia Kift")
-    registry.register_candidate("Arnav Arora")
+    for candidate_name in fixtures.DEFAULT_CANDIDATE_NAMES:
+        registry.register_candidate(candidate_name)
 
     # TODO: Feel free to add voters to the voter registry, and issue ballots
-    all_voters = [
-        Voter("Adam", "Smith", "111111111"),
-        Voter("Thien", "Huynh", "222222222"),
-        Voter("Neel", "Banerjee", "333333333"),
-        Voter("Linda", "Qi", "444444444"),
-        Voter("Shoujit", "Gande", "555555555"),
-    ]
-
-    for voter in all_voters:
+    for voter in fixtures.DEFAULT_VOTERS:
         registry.register_voter(voter)
         print(
             "Voter {0} Ballot Number: {1}".format(
@@ -89,4 +362,65 @@ def populate_database():
         )
 
 
-populate_database()
+def seed_database(seed: str):
+    """
+    Seeds the store according to the VOTING_STORE_SEED setting:
+
+    1. "fixture" (the default) - bulk loads the bundled pre-serialized seed
+    2. "populate" - runs populate_database() above
+    3. "none" - leaves the store empty
+    4. Anything else is treated as the path to a seed file written by main.store.fixtures
+    """
+    if seed == SEED_NONE:
+        return
+    if seed == SEED_POPULATE:
+        populate_database()
+        return
+
+    path = fixtures.DEFAULT_SEED_PATH if seed == SEED_FIXTURE else seed
+    for voter_national_id, ballot_number in fixtures.load_seed(path):
+        print("Voter {0} Ballot Number: {1}".format(voter_national_id, ballot_number))
+
+
+def seed_database_once():
+    """
+    Seeds the store, once per process. Starts no background work, so that the prefork master can seed before it forks.
+    """
+    global _database_seeded
+    if _database_seeded:
+        return
+
+    with _seed_lock:
+        if not _database_seeded:
+            # A shared store outlives this process, and may already have been seeded by an earlier run
+            store = VotingStore.get_instance()
+            if not (store.is_shared() and store.get_all_candidates()):
+                seed_database(os.getenv(SEED_ENV, SEED_FIXTURE))
+            _database_seeded = True
+
+
+def start_background_work(reencrypt_names: bool = True):
+    """
+    Starts the comment redaction pool and, if a name encryption key rotation is under way, the name re-encryption job.
+    Threads don't survive a fork, so the prefork server calls this in each worker once it has forked.
+
+    :param: reencrypt_names Whether this process runs the name re-encryption job. Behind the prefork server, only one
+            worker does.
+    """
+    global _name_reencryption_job
+    with _seed_lock:
+        if reencrypt_names and _name_reencryption_job is None:
+            _name_reencryption_job = reencryption.start_if_rotated()
+        CommentRedactionPool.get_instance().start()
+
+
+@app.before_request
+def seed_database_on_first_request():
+    """
+    Seeds the store lazily, so that importing this module (and booting a worker) does no work
+    """
+    if _database_seeded:
+        return
+
+    seed_database_once()
+    start_background_work()
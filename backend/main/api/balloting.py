@@ -1,32 +1,66 @@
-from typing import Optional, Set
-
-import bcrypt
-
+import binascii
+import re
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Dict, Optional, Set, Tuple
+
+from ..crypto import executor, primitives
+from ..crypto.executor import Priority
 from ..detection.pii_detection import redact_free_text
-from ..objects.ballot import Ballot, generate_ballot_number
+from ..detection.redaction_pipeline import CommentRedactionPool, quarantine_comment
+from ..objects.ballot import Ballot, BallotCommentPage, generate_ballot_number
 from ..objects.candidate import Candidate
-from ..objects.voter import BallotStatus, VoterStatus, decrypt_name
-from ..store.data_registry import VotingStore
-from .registry import get_voter_status
+from ..objects.tally import CountingRule, ElectionTally, Turnout
+from ..objects.voter import BallotStatus, VoterKey, VoterStatus, decrypt_name
+from ..store import audit_log, tally_engine
+from ..store.data_registry import (
+    TURNOUT_SERIES_MINUTES,
+    IdempotencyRecord,
+    VotingStore,
+)
+from ..store.tally_engine import compute_tally
+from .idempotency import IdempotencyKeyReused, IdempotentReplay
+from .registry import get_voter_status_by_key
+from .verification_cache import VerificationCache
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+DEFAULT_TURNOUT_MINUTES = 60
 
 
 def issue_ballot(voter_national_id: str) -> Optional[str]:
     """
     Issues a new ballot to a given voter. The ballot number of the new ballot. This method should NOT invalidate any old
-    ballots. If the voter isn't registered, should return None.
+    ballots. If the voter isn't registered, should return None. Blocks until the ballot number is hashed; see
+    main/api/issuance_jobs.py to issue ballots without blocking.
 
     :params: voter_national_id The sensitive ID of the voter to issue a new ballot to.
     :returns: The ballot number of the new ballot, or None if the voter isn't registered
     """
-    # TODO: Implement this!
-    status = get_voter_status(voter_national_id)
+    return issue_ballot_by_key(VoterKey(voter_national_id))
+
+
+def issue_ballot_by_key(key: VoterKey) -> Optional[str]:
+    """
+    Issues a new ballot to the voter with the key specified. See issue_ballot above.
+
+    :params: key The key of the voter to issue a new ballot to.
+    :returns: The ballot number of the new ballot, or None if the voter isn't registered
+    """
+    status = get_voter_status_by_key(key)
     if status == VoterStatus.NOT_REGISTERED:
         return None
 
-    return generate_ballot_number(voter_national_id)
+    ballot_number = generate_ballot_number(key.national_id)
+    audit_log.record_ballot_issued(key)
+    return ballot_number
 
 
-def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
+def count_ballot(
+    ballot: Ballot,
+    voter_national_id: str,
+    idempotency_record: Optional[IdempotencyRecord] = None,
+) -> BallotStatus:
     """
     Validates and counts the ballot for the given voter. If the ballot contains a sensitive comment, this method will
     appropriately redact the sensitive comment.
@@ -37,25 +71,52 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     3. BallotStatus.INVALID_BALLOT - The ballot has been invalidated, or does not exist
     4. BallotStatus.BALLOT_COUNTED - If the ballot submitted in this request was successfully counted
     5. BallotStatus.VOTER_NOT_REGISTERED - If the voter is not registered
+    6. BallotStatus.INVALID_CANDIDATE - If the chosen candidate is not registered
 
     :param: ballot The Ballot to count
     :param: voter_national_id The sensitive ID of the voter who the ballot corresponds to.
+    :param: idempotency_record The idempotency key of the request, claimed in the store once the ballot is counted
     :returns: The Ballot Status after the ballot has been processed.
+    :raises: IdempotentReplay if a request with the same idempotency key already counted the ballot
+    :raises: IdempotencyKeyReused if the idempotency key was already used with a different request
     """
+    return count_ballot_by_key(ballot, VoterKey(voter_national_id), idempotency_record)
 
+
+def count_ballot_by_key(
+    ballot: Ballot,
+    key: VoterKey,
+    idempotency_record: Optional[IdempotencyRecord] = None,
+) -> BallotStatus:
+    """
+    Validates and counts the ballot for the voter with the key specified. See count_ballot above.
+
+    :param: ballot The Ballot to count
+    :param: key The key of the voter who the ballot corresponds to.
+    :param: idempotency_record The idempotency key of the request, claimed in the store once the ballot is counted
+    :returns: The Ballot Status after the ballot has been processed.
+    """
     store = VotingStore.get_instance()
+    _replay_if_recorded(store, idempotency_record)
 
-    voter = store.get_voter_by_national_id(voter_national_id)
+    voter = store.get_voter_by_key(key)
     if voter is None:
         return BallotStatus.VOTER_NOT_REGISTERED
     if voter.voted == True:
-        store.fraud_voter(voter_national_id)
+        # A retry of this request may have counted the ballot since
+        _replay_if_recorded(store, idempotency_record)
+        store.fraud_voter_by_key(key)
+        audit_log.record_fraud_flagged(key)
         return BallotStatus.FRAUD_COMMITTED
-
-    ballot_check = bcrypt.checkpw(
-        voter_national_id.encode("utf-8"), ballot.ballot_number.encode("utf-8")
-    )
-    if not ballot_check:
+    # Checked against the in-memory candidate index, so bogus candidates are turned away before any bcrypt work
+    if not store.is_candidate_registered(ballot.chosen_candidate_id):
+        return BallotStatus.INVALID_CANDIDATE
+
+    # verify_ballot has usually just made the same bcrypt check
+    verification_cache = VerificationCache.get_instance()
+    if not verification_cache.is_verified(
+        key.national_id, ballot.ballot_number
+    ) and not _check_ballot_ownership(key.national_id, ballot.ballot_number):
         return BallotStatus.VOTER_BALLOT_MISMATCH
 
     store = VotingStore.get_instance()
@@ -63,11 +124,59 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     if not ballot_check:
         return BallotStatus.INVALID_BALLOT
 
-    ballot.voter_comments = redact_free_text(ballot.voter_comments, voter)
-    store.add_ballot(ballot, voter_national_id)
+    redaction_pool = CommentRedactionPool.get_instance()
+    quarantined_comment = None
+    if redaction_pool.enabled and ballot.voter_comments:
+        # The comment is redacted in the background, and stays out of sight until then
+        quarantined_comment = quarantine_comment(ballot.voter_comments, voter)
+        ballot.voter_comments = None
+    else:
+        ballot.voter_comments = redact_free_text(ballot.voter_comments, voter)
+    # The voter may have voted, or been de-registered, since they were read above - possibly by another process sharing
+    # the store - so the ballot is only added if the voter still hasn't voted
+    if idempotency_record is not None:
+        idempotency_record = idempotency_record._replace(
+            status=BallotStatus.BALLOT_COUNTED.name
+        )
+    if not store.cast_ballot_by_key(
+        ballot, key, quarantined_comment, idempotency_record
+    ):
+        _replay_if_recorded(store, idempotency_record)
+        if store.get_voter_by_key(key) is None:
+            return BallotStatus.VOTER_NOT_REGISTERED
+        store.fraud_voter_by_key(key)
+        audit_log.record_fraud_flagged(key)
+        return BallotStatus.FRAUD_COMMITTED
+    verification_cache.evict(ballot.ballot_number)
+    if quarantined_comment is not None:
+        redaction_pool.notify()
+    audit_log.record_ballot_counted(ballot.ballot_number, ballot.chosen_candidate_id)
     return BallotStatus.BALLOT_COUNTED
 
 
+def _replay_if_recorded(
+    store: VotingStore, idempotency_record: Optional[IdempotencyRecord]
+):
+    """
+    Checks whether a request with the same idempotency key already ran, possibly on another process sharing the store
+
+    :raises: IdempotentReplay with the status of that request
+    :raises: IdempotencyKeyReused if the key was used with a different request
+    """
+    if idempotency_record is None:
+        return
+    record = store.get_idempotency_record(
+        idempotency_record.endpoint, idempotency_record.idempotency_key
+    )
+    if record is None:
+        return
+    if record.fingerprint != idempotency_record.fingerprint:
+        raise IdempotencyKeyReused(
+            "The idempotency key was already used with a different request"
+        )
+    raise IdempotentReplay(BallotStatus[record.status])
+
+
 def invalidate_ballot(ballot_number: str) -> bool:
     """
     Marks a ballot as invalid so that it cannot be used. This should only work on ballots that have NOT been cast. If a
@@ -84,6 +193,8 @@ def invalidate_ballot(ballot_number: str) -> bool:
         return False
 
     store.invalidate_ballot(ballot_number)
+    audit_log.record_ballot_invalidated(ballot_number)
+    VerificationCache.get_instance().evict(ballot_number)
     return True
 
 
@@ -101,10 +212,7 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
     :returns: Boolean True if the ballot was issued to the voter specified, and if the ballot has not been marked as
               invalid. Boolean False otherwise.
     """
-    ballot_check = bcrypt.checkpw(
-        voter_national_id.encode("utf-8"), ballot_number.encode("utf-8")
-    )
-    if not ballot_check:
+    if not _check_ballot_ownership(voter_national_id, ballot_number):
         return False
 
     store = VotingStore.get_instance()
@@ -115,6 +223,24 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
     return True
 
 
+def _check_ballot_ownership(voter_national_id: str, ballot_number: str) -> bool:
+    """
+    Checks with bcrypt that the ballot was issued to the voter, and if it was, remembers it in the verification cache
+    """
+    start = time.perf_counter()
+    ballot_check = executor.run(
+        Priority.CASTING,
+        primitives.bcrypt_check,
+        voter_national_id.encode("utf-8"),
+        ballot_number.encode("utf-8"),
+    )
+    if ballot_check:
+        VerificationCache.get_instance().record_check(
+            voter_national_id, ballot_number, time.perf_counter() - start
+        )
+    return ballot_check
+
+
 #
 # Aggregate API
 #
@@ -122,21 +248,140 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
 
 def get_all_ballot_comments() -> Set[str]:
     """
-    Returns a list of all the ballot comments that are non-empty.
+    Returns a list of all the ballot comments that are non-empty. Comments still waiting to be redacted in the
+    background aren't included.
     :returns: A list of all the ballot comments that are non-empty
     """
     # TODO: Implement this!
     store = VotingStore.get_instance()
-    return store.get_all_non_empty_ballot_comments()
+    return set(store.iter_non_empty_ballot_comments())
+
+
+def search_ballot_comments(
+    query: str, limit: int = DEFAULT_SEARCH_LIMIT, cursor: Optional[str] = None
+) -> BallotCommentPage:
+    """
+    Searches the (redacted) ballot comments for keywords, through a full-text index. Every word of the query must
+    appear in a comment for it to match, and words in double quotes must appear as a phrase, e.g. `"long line" booth`.
+    Words are matched by their stem, so "lines" matches "line". Comments are ranked by relevance.
+
+    :param: query The keywords to search for
+    :param: limit The maximum number of comments to return, at most MAX_SEARCH_LIMIT
+    :param: cursor The next_cursor of the previous page, to get the page after it
+    :returns: A page of matching comments, best matches first
+    :raises: ValueError if the cursor is malformed
+    """
+    fts_query = _fts5_query(query)
+    if not fts_query:
+        return BallotCommentPage([], None)
+
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    store = VotingStore.get_instance()
+    # One extra result tells whether there is a next page
+    results = store.search_ballot_comments(
+        fts_query, limit + 1, _decode_search_cursor(cursor) if cursor else None
+    )
+    next_cursor = (
+        _encode_search_cursor(results[limit - 1][0], results[limit - 1][1])
+        if len(results) > limit
+        else None
+    )
+    return BallotCommentPage(
+        [comment for _, _, comment in results[:limit]], next_cursor
+    )
+
+
+def _fts5_query(query: str) -> str:
+    """
+    Turns user input into an FTS5 query that can't be a syntax error: every word and every double-quoted phrase becomes
+    a quoted string, and the strings are ANDed
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\w+)', query):
+        words = re.findall(r"\w+", phrase or word)
+        if words:
+            terms.append('"{0}"'.format(" ".join(words)))
+    return " ".join(terms)
+
+
+def _encode_search_cursor(rank: float, rowid: int) -> str:
+    return urlsafe_b64encode("{0!r}:{1}".format(rank, rowid).encode("utf-8")).decode(
+        "utf-8"
+    )
+
+
+def _decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, rowid = (
+            urlsafe_b64decode(cursor.encode("utf-8")).decode("utf-8").split(":")
+        )
+        return float(rank), int(rowid)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Malformed search cursor")
 
 
 def compute_election_winner() -> Candidate:
     """
     Computes the winner of the election - the candidate that gets the most votes (even if there is not a majority).
+    Ties are broken by the lowest candidate id; use compute_election_tally to see them.
     :return: The winning Candidate
     """
+    winner = compute_election_tally().winner(CountingRule.PLURALITY)
+    if winner is None:
+        raise ValueError("No ballots have been counted")
+
+    return winner
+
+
+def compute_election_tally() -> ElectionTally:
+    """
+    Computes the per-candidate counts of the election, with vote shares, rankings and tie reporting.
+    :return: The ElectionTally of every ballot counted so far
+    """
+    return compute_tally()
+
+
+def compute_precinct_tallies() -> Dict[str, ElectionTally]:
+    """
+    Computes the per-candidate counts of each precinct. See main/store/precincts.py to merge precincts counted on
+    separate machines.
+    :return: The ElectionTally of every ballot counted so far, by precinct
+    """
+    return tally_engine.compute_precinct_tallies()
+
+
+def get_turnout(
+    minutes: int = DEFAULT_TURNOUT_MINUTES, now: Optional[float] = None
+) -> Turnout:
+    """
+    Gets the number of registered voters, of those who voted and of those flagged for fraud, and the ballots cast in
+    each of the last minutes. Reads counters the store keeps up to date, so the cost doesn't grow with the number of
+    voters.
+
+    :param: minutes The number of minutes of the series, up to TURNOUT_SERIES_MINUTES, ending with the current one
+    :param: now The current time, in seconds since the Unix epoch
+    :returns: The Turnout
+    :raises: ValueError if minutes is out of range
+    """
+    if not 1 <= minutes <= TURNOUT_SERIES_MINUTES:
+        raise ValueError(
+            "minutes must be between 1 and {0}".format(TURNOUT_SERIES_MINUTES)
+        )
+    current_minute = int(time.time() if now is None else now) // 60
+    first_minute = current_minute - minutes + 1
     store = VotingStore.get_instance()
-    return store.get_top_candidate()
+    registered, voted, fraud_flagged = store.get_turnout()
+    ballots_by_minute = store.get_ballots_cast_by_minute(first_minute)
+
+    return Turnout(
+        registered,
+        voted,
+        fraud_flagged,
+        [
+            (minute * 60, ballots_by_minute.get(minute, 0))
+            for minute in range(first_minute, current_minute + 1)
+        ],
+    )
 
 
 def get_all_fraudulent_voters() -> Set[str]:
@@ -150,12 +395,7 @@ def get_all_fraudulent_voters() -> Set[str]:
     """
     # TODO: Implement this!
     store = VotingStore.get_instance()
-    fraud_voters = store.get_fraud_voters()
-    result = set()
-
-    for voter in fraud_voters:
-        first_name = decrypt_name(voter.first_name)
-        last_name = decrypt_name(voter.last_name)
-        result.add(first_name + " " + last_name)
-
-    return result
+    return {
+        decrypt_name(voter.first_name) + " " + decrypt_name(voter.last_name)
+        for voter in store.iter_fraud_voters()
+    }
@@ -0,0 +1,223 @@
+#
+# This file lets clients retry requests safely. A client sends the same Idempotency-Key header with every attempt of one
+# request, and the first attempt's result is kept for a while in a bounded, expiring in-memory cache. Retries get that
+# result back without running the request again. Concurrent duplicates wait for the first attempt to finish, rather than
+# running alongside it. An attempt that raises isn't cached, so the next retry runs the request again.
+#
+# The cache is per process, and is only a front: requests that change the store also claim their idempotency key in the
+# shared store, in the same transaction as the change (see IdempotencyRecord in main/store/data_registry.py). Behind the
+# pre-fork server (main/api/prefork.py), a retry that reaches another worker finds the claim, and raises IdempotentReplay
+# with the first attempt's result rather than running again.
+#
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from ..store.data_registry import IdempotencyRecord
+from ..store.keyring import Keyring
+from . import metrics
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# Keys the fingerprints of requests, which are kept in the shared store and cover national ids
+IDEMPOTENCY_FINGERPRINT_KEY_HMAC = "IDEMPOTENCY_FINGERPRINT_KEY_HMAC"
+FINGERPRINT_KEY_BYTES = 32
+
+# Every cache, so that a forked child can reset them
+_caches: "weakref.WeakSet[IdempotencyCache]" = weakref.WeakSet()
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Raised when an idempotency key is sent again with a different request
+    """
+
+
+class IdempotentReplay(Exception):
+    """
+    Raised by a request that finds it already ran, e.g. on another process sharing the store. The cache returns result
+    as replayed.
+    """
+
+    def __init__(self, result: Any):
+        super().__init__(result)
+        self.result = result
+
+
+class _Attempt:
+    """
+    The first attempt of a request, and once it has finished, its result
+    """
+
+    __slots__ = ("fingerprint", "expires_at", "finished", "failed", "result")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.finished = threading.Event()
+        self.failed = False
+        self.result = None
+
+
+class IdempotencyCache:
+    """
+    The results of recent requests, by idempotency key. Holds at most max_entries results, each for ttl_seconds.
+
+    >>> cache = IdempotencyCache("count_ballot", max_entries=100_000, ttl_seconds=3600)
+    >>> result, replayed = cache.run(key, fingerprint, lambda: count_ballot(...))
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # idempotency key -> attempt, oldest first
+        self._attempts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+        metrics.register_gauge(
+            "idempotency.{0}.entries".format(name), lambda: len(self._attempts)
+        )
+
+    def _evict(self, now: float):
+        while self._attempts:
+            _, oldest = next(iter(self._attempts.items()))
+            if oldest.expires_at > now and len(self._attempts) <= self.max_entries:
+                break
+            self._attempts.popitem(last=False)
+
+    def shared_record(self, key: str, fingerprint: str) -> IdempotencyRecord:
+        """
+        :returns: The record for a request to claim its key with in the shared store, once its status is filled in
+        """
+        return IdempotencyRecord(
+            self.name, key, fingerprint, "", time.time() + self.ttl_seconds
+        )
+
+    def run(
+        self, key: str, fingerprint: str, compute: Callable[[], Any]
+    ) -> Tuple[Any, bool]:
+        """
+        Runs compute, unless a request with the same key already ran and its result is still cached.
+
+        :param: key The idempotency key sent by the client
+        :param: fingerprint Identifies the request, so that a key sent again with a different request is refused
+        :param: compute Runs the request
+        :returns: The result, and whether it was replayed from the cache
+        :raises: IdempotencyKeyReused if the key was last used with a different fingerprint
+        """
+        while True:
+            now = self._clock()
+            with self._lock:
+                self._evict(now)
+                attempt = self._attempts.get(key)
+                first = attempt is None
+                if first:
+                    attempt = _Attempt(fingerprint, now + self.ttl_seconds)
+                    self._attempts[key] = attempt
+                    self._evict(now)
+                elif attempt.fingerprint != fingerprint:
+                    raise IdempotencyKeyReused(
+                        "The idempotency key was already used with a different request"
+                    )
+
+            if first:
+                replayed = False
+                try:
+                    attempt.result = compute()
+                except IdempotentReplay as replay:
+                    attempt.result = replay.result
+                    replayed = True
+                except BaseException:
+                    with self._lock:
+                        if self._attempts.get(key) is attempt:
+                            del self._attempts[key]
+                    attempt.failed = True
+                    raise
+                finally:
+                    attempt.finished.set()
+                if replayed:
+                    metrics.increment("idempotency.{0}.replayed".format(self.name))
+                return attempt.result, replayed
+
+            attempt.finished.wait()
+            if not attempt.failed:
+                metrics.increment("idempotency.{0}.replayed".format(self.name))
+                return attempt.result, True
+            # The first attempt failed, so this one runs the request itself, or waits for whoever does
+
+    def _after_fork_in_child(self):
+        """
+        Runs in every forked child. The lock may have been held by a thread that doesn't exist in the child, and the
+        attempts in flight would never finish there, so the child starts with an empty cache.
+        """
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+
+def validate_key(key: Optional[str]) -> Optional[str]:
+    """
+    :returns: The idempotency key, or None if the client didn't send one
+    :raises: ValueError if the key is empty or too long
+    """
+    if key is None:
+        return None
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(
+            "{0} must be 1 to {1} characters long".format(
+                IDEMPOTENCY_KEY_HEADER, MAX_IDEMPOTENCY_KEY_LENGTH
+            )
+        )
+    return key
+
+
+def fingerprint(*fields: str) -> str:
+    """
+    Hashes the fields of a request, so that neither the cache nor the shared store holds them, e.g. national ids. The
+    hash is keyed: national ids are short enough that an unkeyed hash could be reversed by trying them all.
+
+    :raises: KeyNotConfigured if IDEMPOTENCY_FINGERPRINT_KEY_HMAC isn't set (see main/store/keyring.py)
+    """
+    _, key = Keyring.get_instance(
+        IDEMPOTENCY_FINGERPRINT_KEY_HMAC, FINGERPRINT_KEY_BYTES
+    ).current()
+    return hmac.new(key, json.dumps(fields).encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def cache_from_env(
+    name: str, default_max_entries: int, default_ttl_seconds: float
+) -> IdempotencyCache:
+    """
+    Builds the idempotency cache of an endpoint, overridable by <NAME>_IDEMPOTENCY_MAX_ENTRIES and
+    <NAME>_IDEMPOTENCY_TTL_SECONDS environment variables.
+    """
+    prefix = name.upper()
+    return IdempotencyCache(
+        name,
+        int(os.getenv(prefix + "_IDEMPOTENCY_MAX_ENTRIES", default_max_entries)),
+        float(os.getenv(prefix + "_IDEMPOTENCY_TTL_SECONDS", default_ttl_seconds)),
+    )
+
+
+def _after_fork_in_child():
+    for cache in list(_caches):
+        cache._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,337 @@
+#
+# This file issues ballots as jobs, so that a poll-worker UI issuing ballots for a queue of voters doesn't stall on the
+# bcrypt hash of each one. Submitting a job returns its id right away, a pool of worker threads issues the ballots, and
+# clients poll for the result, optionally waiting for it (long-polling). With ISSUANCE_JOB_WORKERS unset or 0, jobs run
+# inline when submitted, which is what tests and CLI tools want; while the REST endpoints are enabled there is always at
+# least one worker.
+#
+# Jobs live in the store, so that a job submitted to one prefork worker (see main/api/prefork.py) can be polled on any
+# other. Issued ballot numbers are held encrypted, under a random key drawn when this module is imported, which the
+# prefork workers inherit from the master and which never leaves the process tree. The first poll that sees the ballot
+# issued collects its number, which is then cleared; later polls only see the job as collected. Jobs are forgotten
+# ISSUANCE_JOB_TTL_SECONDS after they were submitted, or after they finished. A pending job holds the voter's key, in
+# the process it was submitted to, until its ballot is issued.
+#
+
+import os
+import queue
+import secrets
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, NamedTuple, Optional
+
+from ..crypto import executor, primitives
+from ..crypto.executor import Priority
+from ..objects.voter import VoterKey
+from ..store.data_registry import IssuanceJobRecord, VotingStore
+from . import admin_auth, balloting, metrics
+
+ISSUANCE_JOB_WORKERS = "ISSUANCE_JOB_WORKERS"
+ISSUANCE_JOB_TTL_SECONDS = "ISSUANCE_JOB_TTL_SECONDS"
+ISSUANCE_JOB_MAX_QUEUE = "ISSUANCE_JOB_MAX_QUEUE"
+# The REST endpoints only exist while this is set, and require it as a bearer token
+ISSUANCE_ADMIN_TOKEN = "ISSUANCE_ADMIN_TOKEN"
+DEFAULT_TTL_SECONDS = 300.0
+DEFAULT_MAX_QUEUE = 1024
+# The longest a poll may wait for a job to finish
+MAX_WAIT_SECONDS = 30.0
+# How often a poll waiting for a job submitted to another process checks the store
+POLL_INTERVAL_SECONDS = 0.05
+
+# Shared by every process forked after the import, so that any of them can read the ballot numbers the others issued
+_BALLOT_NUMBER_KEY = os.urandom(64)
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    ISSUED = "issued"
+    # Issued, and the ballot number was already handed to an earlier poll
+    COLLECTED = "collected"
+    NOT_REGISTERED = "not registered"
+    FAILED = "failed"
+
+
+class JobResult(NamedTuple):
+    status: JobStatus
+    # Only set on the first poll that sees the ballot issued
+    ballot_number: Optional[str]
+
+
+class IssuanceQueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue of pending jobs is full
+    """
+
+
+_STOP = None
+
+
+class IssuanceJobs:
+    """
+    A singleton pool of ballot issuance jobs.
+
+    >>> jobs = IssuanceJobs.get_instance()
+    >>> job_id = jobs.submit(national_id)   # returns right away
+    >>> jobs.poll(job_id, wait_seconds=10)   # JobResult, or None if the job is unknown or expired
+    >>> jobs.poll(job_id)                    # JobStatus.COLLECTED once the ballot number was handed out
+    """
+
+    issuance_jobs_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> "IssuanceJobs":
+        if IssuanceJobs.issuance_jobs_instance is None:
+            with IssuanceJobs._instance_lock:
+                if IssuanceJobs.issuance_jobs_instance is None:
+                    workers = int(os.getenv(ISSUANCE_JOB_WORKERS, 0))
+                    # Running jobs inline would make the REST submit block on the bcrypt hash it is meant to avoid
+                    if admin_auth.enabled(ISSUANCE_ADMIN_TOKEN):
+                        workers = max(workers, 1)
+                    IssuanceJobs.issuance_jobs_instance = IssuanceJobs(
+                        workers,
+                        float(os.getenv(ISSUANCE_JOB_TTL_SECONDS, DEFAULT_TTL_SECONDS)),
+                        int(os.getenv(ISSUANCE_JOB_MAX_QUEUE, DEFAULT_MAX_QUEUE)),
+                    )
+
+        return IssuanceJobs.issuance_jobs_instance
+
+    @staticmethod
+    def configure(
+        workers: int,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        clock: Callable[[], float] = time.time,
+    ) -> "IssuanceJobs":
+        """
+        Replaces the singleton, stopping the previous one once its pending jobs are done
+        """
+        with IssuanceJobs._instance_lock:
+            if IssuanceJobs.issuance_jobs_instance is not None:
+                IssuanceJobs.issuance_jobs_instance.stop()
+            IssuanceJobs.issuance_jobs_instance = IssuanceJobs(
+                workers, ttl_seconds, max_queue, clock
+            )
+
+            return IssuanceJobs.issuance_jobs_instance
+
+    def __init__(
+        self,
+        workers: int,
+        ttl_seconds: float,
+        max_queue: int,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        DO NOT call this method directly - instead use the IssuanceJobs.get_instance method above.
+        """
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self.max_queue = max_queue
+        self.issued = 0
+        self.failed = 0
+        self._clock = clock
+        # Set once the job submitted to this process finishes, for polls waiting on it
+        self._finished: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def held(self) -> int:
+        return VotingStore.get_instance().count_issuance_jobs(self._clock())
+
+    def submit(self, voter_national_id: str) -> str:
+        """
+        Submits a job issuing a new ballot to the voter, like balloting.issue_ballot
+
+        :returns: The id of the job
+        :raises: IssuanceQueueFull if the queue of pending jobs is full
+        """
+        job_id = secrets.token_urlsafe(16)
+        key = VoterKey(voter_national_id)
+        if self.workers <= 0:
+            self._add(job_id)
+            self._run(job_id, key)
+            return job_id
+
+        self._start()
+        with self._lock:
+            self._finished[job_id] = threading.Event()
+        self._add(job_id)
+        try:
+            self._queue.put_nowait((job_id, key))
+        except queue.Full:
+            with self._lock:
+                del self._finished[job_id]
+            VotingStore.get_instance().remove_issuance_job(job_id)
+            raise IssuanceQueueFull(
+                "{0} issuance jobs are already pending".format(self.max_queue)
+            )
+        return job_id
+
+    def poll(self, job_id: str, wait_seconds: float = 0.0) -> Optional[JobResult]:
+        """
+        :param: wait_seconds How long to wait for a pending job to finish, up to MAX_WAIT_SECONDS
+        :returns: The result of the job, or None if there is no such job or it expired
+        """
+        store = VotingStore.get_instance()
+        record = store.get_issuance_job(job_id, self._clock())
+        if record is None:
+            return None
+
+        if record.status == JobStatus.PENDING.name and wait_seconds > 0:
+            wait_seconds = min(wait_seconds, MAX_WAIT_SECONDS)
+            with self._lock:
+                finished = self._finished.get(job_id)
+            if finished is not None:
+                finished.wait(wait_seconds)
+                record = store.get_issuance_job(job_id, self._clock())
+            else:
+                # Submitted to another process
+                deadline = time.monotonic() + wait_seconds
+                while (
+                    record is not None
+                    and record.status == JobStatus.PENDING.name
+                    and time.monotonic() < deadline
+                ):
+                    time.sleep(POLL_INTERVAL_SECONDS)
+                    record = store.get_issuance_job(job_id, self._clock())
+            if record is None:
+                return None
+
+        status = JobStatus[record.status]
+        if status != JobStatus.ISSUED:
+            return JobResult(status, None)
+
+        encrypted_ballot_number = store.collect_issued_ballot_number(
+            job_id, self._clock()
+        )
+        if encrypted_ballot_number is None:
+            return JobResult(JobStatus.COLLECTED, None)
+
+        return JobResult(
+            JobStatus.ISSUED,
+            executor.run(
+                Priority.ISSUANCE,
+                primitives.aes_siv_decrypt,
+                _BALLOT_NUMBER_KEY,
+                encrypted_ballot_number,
+            ),
+        )
+
+    def _add(self, job_id: str):
+        now = self._clock()
+        VotingStore.get_instance().add_issuance_job(
+            IssuanceJobRecord(
+                job_id, JobStatus.PENDING.name, None, now + self.ttl_seconds
+            ),
+            now,
+        )
+
+    def _run(self, job_id: str, key: VoterKey):
+        encrypted_ballot_number = None
+        try:
+            ballot_number = balloting.issue_ballot_by_key(key)
+            if ballot_number is None:
+                status = JobStatus.NOT_REGISTERED
+            else:
+                encrypted_ballot_number = executor.run(
+                    Priority.ISSUANCE,
+                    primitives.aes_siv_encrypt,
+                    _BALLOT_NUMBER_KEY,
+                    ballot_number,
+                )
+                status = JobStatus.ISSUED
+        except Exception:
+            status = JobStatus.FAILED
+
+        try:
+            VotingStore.get_instance().finish_issuance_job(
+                IssuanceJobRecord(
+                    job_id,
+                    status.name,
+                    encrypted_ballot_number,
+                    self._clock() + self.ttl_seconds,
+                )
+            )
+        except Exception:
+            status = JobStatus.FAILED
+        with self._lock:
+            if status == JobStatus.FAILED:
+                self.failed += 1
+            elif status == JobStatus.ISSUED:
+                self.issued += 1
+            finished = self._finished.pop(job_id, None)
+        if finished is not None:
+            finished.set()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            self._run(*item)
+
+    def _start(self):
+        """
+        Starts the workers, if they aren't running yet
+        """
+        if self._threads:
+            return
+        with IssuanceJobs._instance_lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    name="ballot-issuance-{0}".format(index),
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stops the workers once the jobs already submitted are done
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @staticmethod
+    def _after_fork_in_child():
+        """
+        Runs in every forked child. Threads don't survive a fork, so the child starts its own pool on first use.
+        """
+        IssuanceJobs._instance_lock = threading.Lock()
+        IssuanceJobs.issuance_jobs_instance = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=IssuanceJobs._after_fork_in_child)
+
+# Gauges read the pool only once it exists, so that taking a snapshot doesn't start its workers
+metrics.register_gauge(
+    "ballot_issuance.pending",
+    lambda: getattr(IssuanceJobs.issuance_jobs_instance, "pending", 0),
+)
+metrics.register_gauge(
+    "ballot_issuance.held",
+    lambda: getattr(IssuanceJobs.issuance_jobs_instance, "held", 0),
+)
+metrics.register_gauge(
+    "ballot_issuance.issued",
+    lambda: getattr(IssuanceJobs.issuance_jobs_instance, "issued", 0),
+)
+metrics.register_gauge(
+    "ballot_issuance.failed",
+    lambda: getattr(IssuanceJobs.issuance_jobs_instance, "failed", 0),
+)
@@ -0,0 +1,49 @@
+#
+# This file is a minimal, process-wide metrics registry. Counters are incremented by the code that owns them; gauges
+# are callables that are only evaluated when a snapshot is taken. /api/metrics serves the snapshot, but only while
+# METRICS_ADMIN_TOKEN is set, and only to requests carrying it as a bearer token: queue depths and backlogs tell an
+# attacker how close the server is to shedding load.
+#
+
+import threading
+from typing import Callable, Dict, Optional
+
+# /api/metrics only exists while this is set, and requires it as a bearer token
+METRICS_ADMIN_TOKEN = "METRICS_ADMIN_TOKEN"
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, Callable[[], Optional[float]]] = {}
+
+
+def increment(name: str, by: int = 1):
+    """
+    Increments a counter, creating it if it doesn't exist yet
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + by
+
+
+def register_gauge(name: str, read: Callable[[], Optional[float]]):
+    """
+    Registers a gauge. read is called every time a snapshot is taken, so it should be cheap, and must not start what it
+    measures. It may return None to leave the gauge out of the snapshot.
+    """
+    with _lock:
+        _gauges[name] = read
+
+
+def snapshot() -> Dict[str, float]:
+    """
+    Returns the current value of every counter and gauge
+    """
+    with _lock:
+        values: Dict[str, float] = dict(_counters)
+        gauges = dict(_gauges)
+
+    for name, read in gauges.items():
+        value = read()
+        if value is not None:
+            values[name] = value
+
+    return values
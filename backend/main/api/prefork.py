@@ -0,0 +1,172 @@
+#
+# This file serves the REST API from several worker processes, so that bcrypt-bound ballot casting can use more than one
+# core. The master process opens the listening socket, seeds the shared store and settles the secrets, then forks the
+# workers. The master starts no threads, so that no worker inherits a lock held by a thread that doesn't exist in it.
+# Each worker starts its own background work (comment redaction, and in one worker name re-encryption), then accepts
+# connections from the shared socket and serves one request at a time. Workers that die are replaced.
+#
+# The workers share a file-backed store (see VOTING_STORE_DATABASE in main/store/data_registry.py), so the database
+# path is required. To run the backend with 4 workers, run the following from the /backend directory
+#
+# $ VOTING_STORE_DATABASE=/tmp/voting-store.sqlite3 python -m main.api.prefork --workers 4 --port 5000
+#
+# /api/results/stream reads the ballot counters kept in the shared store, so every worker streams the ballots counted
+# by all of them. Everything else is per worker: admission control and rate limits apply per process, and /api/metrics
+# reports the worker that served the request. Leave CRYPTO_EXECUTOR_WORKERS unset, as the workers already are the
+# crypto parallelism.
+#
+# Name encryption, blind index, comment quarantine and idempotency fingerprint keys must be the same in every worker,
+# so set them in the environment. The master reads them before forking, and refuses to start if one is missing
+# (KeyNotConfigured). With ALLOW_GENERATED_KEYS=1 it generates the missing ones instead, which every worker inherits,
+# and which only live as long as the master does.
+#
+
+import os
+import signal
+import socket
+import sys
+from typing import Optional, Set
+
+from ..detection.redaction_pipeline import COMMENT_QUARANTINE_KEY_AES_SIV
+from ..objects.voter import (
+    BLIND_INDEX_KEY_BYTES,
+    NAME_BLIND_INDEX_KEY_HMAC,
+    NAME_ENCRYPTION_KEY_AES_SIV,
+)
+from ..store.data_registry import VOTING_STORE_DATABASE
+from ..store.keyring import Keyring
+from .idempotency import FINGERPRINT_KEY_BYTES, IDEMPOTENCY_FINGERPRINT_KEY_HMAC
+
+PREFORK_WORKERS = "PREFORK_WORKERS"
+LISTEN_BACKLOG = 1024
+
+
+def _settle_secrets():
+    """
+    Makes sure every secret a worker needs exists before forking. A secret generated after the fork would be different
+    in every worker, and names encrypted by one worker couldn't be read by the others.
+
+    :raises: KeyNotConfigured if a key isn't set, and ALLOW_GENERATED_KEYS isn't set either
+    """
+    Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV).current()
+    Keyring.get_instance(COMMENT_QUARANTINE_KEY_AES_SIV).current()
+    Keyring.get_instance(NAME_BLIND_INDEX_KEY_HMAC, BLIND_INDEX_KEY_BYTES).current()
+    Keyring.get_instance(
+        IDEMPOTENCY_FINGERPRINT_KEY_HMAC, FINGERPRINT_KEY_BYTES
+    ).current()
+
+
+def _run_worker(listener: socket.socket, reencrypt_names: bool):
+    """
+    Serves requests from the shared listening socket until the worker is terminated. Never returns.
+
+    :param: reencrypt_names Whether this worker runs the name re-encryption job
+    """
+    from werkzeug.serving import make_server
+
+    from . import backend_rest_api
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    host, port = listener.getsockname()[:2]
+    exit_code = 1
+    try:
+        backend_rest_api.start_background_work(reencrypt_names)
+        app = backend_rest_api.app
+        server = make_server(host, port, app, threaded=False, fd=listener.fileno())
+        server.serve_forever()
+        exit_code = 0
+    finally:
+        os._exit(exit_code)
+
+
+def serve(host: str, port: int, workers: int):
+    """
+    Serves the REST API from workers forked processes, until the master process is interrupted or terminated.
+
+    :param: host The address to listen on
+    :param: port The port to listen on
+    :param: workers The number of worker processes
+    :raises: ValueError if the store isn't file-backed, or workers isn't positive
+    """
+    if not os.getenv(VOTING_STORE_DATABASE):
+        raise ValueError(
+            "{0} must be set to the database file the workers share".format(
+                VOTING_STORE_DATABASE
+            )
+        )
+    if workers < 1:
+        raise ValueError("At least one worker is needed")
+
+    from . import backend_rest_api
+
+    listener = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    _settle_secrets()
+    # Seeding here, rather than on each worker's first request, seeds the shared store once
+    backend_rest_api.seed_database_once()
+
+    children: Set[int] = set()
+    stopping = False
+    # The worker running the name re-encryption job, so that it is handed on if that worker dies
+    reencrypting_worker: Optional[int] = None
+
+    def spawn():
+        nonlocal reencrypting_worker
+        reencrypt_names = reencrypting_worker is None
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(listener, reencrypt_names)
+        children.add(pid)
+        if reencrypt_names:
+            reencrypting_worker = pid
+
+    def stop(signal_number, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(
+        "Serving on http://{0}:{1} with {2} workers".format(host, port, workers),
+        flush=True,
+    )
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if pid == reencrypting_worker:
+            reencrypting_worker = None
+        if not stopping:
+            print("Worker {0} exited, starting another".format(pid), file=sys.stderr)
+            spawn()
+
+    listener.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serve the REST API from forked workers"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv(PREFORK_WORKERS, 0)) or os.cpu_count() or 1,
+    )
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,489 @@
+#
+# This file profiles the running server on demand, to find hot spots under production load. Profiling is disabled
+# unless PROFILING_ADMIN_TOKEN is set. An admin then starts a time-bounded capture with
+#
+# $ PROFILING_ADMIN_TOKEN=... python -m main.api.profiling --url http://127.0.0.1:5000 --seconds 10
+#
+# which calls POST /api/admin/profile with the token as a bearer token. The capture is written to a new directory under
+# PROFILING_OUTPUT_DIRECTORY (./profiles by default), on the server:
+#
+# 1. all.pstats and all.collapsed - the profile of the whole process, as pstats (python -m pstats, snakeviz) and as
+#    collapsed stacks (flamegraph.pl, speedscope)
+# 2. <endpoint>.pstats and <endpoint>.collapsed - the same, for each endpoint that served requests, e.g. count_ballot
+# 3. memory-start.tracemalloc and memory-end.tracemalloc - tracemalloc snapshots, if memory was requested
+# 4. summary.json - time per endpoint, the cumulative time of every balloting and registry function, and the lines that
+#    allocated the most memory during the capture
+#
+# There are two modes. "sampling" (the default) samples the stacks of every thread every few milliseconds; it is cheap
+# enough to leave on under load. "cprofile" runs every request under cProfile, which counts calls exactly but slows
+# requests down, and has no collapsed stacks. Only one request is profiled at a time; the others are counted in the
+# summary as unprofiled.
+#
+# Nothing is installed until a capture starts, so a server that is never profiled pays nothing. Behind the pre-fork
+# server (main/api/prefork.py) a capture only profiles the worker that serves it.
+#
+
+import cProfile
+import inspect
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from . import balloting, registry
+
+PROFILING_ADMIN_TOKEN = "PROFILING_ADMIN_TOKEN"
+PROFILING_OUTPUT_DIRECTORY = "PROFILING_OUTPUT_DIRECTORY"
+DEFAULT_OUTPUT_DIRECTORY = "profiles"
+
+SAMPLING = "sampling"
+CPROFILE = "cprofile"
+MODES = (SAMPLING, CPROFILE)
+MAX_CAPTURE_SECONDS = 120.0
+SAMPLE_INTERVAL_SECONDS = 0.005
+# Samples of threads that aren't serving a request, e.g. the server's accept loop
+OTHER_ENDPOINT = "other"
+TOP_ALLOCATIONS = 20
+
+# The modules whose functions are broken down in the summary
+PROFILED_MODULES = (balloting, registry)
+
+# (file name, first line, function name), as in pstats
+FunctionKey = Tuple[str, int, str]
+
+
+class CaptureInProgress(Exception):
+    """
+    Raised when a capture is requested while another one is running
+    """
+
+
+def _function_key(code) -> FunctionKey:
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class _SampledStats:
+    """
+    Turns sampled stacks into the stats pstats.Stats loads from a profiler. Calls are counted in samples, and times are
+    samples times the sampling interval.
+    """
+
+    def __init__(self, stacks: Dict[Tuple[FunctionKey, ...], int], interval: float):
+        self.stacks = stacks
+        self.interval = interval
+        self.stats = {}
+
+    def create_stats(self):
+        own_samples: Counter = Counter()
+        samples: Counter = Counter()
+        caller_samples: Dict[FunctionKey, Counter] = {}
+        for stack, count in self.stacks.items():
+            own_samples[stack[-1]] += count
+            # A recursive function is only counted once per sample
+            for function in set(stack):
+                samples[function] += count
+            for caller, function in set(zip(stack, stack[1:])):
+                caller_samples.setdefault(function, Counter())[caller] += count
+
+        self.stats = {
+            function: (
+                count,
+                count,
+                own_samples[function] * self.interval,
+                count * self.interval,
+                {
+                    caller: (
+                        caller_count,
+                        caller_count,
+                        0.0,
+                        caller_count * self.interval,
+                    )
+                    for caller, caller_count in caller_samples.get(
+                        function, Counter()
+                    ).items()
+                },
+            )
+            for function, count in samples.items()
+        }
+
+
+def _collapsed(stacks: Dict[Tuple[FunctionKey, ...], int]) -> str:
+    """
+    Formats sampled stacks in the collapsed stack format, one "frame;frame;frame count" line per distinct stack
+    """
+    lines = []
+    for stack, count in sorted(stacks.items()):
+        frames = [
+            "{0} ({1}:{2})".format(name, os.path.basename(file_name), line)
+            for file_name, line, name in stack
+        ]
+        lines.append("{0} {1}\n".format(";".join(frames), count))
+    return "".join(lines)
+
+
+class _Capture:
+    """
+    The state of one running capture
+    """
+
+    def __init__(self, mode: str, endpoints_by_code: dict):
+        self.mode = mode
+        self.endpoints_by_code = endpoints_by_code
+        self.stacks: Dict[str, Counter] = {}
+        self.profiles: Dict[str, object] = {}
+        self.requests: Counter = Counter()
+        self.unprofiled_requests = 0
+        self._request_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def sample(self, ignored_threads: List[int]):
+        """
+        Samples the stack of every other thread until the capture is stopped
+        """
+        ignored_threads = set(ignored_threads) | {threading.get_ident()}
+        while not self._stopped.wait(SAMPLE_INTERVAL_SECONDS):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in ignored_threads:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                endpoint = next(
+                    (
+                        self.endpoints_by_code[code]
+                        for code in codes
+                        if code in self.endpoints_by_code
+                    ),
+                    OTHER_ENDPOINT,
+                )
+                self.stacks.setdefault(endpoint, Counter())[
+                    tuple(_function_key(code) for code in codes)
+                ] += 1
+
+    def stop(self):
+        self._stopped.set()
+
+    def profile_request(self, wsgi_app, endpoint: str, environ, start_response):
+        """
+        Serves a request under cProfile, unless another request is being profiled already
+        """
+        if not self._request_lock.acquire(blocking=False):
+            self.unprofiled_requests += 1
+            return wsgi_app(environ, start_response)
+
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                profile.disable()
+                self.requests[endpoint] += 1
+                if endpoint in self.profiles:
+                    self.profiles[endpoint].add(profile)
+                else:
+                    self.profiles[endpoint] = pstats.Stats(profile)
+        finally:
+            self._request_lock.release()
+
+
+class ProfilingMiddleware:
+    """
+    Wraps the WSGI app to run requests under cProfile while a cProfile capture is running. Installed by the first such
+    capture; outside of a capture it only checks that no capture is running.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.capture: Optional[_Capture] = None
+
+    def __call__(self, environ, start_response):
+        capture = self.capture
+        if capture is None:
+            return self.wsgi_app(environ, start_response)
+
+        from werkzeug.exceptions import HTTPException
+
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = OTHER_ENDPOINT
+        return capture.profile_request(self.wsgi_app, endpoint, environ, start_response)
+
+
+def install(app) -> ProfilingMiddleware:
+    """
+    Wraps the app's WSGI app in the profiling middleware, if it isn't wrapped yet
+    """
+    if not isinstance(app.wsgi_app, ProfilingMiddleware):
+        app.wsgi_app = ProfilingMiddleware(app)
+    return app.wsgi_app
+
+
+def _endpoints_by_code(app) -> dict:
+    """
+    Maps the code of every view function (under its decorators) to its endpoint
+    """
+    return {
+        inspect.unwrap(view).__code__: endpoint
+        for endpoint, view in app.view_functions.items()
+    }
+
+
+def _module_functions(stats) -> List[dict]:
+    """
+    The calls and cumulative time of every balloting and registry function that ran, most expensive first
+    """
+    files = {
+        os.path.normcase(os.path.abspath(module.__file__)): module.__name__.split(".")[
+            -1
+        ]
+        for module in PROFILED_MODULES
+    }
+    functions = []
+    for (file_name, _, name), (_, calls, _, cumulative, _) in stats.stats.items():
+        module = files.get(os.path.normcase(os.path.abspath(file_name)))
+        if module:
+            functions.append(
+                {
+                    "function": "{0}.{1}".format(module, name),
+                    "calls": calls,
+                    "cumulative_seconds": round(cumulative, 6),
+                }
+            )
+    return sorted(
+        functions, key=lambda function: function["cumulative_seconds"], reverse=True
+    )
+
+
+_capture_lock = threading.Lock()
+
+
+def capture(
+    app,
+    seconds: float,
+    mode: str = SAMPLING,
+    memory: bool = False,
+    output_directory: Optional[str] = None,
+) -> dict:
+    """
+    Profiles the app for a number of seconds, on the calling thread, and writes the profile to a new directory.
+
+    :param: app The Flask app to profile
+    :param: seconds How long to profile for, up to MAX_CAPTURE_SECONDS
+    :param: mode SAMPLING or CPROFILE
+    :param: memory Whether to also take tracemalloc snapshots at the start and at the end of the capture
+    :param: output_directory Where to create the capture's directory. Defaults to PROFILING_OUTPUT_DIRECTORY.
+    :returns: The summary of the capture, as written to summary.json
+    :raises: ValueError if seconds or mode is invalid
+    :raises: CaptureInProgress if another capture is running
+    """
+    if mode not in MODES:
+        raise ValueError("mode must be one of {0}".format(", ".join(MODES)))
+    if not 0 < seconds <= MAX_CAPTURE_SECONDS:
+        raise ValueError(
+            "seconds must be more than 0 and at most {0}".format(MAX_CAPTURE_SECONDS)
+        )
+    if not _capture_lock.acquire(blocking=False):
+        raise CaptureInProgress("A capture is already running")
+
+    try:
+        output_directory = output_directory or os.getenv(
+            PROFILING_OUTPUT_DIRECTORY, DEFAULT_OUTPUT_DIRECTORY
+        )
+        os.makedirs(output_directory, exist_ok=True)
+        directory = tempfile.mkdtemp(
+            prefix="{0}-{1}-".format(time.strftime("%Y%m%d-%H%M%S"), mode),
+            dir=output_directory,
+        )
+        started_tracing, start_snapshot = _start_memory_capture(memory)
+        running = _Capture(mode, _endpoints_by_code(app))
+
+        started = time.perf_counter()
+        if mode == SAMPLING:
+            sampler = threading.Thread(
+                target=running.sample,
+                args=([threading.get_ident()],),
+                name="profiling-sampler",
+                daemon=True,
+            )
+            sampler.start()
+            time.sleep(seconds)
+            running.stop()
+            sampler.join()
+        else:
+            middleware = install(app)
+            middleware.capture = running
+            try:
+                time.sleep(seconds)
+            finally:
+                middleware.capture = None
+                # Wait for the request being profiled, if any
+                with running._request_lock:
+                    pass
+        elapsed = time.perf_counter() - started
+
+        summary = {
+            "mode": mode,
+            "seconds": round(elapsed, 3),
+            "directory": directory,
+            "endpoints": {},
+        }
+        if mode == SAMPLING:
+            all_stats = _write_sampled_profiles(running, directory, summary)
+        else:
+            all_stats = _write_cprofile_profiles(running, directory, summary)
+        summary["functions"] = _module_functions(all_stats) if all_stats else []
+
+        if memory:
+            summary["memory"] = _finish_memory_capture(
+                started_tracing, start_snapshot, directory
+            )
+
+        with open(os.path.join(directory, "summary.json"), "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+            summary_file.write("\n")
+
+        return summary
+    finally:
+        _capture_lock.release()
+
+
+def _write_sampled_profiles(running: _Capture, directory: str, summary: dict):
+    all_stacks: Counter = Counter()
+    for endpoint, stacks in sorted(running.stacks.items()):
+        all_stacks.update(stacks)
+        samples = sum(stacks.values())
+        summary["endpoints"][endpoint] = {
+            "samples": samples,
+            "seconds": round(samples * SAMPLE_INTERVAL_SECONDS, 6),
+        }
+        if endpoint != OTHER_ENDPOINT:
+            _write_sampled_profile(stacks, directory, endpoint)
+
+    if not all_stacks:
+        return None
+    _write_sampled_profile(all_stacks, directory, "all")
+    return pstats.Stats(_SampledStats(all_stacks, SAMPLE_INTERVAL_SECONDS))
+
+
+def _write_sampled_profile(stacks: Counter, directory: str, name: str):
+    pstats.Stats(_SampledStats(stacks, SAMPLE_INTERVAL_SECONDS)).dump_stats(
+        os.path.join(directory, "{0}.pstats".format(name))
+    )
+    with open(
+        os.path.join(directory, "{0}.collapsed".format(name)), "w"
+    ) as collapsed_file:
+        collapsed_file.write(_collapsed(stacks))
+
+
+def _write_cprofile_profiles(running: _Capture, directory: str, summary: dict):
+    all_stats = None
+    for endpoint, stats in sorted(running.profiles.items()):
+        stats.dump_stats(os.path.join(directory, "{0}.pstats".format(endpoint)))
+        summary["endpoints"][endpoint] = {
+            "requests": running.requests[endpoint],
+            "seconds": round(stats.total_tt, 6),
+        }
+        all_stats = all_stats or pstats.Stats()
+        all_stats.add(stats)
+    summary["unprofiled_requests"] = running.unprofiled_requests
+
+    if all_stats is not None:
+        all_stats.dump_stats(os.path.join(directory, "all.pstats"))
+    return all_stats
+
+
+def _start_memory_capture(memory: bool):
+    """
+    :returns: Whether tracing was started by this capture, and the starting snapshot
+    """
+    if not memory:
+        return False, None
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    return started_tracing, tracemalloc.take_snapshot()
+
+
+def _finish_memory_capture(started_tracing: bool, start_snapshot, directory: str):
+    """
+    Writes both snapshots, and stops tracing if the capture started it
+
+    :returns: The lines that allocated the most memory during the capture
+    """
+    end_snapshot = tracemalloc.take_snapshot()
+    if started_tracing:
+        tracemalloc.stop()
+    start_snapshot.dump(os.path.join(directory, "memory-start.tracemalloc"))
+    end_snapshot.dump(os.path.join(directory, "memory-end.tracemalloc"))
+
+    return [
+        {
+            "location": "{0}:{1}".format(
+                difference.traceback[0].filename, difference.traceback[0].lineno
+            ),
+            "size_diff": difference.size_diff,
+            "count_diff": difference.count_diff,
+        }
+        for difference in end_snapshot.compare_to(start_snapshot, "lineno")[
+            :TOP_ALLOCATIONS
+        ]
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+    import urllib.error
+    import urllib.request
+
+    parser = argparse.ArgumentParser(description="Profile a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--mode", choices=MODES, default=SAMPLING)
+    parser.add_argument(
+        "--memory", action="store_true", help="Also take tracemalloc snapshots"
+    )
+    args = parser.parse_args()
+
+    token = os.getenv(PROFILING_ADMIN_TOKEN)
+    if not token:
+        sys.exit(
+            "{0} must be set to the server's admin token".format(PROFILING_ADMIN_TOKEN)
+        )
+
+    profile_request = urllib.request.Request(
+        args.url.rstrip("/") + "/api/admin/profile",
+        data=json.dumps(
+            {"seconds": args.seconds, "mode": args.mode, "memory": args.memory}
+        ).encode("utf-8"),
+        headers={
+            "Authorization": "Bearer {0}".format(token),
+            "Content-Type": "application/json",
+        },
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(
+            profile_request, timeout=args.seconds + 60
+        ) as response:
+            summary = json.load(response)
+    except urllib.error.HTTPError as error:
+        sys.exit(
+            "The server refused the capture: {0} {1}".format(
+                error.code, error.read().decode("utf-8")
+            )
+        )
+
+    json.dump(summary, sys.stdout, indent=2)
+    print()
@@ -2,12 +2,41 @@
 # This file is the internal-only API that allows for the population of the voter registry.
 # This API should not be exposed as a REST API for election security purposes.
 #
-from typing import List
+import itertools
+from typing import Iterable, List, NamedTuple, Optional
 
 from ..objects.candidate import Candidate
-from ..objects.voter import Voter, VoterStatus
+from ..objects.voter import (
+    MinimalVoter,
+    Voter,
+    VoterKey,
+    VoterStatus,
+    blind_index_name,
+    decrypt_name,
+    normalize_name,
+)
+from ..store import audit_log
+from ..store.compaction import CompactionJob, start_compaction
 from ..store.data_registry import VotingStore
 
+# Voters deleted per transaction by de_register_voters. Each chunk holds the database for one short transaction, and
+# stays well under SQLite's limit on query parameters.
+DE_REGISTRATION_CHUNK_SIZE = 500
+
+
+class DeRegistrationReport(NamedTuple):
+    """
+    The outcome of a bulk de-registration
+    """
+
+    removed: int
+    # Voters who committed fraud stay registered
+    fraud_kept: int
+    not_registered: int
+    # The background job reclaiming the space of the removed voters, if one was started
+    compaction: Optional[CompactionJob]
+
+
 #
 # Voter Registration
 #
@@ -23,11 +52,12 @@ def register_voter(voter: Voter) -> bool:
               (based on their National ID)
     """
     store = VotingStore.get_instance()
-    status = get_voter_status(voter.national_id)
+    key = VoterKey(voter.national_id)
+    status = get_voter_status_by_key(key)
     if status != VoterStatus.NOT_REGISTERED:
         return False
 
-    store.add_voter(voter)
+    store.add_voter(voter, key)
     return True
 
 
@@ -38,8 +68,18 @@ def get_voter_status(voter_national_id: str) -> VoterStatus:
     :param: voter_national_id The sensitive ID of the voter to check the registration status of.
     :returns: The status of the voter that best describes their situation
     """
+    return get_voter_status_by_key(VoterKey(voter_national_id))
+
+
+def get_voter_status_by_key(key: VoterKey) -> VoterStatus:
+    """
+    Checks to see if the voter with the key specified is registered.
+
+    :param: key The key of the voter to check the registration status of.
+    :returns: The status of the voter that best describes their situation
+    """
     store = VotingStore.get_instance()
-    existing_voter = store.get_voter_by_national_id(voter_national_id)
+    existing_voter = store.get_voter_by_key(key)
 
     if existing_voter is None:
         return VoterStatus.NOT_REGISTERED
@@ -51,6 +91,39 @@ def get_voter_status(voter_national_id: str) -> VoterStatus:
     return VoterStatus.REGISTERED_NOT_VOTED
 
 
+def find_voters_by_name(
+    last_name: str, first_name: Optional[str] = None
+) -> List[MinimalVoter]:
+    """
+    Finds registered voters by name, for help-desk and de-registration requests. This is an indexed lookup on the blind
+    name indexes; only the matching rows are decrypted.
+
+    :param: last_name The voter's last name
+    :param: first_name The voter's first name, or None to match on the last name only
+    :returns: The matching voters, as stored: their names are still encrypted and their national id is obfuscated.
+    """
+    store = VotingStore.get_instance()
+    candidates = store.find_voters_by_name_index(
+        blind_index_name(last_name),
+        blind_index_name(first_name) if first_name is not None else None,
+    )
+
+    matches = []
+    for candidate in candidates:
+        # Blind indexes are truncated, so different names can share one
+        if normalize_name(
+            decrypt_name(candidate.obfuscated_last_name)
+        ) != normalize_name(last_name):
+            continue
+        if first_name is not None and normalize_name(
+            decrypt_name(candidate.obfuscated_first_name)
+        ) != normalize_name(first_name):
+            continue
+        matches.append(candidate)
+
+    return matches
+
+
 def de_register_voter(voter_national_id: str) -> bool:
     """
     De-registers a voter from voting. This is to be used when the user requests to be removed from the system.
@@ -60,18 +133,69 @@ def de_register_voter(voter_national_id: str) -> bool:
     :param: voter_national_id The sensitive ID of the voter to de-register.
     :returns: Boolean TRUE if de-registration was successful. Boolean FALSE otherwise.
     """
+    return de_register_voter_by_key(VoterKey(voter_national_id))
+
+
+def de_register_voter_by_key(key: VoterKey) -> bool:
+    """
+    De-registers the voter with the key specified. See de_register_voter above.
+
+    :param: key The key of the voter to de-register.
+    :returns: Boolean TRUE if de-registration was successful. Boolean FALSE otherwise.
+    """
     store = VotingStore.get_instance()
-    voter = store.get_voter_by_national_id(voter_national_id)
+    voter = store.get_voter_by_key(key)
 
     if voter is None:
         return False
     if voter.fraud_commited:
         return False
 
-    store.delete_voter_by_national_id(voter_national_id)
+    store.delete_voter_by_key(key)
+    audit_log.record_voter_deregistered(key)
     return True
 
 
+def de_register_voters(
+    voter_national_ids: Iterable[str],
+    chunk_size: int = DE_REGISTRATION_CHUNK_SIZE,
+    compact: bool = True,
+) -> DeRegistrationReport:
+    """
+    De-registers many voters at once, e.g. for a purge after an election. Like de_register_voter, voters who committed
+    fraud are not de-registered. The national ids are read as a stream, and deleted chunk_size voters per transaction.
+
+    :param: voter_national_ids The sensitive IDs of the voters to de-register
+    :param: chunk_size The number of voters deleted per transaction
+    :param: compact Whether to start reclaiming the space of the removed voters in the background afterwards
+    :returns: The number of voters removed, kept because they committed fraud, and not registered in the first place
+    """
+    store = VotingStore.get_instance()
+    removed = fraud_kept = not_registered = 0
+    voter_national_ids = iter(voter_national_ids)
+    while True:
+        keys = {
+            key.obfuscated_national_id: key
+            for key in map(VoterKey, itertools.islice(voter_national_ids, chunk_size))
+        }
+        if not keys:
+            break
+
+        deleted, chunk_fraud_kept = store.delete_voters_by_keys(list(keys.values()))
+        for obfuscated_national_id in deleted:
+            audit_log.record_voter_deregistered(keys[obfuscated_national_id])
+        removed += len(deleted)
+        fraud_kept += chunk_fraud_kept
+        not_registered += len(keys) - len(deleted) - chunk_fraud_kept
+
+    return DeRegistrationReport(
+        removed,
+        fraud_kept,
+        not_registered,
+        start_compaction(store) if compact and removed else None,
+    )
+
+
 #
 # Candidate Registration (Already Implemented)
 #
@@ -93,9 +217,79 @@ def candidate_is_registered(candidate: Candidate) -> bool:
     :returns: Boolean TRUE if the candidate is registered. Boolean FALSE otherwise.
     """
     store = VotingStore.get_instance()
-    return store.get_candidate(candidate.candidate_id) is not None
+    return store.is_candidate_registered(candidate.candidate_id)
 
 
 def get_all_candidates() -> List[Candidate]:
     store = VotingStore.get_instance()
     return store.get_all_candidates()
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    from ..store.data_registry import VOTING_STORE_DATABASE
+
+    parser = argparse.ArgumentParser(description="Voter registry maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    de_register_parser = subparsers.add_parser(
+        "de-register", help="De-register the voters whose national ids are read"
+    )
+    de_register_parser.add_argument(
+        "path",
+        nargs="?",
+        default="-",
+        help="A file with one national id per line, or - for standard input",
+    )
+    de_register_parser.add_argument(
+        "--database",
+        default=os.getenv(VOTING_STORE_DATABASE),
+        help="The database file of the store",
+    )
+    de_register_parser.add_argument(
+        "--chunk-size", type=int, default=DE_REGISTRATION_CHUNK_SIZE
+    )
+    de_register_parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rebuild the whole database afterwards, for files created before incremental vacuuming",
+    )
+    args = parser.parse_args()
+
+    if not args.database:
+        sys.exit(
+            "The in-memory store doesn't outlive this process: pass --database or set {0}".format(
+                VOTING_STORE_DATABASE
+            )
+        )
+    os.environ[VOTING_STORE_DATABASE] = args.database
+
+    national_ids_file = sys.stdin if args.path == "-" else open(args.path)
+    with national_ids_file:
+        report = de_register_voters(
+            (line.strip() for line in national_ids_file if line.strip()),
+            args.chunk_size,
+            compact=False,
+        )
+
+    store = VotingStore.get_instance()
+    page_size, page_count, _ = store.get_page_usage()
+    if args.vacuum:
+        store.vacuum()
+        _, page_count_after, _ = store.get_page_usage()
+        reclaimed_bytes = (page_count - page_count_after) * page_size
+    else:
+        reclaimed_bytes = CompactionJob(store, pause_seconds=0).run()
+        if not store.is_incrementally_vacuumed():
+            print(
+                "This database predates incremental vacuuming; run once with --vacuum to reclaim space",
+                file=sys.stderr,
+            )
+
+    print(
+        "Removed {0} voters, kept {1} who committed fraud, {2} were not registered. Reclaimed {3} bytes".format(
+            report.removed, report.fraud_kept, report.not_registered, reclaimed_bytes
+        )
+    )
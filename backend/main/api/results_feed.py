@@ -0,0 +1,217 @@
+#
+# This file is the live results feed behind /api/results/stream. Instead of every watcher polling
+# compute_election_winner, a background thread reads the store's per-candidate ballot counters once per interval and
+# turns what changed into one delta, and every subscriber is served from memory. The counters are kept by a trigger in
+# the same transaction as every ballot added, so the feed sees ballots counted by any process sharing the store, and
+# never scans the ballots table.
+#
+
+import json
+import os
+import sys
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..store.data_registry import VotingStore
+
+RESULTS_STREAM_INTERVAL_SECONDS = "RESULTS_STREAM_INTERVAL_SECONDS"
+DEFAULT_INTERVAL_SECONDS = 1.0
+
+# The number of past deltas kept for reconnecting clients. Clients that fall further behind get a fresh snapshot.
+HISTORY_SIZE = 1024
+
+SNAPSHOT_EVENT = "snapshot"
+DELTA_EVENT = "delta"
+
+
+class ResultsEvent:
+    """
+    One message of the results feed. A snapshot carries the full per-candidate counts; a delta carries only the changes
+    since the previous sequence id. Both carry the total turnout.
+    """
+
+    def __init__(self, kind: str, seq: int, counts: Dict[str, int], turnout: int):
+        self.kind = kind
+        self.seq = seq
+        self.counts = counts
+        self.turnout = turnout
+
+    def to_sse(self) -> str:
+        """
+        Formats this event as a Server-Sent Events message
+        """
+        data = json.dumps(
+            {"seq": self.seq, "counts": self.counts, "turnout": self.turnout}
+        )
+        return "id: {0}\nevent: {1}\ndata: {2}\n\n".format(self.seq, self.kind, data)
+
+
+class ResultsFeed:
+    """
+    A singleton that turns the store's ballot counters into a sequence of coalesced tally deltas.
+
+    >>> feed = ResultsFeed.get_instance()   # this will take the initial snapshot and start the coalescing thread
+    >>> for event in feed.subscribe(last_seq=None):
+    ...     ...
+    """
+
+    results_feed_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> "ResultsFeed":
+        with ResultsFeed._instance_lock:
+            feed = ResultsFeed.results_feed_instance
+            if feed is None or feed.store is not VotingStore.get_instance():
+                if feed is not None:
+                    feed.stop()
+                interval = float(
+                    os.getenv(RESULTS_STREAM_INTERVAL_SECONDS, DEFAULT_INTERVAL_SECONDS)
+                )
+                feed = ResultsFeed(VotingStore.get_instance(), interval)
+                feed.start()
+                ResultsFeed.results_feed_instance = feed
+
+            return feed
+
+    def __init__(self, store: VotingStore, interval_seconds: float):
+        """
+        DO NOT call this method directly - instead use the ResultsFeed.get_instance method above.
+        """
+        self.store = store
+        self.interval_seconds = interval_seconds
+
+        self._counts, self._turnout = self._read_counts()
+        self._seq = 0
+        self._history: deque = deque(maxlen=HISTORY_SIZE)
+
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="results-feed", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            # The store was replaced, e.g. by VotingStore.refresh_instance: its connection is closed, and the next
+            # ResultsFeed.get_instance starts a feed on the new one
+            if self.store is not VotingStore.voting_store_instance:
+                self.stop()
+                return
+
+            try:
+                self.flush()
+            except Exception as error:
+                # Retried on the next tick, so that one failed read doesn't end the feed for every subscriber
+                print(
+                    "Results feed failed to read the ballot counters: {0}".format(
+                        error
+                    ),
+                    file=sys.stderr,
+                )
+
+    def _read_counts(self) -> Tuple[Dict[str, int], int]:
+        """
+        :returns: The number of ballots cast for each registered candidate, and the number of ballots cast in total
+        """
+        ballots_by_candidate = self.store.get_ballots_by_candidate()
+        counts = {
+            candidate.candidate_id: 0 for candidate in self.store.get_all_candidates()
+        }
+        for candidate_id, ballots in ballots_by_candidate.items():
+            # Other processes sharing the store may have registered candidates this one hasn't seen yet
+            if candidate_id in counts or self.store.is_candidate_registered(
+                candidate_id
+            ):
+                counts[candidate_id] = ballots
+        return counts, sum(ballots_by_candidate.values())
+
+    def flush(self):
+        """
+        Turns the ballots counted since the last flush into a single delta and wakes every subscriber
+        """
+        counts, turnout = self._read_counts()
+        with self._condition:
+            if turnout == self._turnout:
+                return
+
+            delta = {
+                candidate_id: count - self._counts.get(candidate_id, 0)
+                for candidate_id, count in counts.items()
+                if count != self._counts.get(candidate_id, 0)
+            }
+            self._counts = counts
+            self._turnout = turnout
+            self._seq += 1
+            self._history.append(
+                ResultsEvent(DELTA_EVENT, self._seq, delta, self._turnout)
+            )
+            self._condition.notify_all()
+
+    def snapshot(self) -> ResultsEvent:
+        with self._condition:
+            return ResultsEvent(
+                SNAPSHOT_EVENT, self._seq, dict(self._counts), self._turnout
+            )
+
+    def _events_after(self, last_seq: Optional[int]) -> List[ResultsEvent]:
+        """
+        The events a client that has seen last_seq needs to catch up. Must be called while holding the condition.
+        """
+        oldest_seq = self._history[0].seq if self._history else self._seq + 1
+        if last_seq is None or last_seq > self._seq or last_seq < oldest_seq - 1:
+            return [
+                ResultsEvent(
+                    SNAPSHOT_EVENT, self._seq, dict(self._counts), self._turnout
+                )
+            ]
+
+        return [event for event in self._history if event.seq > last_seq]
+
+    def subscribe(
+        self, last_seq: Optional[int], heartbeat_seconds: float = 15.0
+    ) -> Iterator[Optional[ResultsEvent]]:
+        """
+        Yields the events after last_seq, then every new delta as it is flushed. A client that reconnects with the last
+        sequence id it saw resumes where it left off; a new client, or one that fell too far behind, starts with a
+        snapshot. None is yielded when nothing happened for heartbeat_seconds, so that the caller can keep the
+        connection alive.
+
+        :param: last_seq The last sequence id the client has seen, or None
+        :param: heartbeat_seconds How long to wait for a new event before yielding None
+        """
+        while not self._stopped.is_set():
+            with self._condition:
+                events = self._events_after(last_seq)
+                if not events:
+                    self._condition.wait(heartbeat_seconds)
+                    events = self._events_after(last_seq)
+
+            if not events:
+                yield None
+                continue
+
+            for event in events:
+                yield event
+            last_seq = events[-1].seq
+
+
+def stream_results(last_event_id: Optional[str]) -> Iterator[str]:
+    """
+    The Server-Sent Events body of /api/results/stream
+
+    :param: last_event_id The Last-Event-ID sent by a reconnecting client, if any
+    """
+    last_seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    for event in ResultsFeed.get_instance().subscribe(last_seq):
+        yield event.to_sse() if event is not None else ": keep-alive\n\n"
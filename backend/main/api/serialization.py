@@ -0,0 +1,100 @@
+#
+# This file serializes the responses of the REST API with explicit encoders, instead of jsons, which inspects every
+# object by reflection on every call. Candidates are turned into dicts field by field and encoded by one shared encoder;
+# every BallotStatus response body is encoded once, on first use.
+#
+# The wire format is versioned. Clients pick a version with the API-Version header, and API_VERSION sets the default:
+#
+# 1. (the default) the original format: /api/count_ballot returns the status as a JSON-encoded string inside the JSON
+#    body, e.g. {"status": "\"ballot counted\""}, and /api/get_all_candidates is served as text/html
+# 2. plain JSON: {"status": "ballot counted"}, and candidates served as application/json
+#
+
+import json
+import os
+from functools import lru_cache
+from typing import List, Optional
+
+from flask import Response
+
+from ..objects.candidate import Candidate
+from ..objects.voter import BallotStatus
+
+API_VERSION = "API_VERSION"
+API_VERSION_HEADER = "API-Version"
+WIRE_FORMAT_V1 = 1
+WIRE_FORMAT_V2 = 2
+SUPPORTED_VERSIONS = (WIRE_FORMAT_V1, WIRE_FORMAT_V2)
+
+JSON_MIMETYPE = "application/json"
+# Version 1 served candidates as the string returned by the view, which Flask sends as HTML
+LEGACY_CANDIDATES_MIMETYPE = "text/html"
+
+
+@lru_cache(maxsize=None)
+def _encoder():
+    """
+    The encoder shared by every response. Its settings match json.dumps' defaults, which jsons and FlaskAPI use too.
+    """
+    return json.JSONEncoder(ensure_ascii=True, separators=(", ", ": "))
+
+
+def requested_version(header: Optional[str]) -> int:
+    """
+    :param: header The API-Version header of the request, if any
+    :returns: The wire format version to answer with
+    :raises: ValueError if the version isn't supported
+    """
+    version = header or os.getenv(API_VERSION) or str(WIRE_FORMAT_V1)
+    if version not in [str(supported) for supported in SUPPORTED_VERSIONS]:
+        raise ValueError(
+            "Unsupported {0}: {1}. Supported versions are {2}".format(
+                API_VERSION_HEADER,
+                version,
+                ", ".join(str(supported) for supported in SUPPORTED_VERSIONS),
+            )
+        )
+    return int(version)
+
+
+def encode_candidate(candidate: Candidate) -> dict:
+    return {"candidate_id": candidate.candidate_id, "name": candidate.name}
+
+
+def encode_candidates(candidates: List[Candidate]) -> str:
+    return _encoder().encode([encode_candidate(candidate) for candidate in candidates])
+
+
+@lru_cache(maxsize=None)
+def encode_ballot_status(ballot_status: BallotStatus, version: int) -> bytes:
+    """
+    The response body of /api/count_ballot for a status. There are only a few statuses, so each body is encoded once.
+    """
+    encoder = _encoder()
+    status = ballot_status.value
+    if version == WIRE_FORMAT_V1:
+        status = encoder.encode(status)
+    return encoder.encode({"status": status}).encode("utf-8")
+
+
+def candidates_response(candidates: List[Candidate], version: int) -> Response:
+    return Response(
+        encode_candidates(candidates),
+        mimetype=(
+            LEGACY_CANDIDATES_MIMETYPE if version == WIRE_FORMAT_V1 else JSON_MIMETYPE
+        ),
+    )
+
+
+def ballot_status_response(
+    ballot_status: BallotStatus,
+    version: int,
+    http_status: int,
+    headers: Optional[dict] = None,
+) -> Response:
+    return Response(
+        encode_ballot_status(ballot_status, version),
+        status=http_status,
+        mimetype=JSON_MIMETYPE,
+        headers=headers,
+    )
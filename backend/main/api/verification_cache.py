@@ -0,0 +1,181 @@
+#
+# This file remembers recent successful ballot ownership checks, so that count_ballot doesn't repeat the bcrypt check
+# verify_ballot has just made for the same voter and ballot. Entries are bounded in number and expire after a short
+# while. Neither national ids nor ballot numbers are kept: entries are found by an HMAC of the ballot number and matched
+# on an HMAC of the (national id, ballot number) pair, under a random key that never leaves the process.
+#
+# Only ownership is cached. Whether the ballot is still valid is checked against the store every time, and
+# invalidate_ballot evicts the ballot's entry as well.
+#
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from . import metrics
+
+BALLOT_VERIFICATION_CACHE_MAX_ENTRIES = "BALLOT_VERIFICATION_CACHE_MAX_ENTRIES"
+BALLOT_VERIFICATION_CACHE_TTL_SECONDS = "BALLOT_VERIFICATION_CACHE_TTL_SECONDS"
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_TTL_SECONDS = 60.0
+# Smoothing factor of the moving average of bcrypt check times, used to estimate the time saved by hits
+CHECK_TIME_SMOOTHING = 0.2
+
+
+class VerificationCache:
+    """
+    A singleton cache of successful ballot ownership checks.
+
+    >>> cache = VerificationCache.get_instance()
+    >>> cache.is_verified(national_id, ballot_number)   # True if the pair was checked recently
+    >>> cache.record_check(national_id, ballot_number, seconds)   # after a successful bcrypt check
+    >>> cache.evict(ballot_number)
+    """
+
+    verification_cache_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> "VerificationCache":
+        if VerificationCache.verification_cache_instance is None:
+            with VerificationCache._instance_lock:
+                if VerificationCache.verification_cache_instance is None:
+                    VerificationCache.verification_cache_instance = VerificationCache(
+                        int(
+                            os.getenv(
+                                BALLOT_VERIFICATION_CACHE_MAX_ENTRIES,
+                                DEFAULT_MAX_ENTRIES,
+                            )
+                        ),
+                        float(
+                            os.getenv(
+                                BALLOT_VERIFICATION_CACHE_TTL_SECONDS,
+                                DEFAULT_TTL_SECONDS,
+                            )
+                        ),
+                    )
+
+        return VerificationCache.verification_cache_instance
+
+    @staticmethod
+    def configure(
+        max_entries: int,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> "VerificationCache":
+        """
+        Replaces the cache singleton. A max_entries of 0 turns the cache off.
+        """
+        with VerificationCache._instance_lock:
+            VerificationCache.verification_cache_instance = VerificationCache(
+                max_entries, ttl_seconds, clock
+            )
+
+            return VerificationCache.verification_cache_instance
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        DO NOT call this method directly - instead use the VerificationCache.get_instance method above.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._key = os.urandom(32)
+        # HMAC of the ballot number -> (HMAC of the pair, expiry time), oldest first
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self._average_check_seconds = 0.0
+
+    def _digest(self, *fields: str) -> bytes:
+        return hmac.new(
+            self._key, "\x00".join(fields).encode("utf-8"), hashlib.sha256
+        ).digest()
+
+    def is_verified(self, national_id: str, ballot_number: str) -> bool:
+        """
+        Whether the ballot was recently checked to belong to the voter. Counts a hit or a miss.
+        """
+        ballot_digest = self._digest(ballot_number)
+        pair_digest = self._digest(national_id, ballot_number)
+        with self._lock:
+            entry = self._entries.get(ballot_digest)
+            verified = (
+                entry is not None
+                and entry[1] > self._clock()
+                and entry[0] == pair_digest
+            )
+            if verified:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return verified
+
+    def record_check(self, national_id: str, ballot_number: str, seconds: float):
+        """
+        Remembers that the ballot was checked to belong to the voter, with a bcrypt check that took seconds
+        """
+        ballot_digest = self._digest(ballot_number)
+        pair_digest = self._digest(national_id, ballot_number)
+        now = self._clock()
+        with self._lock:
+            self._average_check_seconds += CHECK_TIME_SMOOTHING * (
+                seconds - self._average_check_seconds
+            )
+            if self.max_entries <= 0:
+                return
+            self._entries.pop(ballot_digest, None)
+            self._entries[ballot_digest] = (pair_digest, now + self.ttl_seconds)
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or next(iter(self._entries.values()))[1] <= now
+            ):
+                self._entries.popitem(last=False)
+
+    def evict(self, ballot_number: str):
+        """
+        Forgets the checks of a ballot, e.g. once it is counted or invalidated
+        """
+        ballot_digest = self._digest(ballot_number)
+        with self._lock:
+            self._entries.pop(ballot_digest, None)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        """
+        An estimate of the bcrypt time saved by hits, from the average time of the checks made
+        """
+        return self.hits * self._average_check_seconds
+
+
+metrics.register_gauge(
+    "ballot_verification_cache.hits", lambda: VerificationCache.get_instance().hits
+)
+metrics.register_gauge(
+    "ballot_verification_cache.misses", lambda: VerificationCache.get_instance().misses
+)
+metrics.register_gauge(
+    "ballot_verification_cache.hit_rate",
+    lambda: VerificationCache.get_instance().hit_rate,
+)
+metrics.register_gauge(
+    "ballot_verification_cache.seconds_saved",
+    lambda: VerificationCache.get_instance().seconds_saved,
+)
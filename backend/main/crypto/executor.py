@@ -0,0 +1,227 @@
+#
+# This file is the process-wide crypto executor. Every CPU-heavy crypto call in the backend goes through it, so that one
+# component owns how many cores crypto may use. With CRYPTO_EXECUTOR_WORKERS > 0, tasks run on a long-lived pool of
+# warm worker processes, behind a bounded priority queue: casting runs before issuance, which runs before reporting.
+# Lower priorities may only fill part of the queue, so that they are refused first and casting always finds room. With
+# CRYPTO_EXECUTOR_WORKERS unset or 0, tasks run inline on the calling thread, which is what tests and CLI tools want.
+#
+
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Callable
+
+from . import primitives
+
+CRYPTO_EXECUTOR_WORKERS = "CRYPTO_EXECUTOR_WORKERS"
+CRYPTO_EXECUTOR_MAX_QUEUE = "CRYPTO_EXECUTOR_MAX_QUEUE"
+DEFAULT_MAX_QUEUE = 1024
+
+
+class Priority(IntEnum):
+    """
+    The priority of a crypto task. Lower values run first.
+    """
+
+    CASTING = 0
+    ISSUANCE = 1
+    REPORTING = 2
+
+
+# The share of the queue that tasks of each priority may fill
+QUEUE_SHARES = {
+    Priority.CASTING: 1.0,
+    Priority.ISSUANCE: 0.75,
+    Priority.REPORTING: 0.5,
+}
+
+
+class CryptoQueueFull(Exception):
+    """
+    Raised when a task is submitted while the executor's queue is full, for its priority
+    """
+
+
+_STOP = object()
+
+
+class CryptoExecutor:
+    """
+    A singleton that runs crypto tasks by priority on a pool of worker processes.
+
+    >>> executor = CryptoExecutor.get_instance()
+    >>> executor.run(Priority.CASTING, primitives.bcrypt_check, secret, hashed)   # blocks until done
+    >>> await executor.run_async(Priority.REPORTING, primitives.aes_siv_decrypt, key, ciphertext)
+    """
+
+    crypto_executor_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> "CryptoExecutor":
+        if CryptoExecutor.crypto_executor_instance is None:
+            with CryptoExecutor._instance_lock:
+                if CryptoExecutor.crypto_executor_instance is None:
+                    CryptoExecutor.crypto_executor_instance = CryptoExecutor(
+                        int(os.getenv(CRYPTO_EXECUTOR_WORKERS, 0)),
+                        int(os.getenv(CRYPTO_EXECUTOR_MAX_QUEUE, DEFAULT_MAX_QUEUE)),
+                    )
+
+        return CryptoExecutor.crypto_executor_instance
+
+    @staticmethod
+    def configure(workers: int, max_queue: int = DEFAULT_MAX_QUEUE) -> "CryptoExecutor":
+        """
+        Replaces the executor singleton, shutting the previous one down
+        """
+        with CryptoExecutor._instance_lock:
+            if CryptoExecutor.crypto_executor_instance is not None:
+                CryptoExecutor.crypto_executor_instance.shutdown()
+            CryptoExecutor.crypto_executor_instance = CryptoExecutor(workers, max_queue)
+
+            return CryptoExecutor.crypto_executor_instance
+
+    def __init__(self, workers: int, max_queue: int):
+        """
+        DO NOT call this method directly - instead use the CryptoExecutor.get_instance method above.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.busy_workers = 0
+        self.queue_depth = 0
+        self._queue_limits = {
+            priority: max(1, int(max_queue * share))
+            for priority, share in QUEUE_SHARES.items()
+        }
+        self._sequence = itertools.count()
+        # Bounded by the limits above, rather than by the queue itself
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._queue_lock = threading.Lock()
+        self._busy_lock = threading.Lock()
+        self._pool = None
+        self._dispatchers = []
+
+        if workers > 0:
+            # Imported here like the crypto libraries: the process pool and asyncio pull in more modules than the rest
+            # of the store together (see test/import_budget_tests.py), and only a server with workers needs them
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, wait
+
+            # Workers are spawned rather than forked, because the server process is multi-threaded
+            self._pool = ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=primitives.warm_up,
+            )
+            wait([self._pool.submit(primitives.warm_up) for _ in range(workers)])
+
+            # One dispatcher per worker, so the pool never holds more than one task per worker and the priority queue
+            # decides what runs next
+            for index in range(workers):
+                dispatcher = threading.Thread(
+                    target=self._dispatch,
+                    name="crypto-dispatch-{0}".format(index),
+                    daemon=True,
+                )
+                dispatcher.start()
+                self._dispatchers.append(dispatcher)
+
+    def submit(self, priority: Priority, fn: Callable, *args) -> Future:
+        """
+        Submits a crypto task. fn must be a top-level function, such as one from main.crypto.primitives.
+
+        :raises: CryptoQueueFull if the queue is full, for the priority of the task
+        """
+        future: Future = Future()
+        if self._pool is None:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exception:
+                future.set_exception(exception)
+            return future
+
+        with self._queue_lock:
+            if self.queue_depth >= self._queue_limits[priority]:
+                raise CryptoQueueFull(
+                    "{0} crypto tasks are already queued".format(self.queue_depth)
+                )
+            self.queue_depth += 1
+        self._queue.put((priority, next(self._sequence), fn, args, future))
+        return future
+
+    def run(self, priority: Priority, fn: Callable, *args) -> Any:
+        """
+        Runs a crypto task and waits for its result
+        """
+        return self.submit(priority, fn, *args).result()
+
+    async def run_async(self, priority: Priority, fn: Callable, *args) -> Any:
+        """
+        Runs a crypto task without blocking the event loop
+        """
+        import asyncio
+
+        return await asyncio.wrap_future(self.submit(priority, fn, *args))
+
+    def _dispatch(self):
+        assert self._pool is not None
+        while True:
+            _, _, fn, args, future = self._queue.get()
+            if fn is _STOP:
+                return
+            with self._queue_lock:
+                self.queue_depth -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            with self._busy_lock:
+                self.busy_workers += 1
+            try:
+                future.set_result(self._pool.submit(fn, *args).result())
+            except BaseException as exception:
+                future.set_exception(exception)
+            finally:
+                with self._busy_lock:
+                    self.busy_workers -= 1
+
+    @staticmethod
+    def _after_fork_in_child():
+        """
+        Runs in every forked child. The dispatcher threads and the pool's management threads don't survive a fork, so
+        the child starts its own executor on first use.
+        """
+        CryptoExecutor._instance_lock = threading.Lock()
+        CryptoExecutor.crypto_executor_instance = None
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        # Stop markers sort after every real task, so queued work is drained first
+        for _ in self._dispatchers:
+            self._queue.put((len(Priority), next(self._sequence), _STOP, (), None))
+        for dispatcher in self._dispatchers:
+            dispatcher.join()
+        self._pool.shutdown()
+        self._pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=CryptoExecutor._after_fork_in_child)
+
+
+def run(priority: Priority, fn: Callable, *args) -> Any:
+    """
+    Runs a crypto task on the executor singleton and waits for its result
+    """
+    return CryptoExecutor.get_instance().run(priority, fn, *args)
+
+
+async def run_async(priority: Priority, fn: Callable, *args) -> Any:
+    """
+    Runs a crypto task on the executor singleton without blocking the event loop
+    """
+    return await CryptoExecutor.get_instance().run_async(priority, fn, *args)
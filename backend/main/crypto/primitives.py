@@ -0,0 +1,78 @@
+#
+# This file contains the CPU-heavy cryptographic primitives used by the backend, as plain top-level functions of bytes
+# and strings. They take every key they need as an argument and touch no global state, so the crypto executor can run
+# them in its worker processes.
+#
+
+from base64 import b64decode, b64encode
+from typing import Optional
+
+AES_SIV_NONCE_BYTES = 32
+
+
+def bcrypt_hash(secret: bytes) -> bytes:
+    """
+    Hashes a secret with bcrypt, under a fresh random salt of the default cost
+    """
+    import bcrypt
+
+    return bcrypt.hashpw(secret, bcrypt.gensalt())
+
+
+def bcrypt_check(secret: bytes, hashed: bytes) -> bool:
+    """
+    Checks a secret against a bcrypt hash
+    """
+    import bcrypt
+
+    return bcrypt.checkpw(secret, hashed)
+
+
+def aes_siv_encrypt(key: bytes, plaintext: str, kid: Optional[str] = None) -> str:
+    """
+    Encrypts a string with AES-SIV under a random nonce, so that equal plaintexts give different ciphertexts.
+
+    :param: kid The id of the key, recorded in the document so that the right key can be picked to decrypt it
+    :returns: A JSON document holding the base64-encoded nonce, ciphertext and tag, and the key id
+    """
+    import jsons
+    from Crypto.Cipher import AES
+    from Crypto.Random import get_random_bytes
+
+    nonce = get_random_bytes(AES_SIV_NONCE_BYTES)
+    cipher = AES.new(key, AES.MODE_SIV, nonce=nonce)
+
+    cipher.update(b"")
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext.encode("utf-8"))
+
+    json_v = [b64encode(x).decode("utf-8") for x in (nonce, ciphertext, tag)]
+    document = dict(zip(["nonce", "ciphertext", "tag"], json_v))
+    if kid is not None:
+        document["kid"] = kid
+    return jsons.dumps(document)
+
+
+def aes_siv_decrypt(key: bytes, encrypted: str) -> str:
+    """
+    Decrypts and authenticates a document produced by aes_siv_encrypt
+    """
+    import jsons
+    from Crypto.Cipher import AES
+
+    b64 = jsons.loads(encrypted)
+    json_dict = {k: b64decode(b64[k]) for k in ["nonce", "ciphertext", "tag"]}
+    cipher = AES.new(key, AES.MODE_SIV, nonce=json_dict["nonce"])
+    cipher.update(b"")
+
+    return cipher.decrypt_and_verify(json_dict["ciphertext"], json_dict["tag"]).decode(
+        "utf-8"
+    )
+
+
+def warm_up():
+    """
+    Imports the crypto dependencies, so that the first real task in a fresh worker doesn't pay for it
+    """
+    import bcrypt  # noqa: F401
+    import jsons  # noqa: F401
+    from Crypto.Cipher import AES  # noqa: F401
@@ -1,5 +1,6 @@
 import re
 
+from ..crypto.executor import Priority
 from ..objects.voter import Voter, decrypt_name
 
 REDACTED_PHONE_NUMBER = "[REDACTED PHONE NUMBER]"
@@ -13,15 +14,31 @@ EMAIL_REGEX = re.compile(r"\b\S+@\S+\.\S+\b")
 NATIONAL_ID_REGEX = re.compile(r"\b\d{3}(-|\s)?[\s\d]{2}(-|\s)?[\d]{4}\b")
 
 
-def redact_free_text(free_text: str, voter: Voter) -> str:
+def redact_free_text(
+    free_text: str, voter: Voter, priority: Priority = Priority.CASTING
+) -> str:
     """
     :param: free_text The free text to remove sensitive data from
+    :param: priority The crypto executor priority to decrypt the voter's names with. Redaction is on the casting path
+            unless comments are redacted in the background.
     :returns: The redacted free text
     """
 
-    first_name = decrypt_name(voter.first_name)
-    last_name = decrypt_name(voter.last_name)
+    first_name = decrypt_name(voter.first_name, priority=priority)
+    last_name = decrypt_name(voter.last_name, priority=priority)
 
+    return redact_free_text_with_names(free_text, first_name, last_name)
+
+
+def redact_free_text_with_names(free_text: str, first_name: str, last_name: str) -> str:
+    """
+    Like redact_free_text, with the voter's names already decrypted
+
+    :param: free_text The free text to remove sensitive data from
+    :param: first_name The voter's plaintext first name
+    :param: last_name The voter's plaintext last name
+    :returns: The redacted free text
+    """
     new_text = free_text.replace(first_name, REDACTED_NAME).replace(
         last_name, REDACTED_NAME
     )
@@ -0,0 +1,263 @@
+#
+# This file is the asynchronous comment redaction pipeline. With COMMENT_REDACTION_WORKERS > 0, count_ballot no longer
+# redacts comments itself: the ballot is committed right away without its comment, together with the raw comment in
+# quarantine, encrypted. A pool of background workers then redacts quarantined comments in batches, writes the redacted
+# comment to the ballot and deletes the raw copy, in one transaction. Comments only become visible (through
+# get_all_ballot_comments and comment search) once they are redacted. With COMMENT_REDACTION_WORKERS unset or 0,
+# comments are redacted inline, on the casting path.
+#
+# A quarantined comment is encrypted under its own key together with the voter's names, which redaction needs. The
+# names are decrypted when the comment is quarantined and re-encrypted in the same record, so the quarantine never holds
+# the voter's national id or a ciphertext from the voters table, which could be looked up there. Background redaction
+# requires COMMENT_QUARANTINE_KEY_AES_SIV to be configured: a comment quarantined under a key generated by the process
+# couldn't be read after a restart.
+#
+# A comment that keeps failing to redact is set aside after MAX_REDACTION_FAILURES attempts: its encrypted record is
+# destroyed, so the ballot keeps no comment, and it is reported on stderr and by the comment_redaction.set_aside metric.
+#
+
+import json
+import os
+import sys
+import threading
+from typing import List, Optional
+
+from ..crypto import executor, primitives
+from ..crypto.executor import Priority
+from ..objects.voter import Voter, decrypt_name
+from ..store.data_registry import VotingStore
+from ..store.keyring import KeyNotConfigured, Keyring
+from .pii_detection import redact_free_text_with_names
+
+COMMENT_REDACTION_WORKERS = "COMMENT_REDACTION_WORKERS"
+COMMENT_QUARANTINE_KEY_AES_SIV = "COMMENT_QUARANTINE_KEY_AES_SIV"
+DEFAULT_BATCH_SIZE = 64
+# How long a worker may hold a batch before other workers may claim it
+CLAIM_LEASE_SECONDS = 60.0
+# How often idle workers look for comments quarantined by other processes, or left behind by a worker that died
+POLL_INTERVAL_SECONDS = 1.0
+MAX_REDACTION_FAILURES = 5
+
+
+def quarantine_comment(comment: str, voter: Voter) -> str:
+    """
+    Encrypts a raw comment for quarantine, together with what redacting it needs to know about the voter.
+
+    :param: comment The raw comment
+    :param: voter The voter who wrote the comment, as read from the store, i.e. with encrypted names
+    :returns: The encrypted quarantine record
+    """
+    kid, key = Keyring.get_instance(COMMENT_QUARANTINE_KEY_AES_SIV).current()
+    # Never the ciphertexts from the voters table, which would link the ballot back to its voter
+    first_name = decrypt_name(voter.first_name, priority=Priority.CASTING)
+    last_name = decrypt_name(voter.last_name, priority=Priority.CASTING)
+    return executor.run(
+        Priority.CASTING,
+        primitives.aes_siv_encrypt,
+        key,
+        json.dumps([comment, first_name, last_name]),
+        kid,
+    )
+
+
+def redact_quarantined_comment(encrypted_comment: str) -> str:
+    """
+    Decrypts a quarantine record written by quarantine_comment, and redacts its comment
+    """
+    keyring = Keyring.get_instance(COMMENT_QUARANTINE_KEY_AES_SIV)
+    candidate_keys = keyring.decryption_keys(encrypted_comment)
+    if not candidate_keys:
+        raise Exception("No quarantine key can decrypt this comment")
+
+    comment, first_name, last_name = json.loads(
+        executor.run(
+            Priority.REPORTING,
+            primitives.aes_siv_decrypt,
+            candidate_keys[0],
+            encrypted_comment,
+        )
+    )
+    return redact_free_text_with_names(comment, first_name, last_name)
+
+
+class CommentRedactionPool:
+    """
+    A singleton pool of background threads that redact quarantined comments.
+
+    >>> pool = CommentRedactionPool.get_instance()
+    >>> pool.enabled   # whether count_ballot should quarantine comments
+    >>> pool.start()   # the server starts the workers on its first request
+    >>> pool.drain()   # or redact everything quarantined so far, on the calling thread
+    """
+
+    comment_redaction_pool_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> "CommentRedactionPool":
+        if CommentRedactionPool.comment_redaction_pool_instance is None:
+            with CommentRedactionPool._instance_lock:
+                if CommentRedactionPool.comment_redaction_pool_instance is None:
+                    CommentRedactionPool.comment_redaction_pool_instance = (
+                        CommentRedactionPool(
+                            int(os.getenv(COMMENT_REDACTION_WORKERS, 0))
+                        )
+                    )
+
+        return CommentRedactionPool.comment_redaction_pool_instance
+
+    @staticmethod
+    def configure(
+        workers: int, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> "CommentRedactionPool":
+        """
+        Replaces the pool singleton, stopping the previous one. The new pool's workers aren't started.
+        """
+        with CommentRedactionPool._instance_lock:
+            if CommentRedactionPool.comment_redaction_pool_instance is not None:
+                CommentRedactionPool.comment_redaction_pool_instance.stop()
+            CommentRedactionPool.comment_redaction_pool_instance = CommentRedactionPool(
+                workers, batch_size
+            )
+
+            return CommentRedactionPool.comment_redaction_pool_instance
+
+    def __init__(self, workers: int, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        DO NOT call this method directly - instead use the CommentRedactionPool.get_instance method above.
+
+        :raises: KeyNotConfigured if workers are asked for, but COMMENT_QUARANTINE_KEY_AES_SIV isn't set
+        """
+        if (
+            workers > 0
+            and not Keyring.get_instance(COMMENT_QUARANTINE_KEY_AES_SIV).has_key()
+        ):
+            raise KeyNotConfigured(
+                "{0} must be set to redact comments in the background".format(
+                    COMMENT_QUARANTINE_KEY_AES_SIV
+                )
+            )
+        self.workers = workers
+        self.batch_size = batch_size
+        self.redacted = 0
+        self.failed = 0
+        self.set_aside = 0
+        self._counter_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def run_batch(self, store: Optional[VotingStore] = None) -> int:
+        """
+        Claims a batch of quarantined comments, redacts them and writes them back.
+
+        :returns: The number of comments claimed
+        """
+        store = store or VotingStore.get_instance()
+        claimed = store.claim_quarantined_comments(
+            self.batch_size, CLAIM_LEASE_SECONDS, MAX_REDACTION_FAILURES
+        )
+        redactions = []
+        failures = []
+        for quarantine_id, ballot_number, encrypted_comment in claimed:
+            try:
+                redactions.append(
+                    (
+                        quarantine_id,
+                        ballot_number,
+                        redact_quarantined_comment(encrypted_comment),
+                    )
+                )
+            except Exception:
+                # Left in quarantine, and retried once the claim expires
+                failures.append(quarantine_id)
+
+        if failures:
+            set_aside = store.record_comment_redaction_failures(
+                failures, MAX_REDACTION_FAILURES
+            )
+            with self._counter_lock:
+                self.failed += len(failures)
+                self.set_aside += len(set_aside)
+            if set_aside:
+                print(
+                    "Set aside {0} quarantined comments that failed to redact {1} times: {2}".format(
+                        len(set_aside), MAX_REDACTION_FAILURES, set_aside
+                    ),
+                    file=sys.stderr,
+                )
+
+        if redactions:
+            store.complete_comment_redactions(redactions)
+            with self._counter_lock:
+                self.redacted += len(redactions)
+
+        return len(claimed)
+
+    def drain(self, store: Optional[VotingStore] = None) -> int:
+        """
+        Redacts every quarantined comment on the calling thread
+
+        :returns: The number of comments redacted
+        """
+        redacted_before = self.redacted
+        while self.run_batch(store):
+            pass
+
+        return self.redacted - redacted_before
+
+    def notify(self):
+        """
+        Wakes an idle worker up, after a comment was quarantined
+        """
+        self._wake_up.set()
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                if self.run_batch():
+                    continue
+            except Exception:
+                # e.g. the database is busy; the claimed comments are retried once their claim expires
+                with self._counter_lock:
+                    self.failed += 1
+            self._wake_up.wait(POLL_INTERVAL_SECONDS)
+            self._wake_up.clear()
+
+    def start(self):
+        """
+        Starts the workers, if the pool is enabled and they aren't running yet
+        """
+        with CommentRedactionPool._instance_lock:
+            if self._threads or not self.enabled:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    name="comment-redaction-{0}".format(index),
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake_up.set()
+        for thread in self._threads:
+            thread.join()
+
+    @staticmethod
+    def _after_fork_in_child():
+        """
+        Runs in every forked child. Threads don't survive a fork, so the child starts its own pool on first use.
+        """
+        CommentRedactionPool._instance_lock = threading.Lock()
+        CommentRedactionPool.comment_redaction_pool_instance = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=CommentRedactionPool._after_fork_in_child)
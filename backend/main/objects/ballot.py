@@ -1,5 +1,7 @@
-import bcrypt
+from typing import List, Optional
 
+from ..crypto import executor, primitives
+from ..crypto.executor import Priority
 from ..objects.voter import Voter
 
 
@@ -16,6 +18,20 @@ class Ballot:
         self.voter_comments = voter_comments
 
 
+class BallotCommentPage:
+    """
+    One page of the ballot comments that match a search, best matches first
+    """
+
+    def __init__(self, comments: List[str], next_cursor: Optional[str]):
+        """
+        :param: comments The matching comments of this page
+        :param: next_cursor The cursor of the next page, or None if this is the last page
+        """
+        self.comments = comments
+        self.next_cursor = next_cursor
+
+
 def generate_ballot_number(national_id: str) -> str:
     """
     Produces a ballot number. Feel free to add parameters to this method, if you feel those are necessary.
@@ -35,4 +51,6 @@ def generate_ballot_number(national_id: str) -> str:
 
     voter_identifier = str(national_id).encode("utf-8")
 
-    return bcrypt.hashpw(voter_identifier, bcrypt.gensalt()).decode("utf-8")
+    return executor.run(
+        Priority.ISSUANCE, primitives.bcrypt_hash, voter_identifier
+    ).decode("utf-8")
@@ -0,0 +1,105 @@
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ..objects.candidate import Candidate
+
+
+class CountingRule(Enum):
+    """
+    An enum that represents how a winner is determined from the per-candidate counts.
+    """
+
+    PLURALITY = "plurality"
+    MAJORITY = "majority"
+    SUPERMAJORITY = "supermajority"
+
+
+# The share of the counted votes a candidate must strictly exceed to win under each rule
+COUNTING_RULE_THRESHOLDS = {
+    CountingRule.PLURALITY: 0.0,
+    CountingRule.MAJORITY: 1 / 2,
+    CountingRule.SUPERMAJORITY: 2 / 3,
+}
+
+
+class ElectionTally:
+    """
+    Per-candidate vote counts for an election.
+
+    Candidates are ranked by descending count. Ties are broken deterministically by ascending candidate id, and are
+    reported through tied_leaders so that recount audits can see them.
+    """
+
+    def __init__(
+        self, candidates: List[Candidate], counts: List[int], rejected: int = 0
+    ):
+        """
+        :param: candidates Every registered candidate
+        :param: counts The number of votes for each candidate, in the same order as candidates
+        :param: rejected The number of ballots that didn't name a registered candidate
+        """
+        ranked = sorted(
+            zip(candidates, counts),
+            key=lambda entry: (-entry[1], int(entry[0].candidate_id)),
+        )
+        self.ranked_candidates = [candidate for candidate, _ in ranked]
+        self.counts: Dict[str, int] = {
+            candidate.candidate_id: count for candidate, count in ranked
+        }
+        self.total_votes = sum(counts)
+        self.rejected = rejected
+
+    def share(self, candidate_id: str) -> float:
+        """
+        The share of counted votes that went to the candidate, between 0 and 1
+        """
+        if self.total_votes == 0:
+            return 0.0
+        return self.counts[candidate_id] / self.total_votes
+
+    def shares(self) -> Dict[str, float]:
+        return {candidate_id: self.share(candidate_id) for candidate_id in self.counts}
+
+    def top(self, k: int) -> List[Candidate]:
+        """
+        The k candidates with the most votes, in rank order
+        """
+        return self.ranked_candidates[:k]
+
+    def tied_leaders(self) -> List[Candidate]:
+        """
+        All candidates that share the highest count. More than one entry means the lead is tied.
+        """
+        if self.total_votes == 0:
+            return []
+        top_count = self.counts[self.ranked_candidates[0].candidate_id]
+        return [
+            candidate
+            for candidate in self.ranked_candidates
+            if self.counts[candidate.candidate_id] == top_count
+        ]
+
+    def winner(
+        self, rule: CountingRule = CountingRule.PLURALITY
+    ) -> Optional[Candidate]:
+        """
+        The winner under the given counting rule, or None if no candidate meets it.
+        """
+        if self.total_votes == 0:
+            return None
+        leader = self.ranked_candidates[0]
+        if self.share(leader.candidate_id) <= COUNTING_RULE_THRESHOLDS[rule]:
+            return None
+        return leader
+
+
+class Turnout(NamedTuple):
+    """
+    Turnout of the election so far, read from counters the store keeps as voters are registered, vote and are flagged
+    """
+
+    registered: int
+    voted: int
+    fraud_flagged: int
+    # (start of the minute in seconds since the Unix epoch, ballots cast during it), oldest first
+    ballots_per_minute: List[Tuple[int, int]]
@@ -1,19 +1,30 @@
 #
 # This file contains classes that correspond to voters
 #
+# Encryption runs on the crypto executor, and pycryptodome is only imported once it is needed (see
+# main/crypto/primitives.py), so that importing this module (and everything that depends on it) stays cheap.
+#
 
 
 import hashlib
-from base64 import b64decode, b64encode
+import hmac
+import unicodedata
 from enum import Enum
+from typing import Optional, Union
 
-import jsons
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
-
-from ..store import secret_registry
+from ..crypto import executor, primitives
+from ..crypto.executor import Priority
+from ..store.keyring import Keyring
 
 NAME_ENCRYPTION_KEY_AES_SIV = "NAME_ENCRYPTION_KEY_AES_SIV"
+NAME_BLIND_INDEX_KEY_HMAC = "NAME_BLIND_INDEX_KEY_HMAC"
+
+# The precinct of voters registered without one
+DEFAULT_PRECINCT = "default"
+
+# Blind indexes are truncated so that many different names share an index value, which leaks less about the name
+BLIND_INDEX_BYTES = 8
+BLIND_INDEX_KEY_BYTES = 32
 
 
 def obfuscate_national_id(national_id: str) -> str:
@@ -29,51 +40,110 @@ def obfuscate_national_id(national_id: str) -> str:
     return hashlib.sha256(sanitized_national_id.encode("utf-8")).hexdigest()
 
 
-def encrypt_name(name: str) -> str:
+class VoterKey:
     """
-    Encrypts a name, non-deterministically.
+    A national id together with its obfuscated form, which is computed once. Requests build one VoterKey up front and
+    pass it through the registry, balloting and store APIs, instead of every layer obfuscating the raw national id again.
 
+    >>> key = VoterKey("111-11-1111")
+    >>> store.get_voter_by_key(key)
+    """
 
-    :param: name A plaintext name that is sensitive and needs to encrypt.
-    :return: The encrypted cipher text of the name.
-    """
-    expected_bytes = 32
-    name_encryption_key = secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY_AES_SIV)
-    if not name_encryption_key:
-        name_encryption_key = get_random_bytes(expected_bytes * 2)
-        secret_registry.overwrite_secret_bytes(
-            NAME_ENCRYPTION_KEY_AES_SIV, name_encryption_key
-        )
+    __slots__ = ("national_id", "obfuscated_national_id")
+
+    def __init__(self, national_id: str):
+        self.national_id = national_id
+        self.obfuscated_national_id = obfuscate_national_id(national_id)
+
+    @staticmethod
+    def of(national_id: Union[str, "VoterKey"]) -> "VoterKey":
+        """
+        Returns the argument if it is already a VoterKey, and builds one from a raw national id otherwise
+        """
+        if isinstance(national_id, VoterKey):
+            return national_id
+        return VoterKey(national_id)
+
+
+def encrypt_name(name: str, priority: Priority = Priority.ISSUANCE) -> str:
+    """
+    Encrypts a name, non-deterministically, under the current name encryption key.
 
-    nonce = get_random_bytes(expected_bytes)
-    cipher = AES.new(name_encryption_key, AES.MODE_SIV, nonce=nonce)
 
-    cipher.update(b"")
-    ciphertext, tag = cipher.encrypt_and_digest(name.encode("utf-8"))
+    :param: name A plaintext name that is sensitive and needs to encrypt.
+    :param: priority The crypto executor priority to encrypt with
+    :return: The encrypted cipher text of the name, which records the id of the key it was encrypted under.
+    """
+    kid, name_encryption_key = Keyring.get_instance(
+        NAME_ENCRYPTION_KEY_AES_SIV
+    ).current()
 
-    json_v = [b64encode(x).decode("utf-8") for x in (nonce, ciphertext, tag)]
-    return jsons.dumps(dict(zip(["nonce", "ciphertext", "tag"], json_v)))
+    return executor.run(
+        priority, primitives.aes_siv_encrypt, name_encryption_key, name, kid
+    )
 
 
-def decrypt_name(encrypted_name: str) -> str:
+def decrypt_name(
+    encrypted_name: str,
+    name_encryption_key: Optional[bytes] = None,
+    priority: Priority = Priority.REPORTING,
+) -> str:
     """
     Decrypts a name. This is the inverse of the encrypt_name method above.
 
     :param: encrypted_name The ciphertext of a name that is sensitive
+    :param: name_encryption_key The key to decrypt with. Defaults to the key in the keyring that the name was encrypted
+            under.
+    :param: priority The crypto executor priority to decrypt with
     :return: The plaintext name
     """
-    name_encryption_key = secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY_AES_SIV)
-    if name_encryption_key is None:
-        raise Exception()
+    if name_encryption_key is not None:
+        candidate_keys = [name_encryption_key]
+    else:
+        candidate_keys = Keyring.get_instance(
+            NAME_ENCRYPTION_KEY_AES_SIV
+        ).decryption_keys(encrypted_name)
+    if not candidate_keys:
+        raise Exception("No name encryption key can decrypt this name")
+
+    # Only names encrypted before key ids existed can have more than one candidate key
+    for candidate_key in candidate_keys[:-1]:
+        try:
+            return executor.run(
+                priority, primitives.aes_siv_decrypt, candidate_key, encrypted_name
+            )
+        except ValueError:
+            continue
+
+    return executor.run(
+        priority, primitives.aes_siv_decrypt, candidate_keys[-1], encrypted_name
+    )
 
-    b64 = jsons.loads(encrypted_name)
-    json_dict = {k: b64decode(b64[k]) for k in ["nonce", "ciphertext", "tag"]}
-    cipher = AES.new(name_encryption_key, AES.MODE_SIV, nonce=json_dict["nonce"])
-    cipher.update(b"")
 
-    return cipher.decrypt_and_verify(json_dict["ciphertext"], json_dict["tag"]).decode(
-        "utf-8"
-    )
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a name for searching, so that differences in case, whitespace and unicode form don't matter
+    """
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+def blind_index_name(name: str) -> str:
+    """
+    Produces a keyed, deterministic, truncated digest of a name. Unlike encrypt_name, the same name always produces the
+    same value, so it can be indexed and searched on; without the key, it reveals nothing about the name.
+
+    :param: name A plaintext name that is sensitive
+    :return: The hex-encoded blind index of the normalized name
+    :raises: KeyNotConfigured if NAME_BLIND_INDEX_KEY_HMAC isn't set (see main/store/keyring.py)
+    """
+    # Blind indexes are only ever compared, so there is just the current key and it can't be rotated in place
+    _, blind_index_key = Keyring.get_instance(
+        NAME_BLIND_INDEX_KEY_HMAC, BLIND_INDEX_KEY_BYTES
+    ).current()
+    digest = hmac.new(
+        blind_index_key, normalize_name(name).encode("utf-8"), hashlib.sha256
+    ).digest()
+    return digest[:BLIND_INDEX_BYTES].hex()
 
 
 class MinimalVoter:
@@ -89,12 +159,18 @@ class MinimalVoter:
         obfuscated_national_id: str,
         voted: bool,
         fraud_commited: bool,
+        first_name_index: Optional[str] = None,
+        last_name_index: Optional[str] = None,
+        precinct: str = DEFAULT_PRECINCT,
     ):
         self.obfuscated_national_id = obfuscated_national_id
         self.obfuscated_first_name = obfuscated_first_name
         self.obfuscated_last_name = obfuscated_last_name
         self.voted = voted
         self.fraud_commited = fraud_commited
+        self.first_name_index = first_name_index
+        self.last_name_index = last_name_index
+        self.precinct = precinct
 
 
 class Voter:
@@ -111,23 +187,31 @@ class Voter:
         national_id: str,
         voted=False,
         fraud_commited=False,
+        precinct: str = DEFAULT_PRECINCT,
     ):
         self.national_id = national_id
         self.first_name = first_name
         self.last_name = last_name
         self.voted = voted
         self.fraud_commited = fraud_commited
+        self.precinct = precinct
 
-    def get_minimal_voter(self) -> MinimalVoter:
+    def get_minimal_voter(self, key: Optional[VoterKey] = None) -> MinimalVoter:
         """
         Converts this object (self) into its obfuscated version
+
+        :param: key The voter's key, if the caller already has one, so that the national id isn't obfuscated again
         """
+        key = key or VoterKey(self.national_id)
         return MinimalVoter(
             encrypt_name(self.first_name.strip()),
             encrypt_name(self.last_name.strip()),
-            obfuscate_national_id(self.national_id),
+            key.obfuscated_national_id,
             self.voted,
             self.fraud_commited,
+            blind_index_name(self.first_name),
+            blind_index_name(self.last_name),
+            self.precinct,
         )
 
 
@@ -151,4 +235,5 @@ class BallotStatus(Enum):
     INVALID_BALLOT = "the ballot given is invalid"
     FRAUD_COMMITTED = "fraud committed: the voter has already voted"
     VOTER_NOT_REGISTERED = "voter not registered"
+    INVALID_CANDIDATE = "the candidate chosen is not registered"
     BALLOT_COUNTED = "ballot counted"
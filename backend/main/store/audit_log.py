@@ -0,0 +1,428 @@
+#
+# This file is an append-only audit log of balloting events. Every event is a fixed-size binary record, so the log can
+# be memory-mapped and replayed or verified without parsing. Records only ever hold obfuscated identifiers: the
+# obfuscated national id for voter events, and a SHA-256 digest of the ballot number for ballot events. Counted
+# ballots are never linked to a voter.
+#
+# The log is disabled unless the BALLOT_AUDIT_LOG environment variable names a file to write to.
+#
+# Several processes, such as the workers of main/api/prefork.py, may append to the same log. Each batch is written under
+# an exclusive lock on the file, and takes its sequence ids from the records already in the file at that point.
+#
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from enum import IntEnum
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from ..objects.voter import VoterKey
+
+BALLOT_AUDIT_LOG = "BALLOT_AUDIT_LOG"
+
+MAGIC = b"BALLOTAL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+# seq, timestamp, event, padding, candidate id, subject digest
+RECORD = struct.Struct("<QdB3xi32s")
+
+# Records are fsynced once this many are pending, or after this many seconds, whichever comes first
+DEFAULT_FSYNC_BATCH = 256
+DEFAULT_FSYNC_INTERVAL_SECONDS = 0.05
+
+# Replay converts records to Python objects this many at a time, to keep memory bounded
+REPLAY_BATCH_SIZE = 65536
+
+
+class AuditEvent(IntEnum):
+    """
+    The kinds of event recorded in the audit log. These values are written to disk, so never renumber them.
+    """
+
+    BALLOT_ISSUED = 1
+    BALLOT_COUNTED = 2
+    BALLOT_INVALIDATED = 3
+    FRAUD_FLAGGED = 4
+    VOTER_DEREGISTERED = 5
+
+
+class AuditRecord(NamedTuple):
+    seq: int
+    timestamp: float
+    event: AuditEvent
+    candidate_id: int
+    subject: bytes
+
+
+class AuditLog:
+    """
+    A singleton writer for the audit log. Appends are buffered and fsynced in batches.
+    """
+
+    audit_log_instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> Optional["AuditLog"]:
+        """
+        Returns the audit log configured by BALLOT_AUDIT_LOG, or None if auditing is disabled
+        """
+        if AuditLog.audit_log_instance is None and os.getenv(BALLOT_AUDIT_LOG):
+            AuditLog.configure(os.environ[BALLOT_AUDIT_LOG])
+
+        return AuditLog.audit_log_instance
+
+    @staticmethod
+    def configure(path: Optional[str], **kwargs) -> Optional["AuditLog"]:
+        """
+        Points the audit log singleton at path, closing the previous log. A path of None disables auditing.
+        """
+        with AuditLog._instance_lock:
+            if AuditLog.audit_log_instance is not None:
+                AuditLog.audit_log_instance.close()
+            AuditLog.audit_log_instance = AuditLog(path, **kwargs) if path else None
+
+            return AuditLog.audit_log_instance
+
+    def __init__(
+        self,
+        path: str,
+        fsync_batch: int = DEFAULT_FSYNC_BATCH,
+        fsync_interval_seconds: float = DEFAULT_FSYNC_INTERVAL_SECONDS,
+    ):
+        """
+        DO NOT call this method directly - instead use the AuditLog.configure method above.
+        """
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval_seconds = fsync_interval_seconds
+
+        self._file = open(path, "a+b")
+        with self._file_locked():
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() == 0:
+                self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            else:
+                self._file.seek(0)
+                _check_header(self._file.read(HEADER.size))
+            self._read_tail()
+
+        # (timestamp, event, candidate id, subject) of the records not written yet. Sequence ids are assigned as they
+        # are written.
+        self._pending: List[Tuple[float, AuditEvent, int, bytes]] = []
+        self._last_timestamp = 0.0
+        self._pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="audit-log-fsync", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def append(self, event: AuditEvent, subject: bytes, candidate_id: int = 0):
+        """
+        Appends an event to the log. It is durable once the batch it belongs to has been fsynced.
+
+        :param: event The kind of event
+        :param: subject A 32 byte obfuscated identifier of the voter or ballot the event is about
+        :param: candidate_id The chosen candidate, for counted ballots
+        """
+        with self._lock:
+            if self._closed.is_set():
+                return
+            # Timestamps never go backwards, even if the wall clock does
+            self._last_timestamp = max(time.time(), self._last_timestamp)
+            self._pending.append((self._last_timestamp, event, candidate_id, subject))
+            if len(self._pending) >= self.fsync_batch:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    @contextlib.contextmanager
+    def _file_locked(self):
+        """
+        Holds the exclusive lock on the log file, which every process appending to it takes for each write
+        """
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _read_tail(self) -> Tuple[int, float]:
+        """
+        Drops a torn record at the tail (from a crash mid-write), and reads the log's last record. The caller must hold
+        the file lock.
+
+        :returns: The next sequence id, and the timestamp of the last record
+        """
+        self._file.seek(0, os.SEEK_END)
+        complete_records = (self._file.tell() - HEADER.size) // RECORD.size
+        self._file.truncate(HEADER.size + complete_records * RECORD.size)
+        if not complete_records:
+            return 1, 0.0
+
+        self._file.seek(HEADER.size + (complete_records - 1) * RECORD.size)
+        seq, timestamp, _, _, _ = RECORD.unpack(self._file.read(RECORD.size))
+        self._file.seek(0, os.SEEK_END)
+        return seq + 1, timestamp
+
+    def _flush_locked(self):
+        if not self._pending or self._file.closed or os.getpid() != self._pid:
+            return
+        with self._file_locked():
+            next_seq, last_timestamp = self._read_tail()
+            records = []
+            for timestamp, event, candidate_id, subject in self._pending:
+                # Another process may have written later records since these were appended
+                last_timestamp = max(timestamp, last_timestamp)
+                records.append(
+                    RECORD.pack(next_seq, last_timestamp, event, candidate_id, subject)
+                )
+                next_seq += 1
+            self._file.write(b"".join(records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = []
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.fsync_interval_seconds):
+            self.flush()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            self._closed.set()
+            if os.getpid() == self._pid:
+                self._file.close()
+
+    @staticmethod
+    def _before_fork():
+        """
+        Runs in the parent before every fork, so that the child doesn't inherit records the parent will write
+        """
+        audit_log = AuditLog.audit_log_instance
+        if audit_log is not None:
+            audit_log.flush()
+
+    @staticmethod
+    def _after_fork_in_child():
+        """
+        Runs in every forked child. The fsync thread doesn't survive a fork, so the child opens its own log on first use.
+        The inherited log is left to the parent: it never writes from the child.
+        """
+        AuditLog._instance_lock = threading.Lock()
+        AuditLog.audit_log_instance = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=AuditLog._before_fork, after_in_child=AuditLog._after_fork_in_child
+    )
+
+
+def _check_header(header: bytes):
+    if len(header) < HEADER.size:
+        raise ValueError("Not an audit log: the header is truncated")
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not an audit log: bad magic {0!r}".format(magic))
+    if version != FORMAT_VERSION or record_size != RECORD.size:
+        raise ValueError(
+            "Unsupported audit log version {0} with {1} byte records".format(
+                version, record_size
+            )
+        )
+
+
+#
+# Recording
+#
+
+
+def voter_subject(national_id: Union[str, VoterKey]) -> bytes:
+    """
+    The audit subject of a voter: their obfuscated national id, as raw bytes
+    """
+    return bytes.fromhex(VoterKey.of(national_id).obfuscated_national_id)
+
+
+def ballot_subject(ballot_number: str) -> bytes:
+    """
+    The audit subject of a ballot: a digest of its ballot number
+    """
+    return hashlib.sha256(ballot_number.encode("utf-8")).digest()
+
+
+def record_ballot_issued(national_id: Union[str, VoterKey]):
+    audit_log = AuditLog.get_instance()
+    if audit_log is not None:
+        audit_log.append(AuditEvent.BALLOT_ISSUED, voter_subject(national_id))
+
+
+def record_ballot_counted(ballot_number: str, candidate_id: str):
+    audit_log = AuditLog.get_instance()
+    if audit_log is not None:
+        candidate = int(candidate_id) if str(candidate_id).isdigit() else 0
+        audit_log.append(
+            AuditEvent.BALLOT_COUNTED,
+            ballot_subject(ballot_number),
+            candidate if candidate < 2**31 else 0,
+        )
+
+
+def record_ballot_invalidated(ballot_number: str):
+    audit_log = AuditLog.get_instance()
+    if audit_log is not None:
+        audit_log.append(AuditEvent.BALLOT_INVALIDATED, ballot_subject(ballot_number))
+
+
+def record_fraud_flagged(national_id: Union[str, VoterKey]):
+    audit_log = AuditLog.get_instance()
+    if audit_log is not None:
+        audit_log.append(AuditEvent.FRAUD_FLAGGED, voter_subject(national_id))
+
+
+def record_voter_deregistered(national_id: Union[str, VoterKey]):
+    audit_log = AuditLog.get_instance()
+    if audit_log is not None:
+        audit_log.append(AuditEvent.VOTER_DEREGISTERED, voter_subject(national_id))
+
+
+#
+# Replay
+#
+
+
+class AuditLogReader:
+    """
+    A memory-mapped, read-only view of an audit log. Verification and tally rebuilding are vectorized with numpy.
+
+    >>> with AuditLogReader(path) as reader:
+    ...     reader.verify()
+    ...     counts = reader.rebuild_counts()
+    """
+
+    def __init__(self, path: str):
+        import numpy as np
+
+        self._file = open(path, "rb")
+        _check_header(self._file.read(HEADER.size))
+        size = os.fstat(self._file.fileno()).st_size
+        count = (size - HEADER.size) // RECORD.size
+
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if count
+            else None
+        )
+        dtype = np.dtype(
+            {
+                "names": ["seq", "timestamp", "event", "candidate_id", "subject"],
+                "formats": ["<u8", "<f8", "u1", "<i4", "V32"],
+                "offsets": [0, 8, 16, 20, 24],
+                "itemsize": RECORD.size,
+            }
+        )
+        self.records = (
+            np.frombuffer(self._mmap, dtype=dtype, count=count, offset=HEADER.size)
+            if self._mmap is not None
+            else np.zeros(0, dtype=dtype)
+        )
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # numpy views keep the mmap exported, so they have to go first
+        self.records = None
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def replay(self) -> Iterator[AuditRecord]:
+        """
+        Yields every event in the log, in the order it was written
+        """
+        events = {int(event): event for event in AuditEvent}
+        new_record = AuditRecord.__new__
+        for start in range(0, len(self.records), REPLAY_BATCH_SIZE):
+            batch = self.records[start : start + REPLAY_BATCH_SIZE].tolist()
+            for seq, timestamp, event, candidate_id, subject in batch:
+                yield new_record(
+                    AuditRecord, seq, timestamp, events[event], candidate_id, subject
+                )
+
+    def verify(self):
+        """
+        Checks that sequence ids are contiguous, timestamps never go backwards and every event type is known.
+
+        :raises: ValueError describing the first problem found
+        """
+        import numpy as np
+
+        if not len(self.records):
+            return
+
+        seqs = self.records["seq"]
+        bad_seq = np.flatnonzero(seqs != np.arange(1, len(seqs) + 1, dtype=np.uint64))
+        if len(bad_seq):
+            raise ValueError(
+                "Sequence gap at record {0}: found seq {1}".format(
+                    bad_seq[0], seqs[bad_seq[0]]
+                )
+            )
+
+        bad_time = np.flatnonzero(np.diff(self.records["timestamp"]) < 0)
+        if len(bad_time):
+            raise ValueError(
+                "Timestamp goes backwards at seq {0}".format(seqs[bad_time[0] + 1])
+            )
+
+        known_events = np.array([int(event) for event in AuditEvent], dtype=np.uint8)
+        bad_event = np.flatnonzero(~np.isin(self.records["event"], known_events))
+        if len(bad_event):
+            raise ValueError("Unknown event type at seq {0}".format(seqs[bad_event[0]]))
+
+    def event_counts(self) -> Dict[AuditEvent, int]:
+        import numpy as np
+
+        counts = np.bincount(self.records["event"], minlength=max(AuditEvent) + 1)
+        return {event: int(counts[event]) for event in AuditEvent}
+
+    def rebuild_counts(self) -> Dict[str, int]:
+        """
+        Rebuilds the number of counted ballots per candidate id from the log alone
+        """
+        import numpy as np
+
+        counted = self.records["candidate_id"][
+            self.records["event"] == AuditEvent.BALLOT_COUNTED
+        ]
+        counted = counted[counted > 0]
+        if not len(counted):
+            return {}
+        bins = np.bincount(counted)
+
+        return {
+            str(candidate_id): int(bins[candidate_id])
+            for candidate_id in np.flatnonzero(bins)
+        }
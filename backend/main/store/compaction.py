@@ -0,0 +1,113 @@
+#
+# This file is the background job that hands the pages freed by deletes, such as bulk de-registrations, back to the file
+# system. SQLite keeps freed pages in the database file for reuse, so without it the file never shrinks. The job runs
+# incremental_vacuum a few pages at a time, and only holds the database for one step at a time, so balloting keeps going
+# while it runs.
+#
+# Database files created before incremental vacuuming was turned on need one full VACUUM first; see
+# python -m main.api.registry de-register --vacuum.
+#
+
+import threading
+import time
+from typing import Callable, Optional
+
+from .data_registry import VotingStore
+
+DEFAULT_PAGES_PER_STEP = 256
+DEFAULT_PAUSE_SECONDS = 0.05
+
+
+class CompactionJob:
+    """
+    Reclaims every free page of the database.
+
+    >>> job = CompactionJob()
+    >>> job.start()   # one pass, in a background thread
+    >>> job.reclaimed_bytes, job.finished
+    """
+
+    def __init__(
+        self,
+        store: Optional[VotingStore] = None,
+        pages_per_step: int = DEFAULT_PAGES_PER_STEP,
+        pause_seconds: float = DEFAULT_PAUSE_SECONDS,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.store = store or VotingStore.get_instance()
+        self.pages_per_step = pages_per_step
+        self.pause_seconds = pause_seconds
+        self._sleep = sleep
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.reclaimed_bytes = 0
+        self.finished = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_step(self) -> int:
+        """
+        Reclaims up to pages_per_step free pages.
+
+        :returns: The number of bytes reclaimed
+        """
+        page_size, _, _ = self.store.get_page_usage()
+        reclaimed_bytes = self.store.incremental_vacuum(self.pages_per_step) * page_size
+        self.reclaimed_bytes += reclaimed_bytes
+        return reclaimed_bytes
+
+    def run(self) -> int:
+        """
+        Reclaims free pages until there are none left, pausing between steps. Does nothing if the database isn't set up
+        for incremental vacuuming.
+
+        :returns: The number of bytes reclaimed
+        """
+        reclaimed_before = self.reclaimed_bytes
+        if self.store.is_incrementally_vacuumed():
+            while not self._stopped.is_set():
+                if not self.run_step():
+                    break
+                self._sleep(self.pause_seconds)
+            self.store.checkpoint()
+        self.finished = not self._stopped.is_set()
+
+        return self.reclaimed_bytes - reclaimed_before
+
+    def start(self):
+        """
+        Runs one pass in a background thread
+        """
+        self._thread = threading.Thread(target=self.run, name="compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+
+_job_lock = threading.Lock()
+_running_job: Optional[CompactionJob] = None
+
+
+def start_compaction(store: Optional[VotingStore] = None) -> CompactionJob:
+    """
+    Starts a compaction pass in the background, unless one is already running.
+
+    :returns: The running job
+    """
+    global _running_job
+    with _job_lock:
+        if _running_job is None or not _running_job.running:
+            _running_job = CompactionJob(store)
+            _running_job.start()
+
+        return _running_job
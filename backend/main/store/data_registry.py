@@ -1,14 +1,104 @@
 #
 # This file is the interface between the stores and the database
 #
+# By default the store is an in-memory database private to the process. Set VOTING_STORE_DATABASE to the path of a
+# database file to share one store between processes, such as the workers of main/api/prefork.py. The file is opened in
+# WAL mode, so readers never block the writer, and SQLite's file locks serialize writers across processes.
+#
 
+import os
+import pathlib
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection
-from typing import List, Set
+from types import MappingProxyType
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from ..objects.ballot import Ballot
 from ..objects.candidate import Candidate
-from ..objects.voter import MinimalVoter, Voter, obfuscate_national_id
+from ..objects.voter import DEFAULT_PRECINCT, MinimalVoter, Voter, VoterKey
+
+VOTING_STORE_DATABASE = "VOTING_STORE_DATABASE"
+# How long a connection waits for another process to release the database before giving up
+BUSY_TIMEOUT_MILLISECONDS = 10_000
+# Minutes of ballots cast kept by the turnout ring buffer, one slot per minute
+TURNOUT_SERIES_MINUTES = 1440
+# Rows fetched from SQLite at a time by the iter_* bulk reads
+DEFAULT_FETCH_BATCH_SIZE = 1000
+# The candidate id of a ballot as an integer, for the tally. Ids that aren't written exactly as a decimal integer, such
+# as '2abc', '2.9' or '02', are 0, which is never a registered candidate id, so they are rejected rather than truncated.
+CANDIDATE_ID_AS_INTEGER = """
+    CASE WHEN candidate_id GLOB '[0-9]*' AND CAST(CAST(candidate_id AS INTEGER) AS TEXT) = candidate_id
+    THEN CAST(candidate_id AS INTEGER) ELSE 0 END
+"""
+
+
+class CandidateIndex(NamedTuple):
+    """
+    An immutable snapshot of the registered candidates. The store swaps in a new snapshot whenever a candidate is added,
+    so readers never see a half-built index and never need a lock.
+    """
+
+    candidates: Tuple[Candidate, ...]
+    candidate_ids: FrozenSet[str]
+    candidates_by_id: Mapping[str, Candidate]
+
+
+class VoterRow(NamedTuple):
+    """
+    A voter as stored, with encrypted names and the obfuscated national id
+    """
+
+    first_name: str
+    last_name: str
+    national_id: str
+
+
+class IdempotencyRecord(NamedTuple):
+    """
+    The outcome of a request made with an idempotency key, shared by every process using the store
+    """
+
+    endpoint: str
+    idempotency_key: str
+    # A hash of the request, so that a key sent again with a different request is refused
+    fingerprint: str
+    status: str
+    # Wall clock time
+    expires_at: float
+
+
+class IssuanceJobRecord(NamedTuple):
+    """
+    A ballot issuance job (see main/api/issuance_jobs.py), shared by every process using the store
+    """
+
+    job_id: str
+    status: str
+    # Cleared once the ballot number has been collected
+    encrypted_ballot_number: Optional[str]
+    expires_at: float
+
+
+class _SnapshotConnection(sqlite3.Connection):
+    """
+    A read-only connection that stays in the one read transaction it was opened with. The store's reads commit after
+    each statement, which would otherwise end the transaction and let later writes show through.
+    """
+
+    def commit(self):
+        pass
 
 
 class VotingStore:
@@ -22,6 +112,10 @@ class VotingStore:
     """
 
     voting_store_instance = None
+    # Serializes adding a candidate with rebuilding the candidate index, so that an older index never replaces a newer one
+    _candidate_index_lock = threading.Lock()
+    # Serializes multi-statement write transactions between the threads of a process, which share one connection
+    _transaction_lock = threading.Lock()
 
     @staticmethod
     def get_instance():
@@ -55,91 +149,500 @@ class VotingStore:
         """
         return sqlite3.connect(":memory:", check_same_thread=False)
 
+    @staticmethod
+    def _get_shared_sqlite_connection(database: str) -> Connection:
+        """
+        Opens a database file that other processes may have open too
+        """
+        connection = sqlite3.connect(
+            database,
+            check_same_thread=False,
+            timeout=BUSY_TIMEOUT_MILLISECONDS / 1000,
+        )
+        # Must come before switching to WAL, which writes the header of a new database file
+        connection.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
+        connection.execute("""PRAGMA journal_mode=WAL""")
+        connection.execute("""PRAGMA synchronous=NORMAL""")
+        connection.execute(
+            """PRAGMA busy_timeout={0}""".format(BUSY_TIMEOUT_MILLISECONDS)
+        )
+        return connection
+
+    @staticmethod
+    def _after_fork_in_child():
+        """
+        Runs in every forked child. A SQLite connection must not be used across a fork, so a child of a process with a
+        file-backed store opens its own connection on first use. In-memory stores are private to the process anyway, so
+        the child keeps its copy.
+        """
+        VotingStore._candidate_index_lock = threading.Lock()
+        VotingStore._transaction_lock = threading.Lock()
+        store = VotingStore.voting_store_instance
+        if store is not None and store.database is not None:
+            # Closing the inherited connection could release locks that belong to the parent, so it is kept open
+            _connections_inherited_across_fork.append(store.connection)
+            VotingStore.voting_store_instance = None
+
+    def is_shared(self) -> bool:
+        """
+        Whether the store is a database file that other processes may be using
+        """
+        return self.database is not None
+
+    @staticmethod
+    def open_database(database: str) -> "VotingStore":
+        """
+        Opens a store on a database file, independently of the singleton, e.g. to read the database of another precinct
+        """
+        store = VotingStore.__new__(VotingStore)
+        store.database = database
+        store.connection = VotingStore._get_shared_sqlite_connection(database)
+        store._create_schema()
+
+        return store
+
+    @staticmethod
+    def open_database_read_only(database: str) -> "VotingStore":
+        """
+        Opens a store on a database file for reading only, independently of the singleton. Unlike open_database, the
+        file is never written to: it is neither switched to WAL nor given the current schema, so it must already have
+        it.
+        """
+        store = VotingStore.__new__(VotingStore)
+        store.database = database
+        store.connection = sqlite3.connect(
+            pathlib.Path(database).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            timeout=BUSY_TIMEOUT_MILLISECONDS / 1000,
+        )
+        store._rebuild_candidate_index()
+
+        return store
+
+    def open_snapshot(self) -> "VotingStore":
+        """
+        Opens a read-only store on this store's database file that sees the database as it is now: all its reads run in
+        one read transaction, so writes made after the call don't show up in them. Close its connection when done, as
+        it holds on to the old pages until then.
+
+        :raises: ValueError if the store isn't file-backed
+        """
+        if not self.is_shared():
+            raise ValueError("Only a file-backed store can be snapshotted")
+
+        snapshot = VotingStore.__new__(VotingStore)
+        snapshot.database = self.database
+        snapshot.connection = sqlite3.connect(
+            pathlib.Path(self.database).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            timeout=BUSY_TIMEOUT_MILLISECONDS / 1000,
+            factory=_SnapshotConnection,
+        )
+        snapshot.connection.execute("""BEGIN""")
+        # The first read of the transaction picks the snapshot
+        snapshot._rebuild_candidate_index()
+
+        return snapshot
+
     def create_tables(self):
         """
         Creates Tables
         """
+        self.database = os.getenv(VOTING_STORE_DATABASE) or None
+        if self.database is not None:
+            self.connection.close()
+            self.connection = VotingStore._get_shared_sqlite_connection(self.database)
+        self._create_schema()
+
+    def _create_schema(self):
+        # Lets deleted pages be handed back to the file system a few at a time (see main/store/compaction.py). This only
+        # takes effect on a database without tables yet; older database files need one VACUUM to switch.
+        self.connection.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
         self.connection.execute(
-            """CREATE TABLE candidates (candidate_id integer primary key autoincrement, name text)"""
+            """CREATE TABLE IF NOT EXISTS candidates (candidate_id integer primary key autoincrement, name text)"""
         )
         self.connection.execute(
-            """CREATE TABLE voters (
+            """CREATE TABLE IF NOT EXISTS voters (
                 voter_id integer primary key autoincrement,
                 first_name text,
                 last_name text,
                 national_id text,
                 voted bool,
-                fraud_commited bool
+                fraud_commited bool,
+                first_name_index text,
+                last_name_index text,
+                precinct text
             )"""
         )
         self.connection.execute(
-            """CREATE TABLE ballots (
+            """CREATE INDEX IF NOT EXISTS voters_name_index ON voters (last_name_index, first_name_index)"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS voters_national_id_index ON voters (national_id)"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS ballots (
                 ballot_number text primary key,
                 candidate_id text,
                 comment text,
+                precinct text,
                 FOREIGN KEY (candidate_id) REFERENCES candidates(candidate_id)
             )"""
         )
         self.connection.execute(
-            """CREATE TABLE invalid_ballots (ballot_number text primary key)"""
+            """CREATE TABLE IF NOT EXISTS invalid_ballots (ballot_number text primary key)"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS quarantined_comments (
+                quarantine_id integer primary key autoincrement,
+                ballot_number text,
+                encrypted_comment text,
+                claimed_until real DEFAULT 0,
+                failures integer DEFAULT 0
+            )"""
+        )
+        # Deleted quarantined comments are overwritten, rather than left behind in free pages
+        self.connection.execute("""PRAGMA secure_delete = ON""")
+        # Database files written before precincts existed
+        self._add_column_if_missing("voters", "precinct", "text")
+        self._add_column_if_missing("ballots", "precinct", "text")
+        self._add_column_if_missing(
+            "quarantined_comments", "failures", "integer DEFAULT 0"
+        )
+        self._create_ballot_comment_index()
+        self._create_turnout_counters()
+        self._create_candidate_counters()
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS idempotency_records (
+                endpoint text,
+                idempotency_key text,
+                fingerprint text,
+                status text,
+                expires_at real,
+                PRIMARY KEY (endpoint, idempotency_key)
+            )"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS idempotency_records_expiry_index ON idempotency_records (expires_at)"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS issuance_jobs (
+                job_id text primary key,
+                status text,
+                encrypted_ballot_number text,
+                expires_at real
+            )"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS issuance_jobs_expiry_index ON issuance_jobs (expires_at)"""
         )
         self.connection.commit()
+        self._rebuild_candidate_index()
 
-    def add_candidate(self, candidate_name: str):
+    def _create_ballot_comment_index(self):
         """
-        Adds a candidate into the candidate table, overwriting an existing entry if one exists
+        Creates the full-text index over ballot comments, which triggers keep in sync as ballots are added and as
+        comments redacted in the background are written. Comments are stored in the index under random rowids rather
+        than the ballots' rowids, so that neither search results nor search cursors reveal the order in which ballots
+        were cast.
         """
+        cursor = self.connection.execute(
+            """SELECT 1 FROM sqlite_master WHERE name = 'ballot_comments'"""
+        )
+        if cursor.fetchone() is None:
+            self.connection.execute(
+                """CREATE VIRTUAL TABLE ballot_comments USING fts5(comment, tokenize = 'porter unicode61')"""
+            )
+            # Database files written before the index existed
+            self.connection.execute(
+                """
+                INSERT INTO ballot_comments (rowid, comment)
+                SELECT random() & 9223372036854775807, comment FROM ballots WHERE comment IS NOT NULL AND comment != ''
+                """
+            )
+
         self.connection.execute(
-            """INSERT INTO candidates (name) VALUES (?)""", (candidate_name,)
+            """
+            CREATE TRIGGER IF NOT EXISTS ballot_comments_on_insert AFTER INSERT ON ballots
+            WHEN new.comment IS NOT NULL AND new.comment != ''
+            BEGIN
+                INSERT INTO ballot_comments (rowid, comment) VALUES (random() & 9223372036854775807, new.comment);
+            END
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS ballot_comments_on_redaction AFTER UPDATE OF comment ON ballots
+            WHEN old.comment IS NULL AND new.comment IS NOT NULL AND new.comment != ''
+            BEGIN
+                INSERT INTO ballot_comments (rowid, comment) VALUES (random() & 9223372036854775807, new.comment);
+            END
+            """
         )
-        self.connection.commit()
 
-    def get_candidate(self, candidate_id: str) -> Candidate | None:
+    def _create_turnout_counters(self):
         """
-        Returns the candidate specified, if that candidate is registered. Otherwise returns None.
+        Creates the turnout counters, which triggers keep up to date in the same transaction as every write to voters,
+        and the ring buffer of ballots cast per minute, whose slot for a minute is reused TURNOUT_SERIES_MINUTES minutes
+        later. Reading turnout never touches the voters table.
         """
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT * FROM candidates WHERE candidate_id=?""", (candidate_id,)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS turnout (
+                turnout_id integer primary key CHECK (turnout_id = 0),
+                registered integer,
+                voted integer,
+                fraud_flagged integer
+            )"""
         )
-        candidate_row = cursor.fetchone()
-        candidate = Candidate(candidate_id, candidate_row[1]) if candidate_row else None
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS turnout_by_minute (slot integer primary key, minute integer, ballots integer)"""
+        )
+        self.connection.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS turnout_on_voter_insert AFTER INSERT ON voters
+            BEGIN
+                UPDATE turnout SET
+                    registered = registered + 1,
+                    voted = voted + (COALESCE(new.voted, 0) != 0),
+                    fraud_flagged = fraud_flagged + (COALESCE(new.fraud_commited, 0) != 0);
+            END
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS turnout_on_voter_update AFTER UPDATE OF voted, fraud_commited ON voters
+            BEGIN
+                UPDATE turnout SET
+                    voted = voted + (COALESCE(new.voted, 0) != 0) - (COALESCE(old.voted, 0) != 0),
+                    fraud_flagged = fraud_flagged
+                        + (COALESCE(new.fraud_commited, 0) != 0) - (COALESCE(old.fraud_commited, 0) != 0);
+            END
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS turnout_on_voter_delete AFTER DELETE ON voters
+            BEGIN
+                UPDATE turnout SET
+                    registered = registered - 1,
+                    voted = voted - (COALESCE(old.voted, 0) != 0),
+                    fraud_flagged = fraud_flagged - (COALESCE(old.fraud_commited, 0) != 0);
+            END
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS turnout_on_ballot_insert AFTER INSERT ON ballots
+            BEGIN
+                INSERT INTO turnout_by_minute (slot, minute, ballots)
+                VALUES (
+                    (CAST(strftime('%s', 'now') AS integer) / 60) % {0},
+                    CAST(strftime('%s', 'now') AS integer) / 60,
+                    1
+                )
+                ON CONFLICT (slot) DO UPDATE SET
+                    ballots = CASE WHEN minute = excluded.minute THEN ballots + 1 ELSE 1 END,
+                    minute = excluded.minute;
+            END
+            """.format(
+                TURNOUT_SERIES_MINUTES
+            )
+        )
+        # Counts the voters of database files written before the counters existed, once. The triggers are created
+        # first, so that a voter added by another process in the meantime is counted by one or the other.
+        self.connection.execute(
+            """
+            INSERT OR IGNORE INTO turnout (turnout_id, registered, voted, fraud_flagged)
+            SELECT 0, COUNT(*), COALESCE(SUM(COALESCE(voted, 0) != 0), 0), COALESCE(SUM(COALESCE(fraud_commited, 0) != 0), 0)
+            FROM voters WHERE NOT EXISTS (SELECT 1 FROM turnout)
+            """
+        )
+
+    def _create_candidate_counters(self):
+        """
+        Creates the count of ballots cast for each candidate id, as written, which a trigger keeps up to date in the
+        same transaction as every ballot added. The results feed (main/api/results_feed.py) reads these instead of the
+        ballots table. The counters of database files written before they existed are filled in while holding the
+        write lock, so that no ballot is counted twice or missed.
+        """
         self.connection.commit()
+        with self.connection:
+            self.connection.execute("""BEGIN IMMEDIATE""")
+            cursor = self.connection.execute(
+                """SELECT 1 FROM sqlite_master WHERE name = 'ballots_by_candidate'"""
+            )
+            if cursor.fetchone() is None:
+                self.connection.execute(
+                    """CREATE TABLE ballots_by_candidate (candidate_id text primary key, ballots integer)"""
+                )
+                self.connection.execute(
+                    """
+                    INSERT INTO ballots_by_candidate (candidate_id, ballots)
+                    SELECT COALESCE(candidate_id, ''), COUNT(*) FROM ballots GROUP BY COALESCE(candidate_id, '')
+                    """
+                )
+            self.connection.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS ballots_by_candidate_on_insert AFTER INSERT ON ballots
+                BEGIN
+                    INSERT INTO ballots_by_candidate (candidate_id, ballots) VALUES (COALESCE(new.candidate_id, ''), 1)
+                    ON CONFLICT (candidate_id) DO UPDATE SET ballots = ballots + 1;
+                END
+                """
+            )
 
-        return candidate
+    def _add_column_if_missing(self, table: str, column: str, column_type: str):
+        columns = [
+            column_row[1]
+            for column_row in self.connection.execute(
+                """PRAGMA table_info({0})""".format(table)
+            )
+        ]
+        if column not in columns:
+            self.connection.execute(
+                """ALTER TABLE {0} ADD COLUMN {1} {2}""".format(
+                    table, column, column_type
+                )
+            )
 
-    def get_all_candidates(self) -> List[Candidate]:
+    def _rebuild_candidate_index(self):
         """
-        Gets ALL the candidates from the database
+        Rebuilds the candidate index from the candidates table, and swaps it in with a single assignment
         """
         cursor = self.connection.cursor()
-        cursor.execute("""SELECT * FROM candidates""")
-        all_candidate_rows = cursor.fetchall()
-        all_candidates = [
+        cursor.execute("""SELECT candidate_id, name FROM candidates""")
+        candidates = tuple(
             Candidate(str(candidate_row[0]), candidate_row[1])
-            for candidate_row in all_candidate_rows
-        ]
+            for candidate_row in cursor.fetchall()
+        )
         self.connection.commit()
 
-        return all_candidates
+        self.candidate_index = CandidateIndex(
+            candidates,
+            frozenset(candidate.candidate_id for candidate in candidates),
+            MappingProxyType(
+                {candidate.candidate_id: candidate for candidate in candidates}
+            ),
+        )
+
+    def add_candidate(self, candidate_name: str):
+        """
+        Adds a candidate into the candidate table, overwriting an existing entry if one exists
+        """
+        with VotingStore._candidate_index_lock:
+            self.connection.execute(
+                """INSERT INTO candidates (name) VALUES (?)""", (candidate_name,)
+            )
+            self.connection.commit()
+            self._rebuild_candidate_index()
+
+    def _refresh_candidate_index_on_miss(self, candidate_id: str) -> CandidateIndex:
+        """
+        Returns the candidate index. Other processes sharing the store may have added candidates since it was built, so
+        a shared store rebuilds the index when it doesn't know the candidate.
+        """
+        candidate_index = self.candidate_index
+        if candidate_id not in candidate_index.candidate_ids and self.is_shared():
+            with VotingStore._candidate_index_lock:
+                self._rebuild_candidate_index()
+            candidate_index = self.candidate_index
+
+        return candidate_index
+
+    def is_candidate_registered(self, candidate_id) -> bool:
+        """
+        Checks the candidate index, without going to the database unless the store is shared and the candidate is unknown
+        """
+        candidate_id = str(candidate_id)
+        return (
+            candidate_id
+            in self._refresh_candidate_index_on_miss(candidate_id).candidate_ids
+        )
+
+    def get_candidate(self, candidate_id: str) -> Candidate | None:
+        """
+        Returns the candidate specified, if that candidate is registered. Otherwise returns None.
+        """
+        candidate_id = str(candidate_id)
+        candidate = self._refresh_candidate_index_on_miss(
+            candidate_id
+        ).candidates_by_id.get(candidate_id)
+        return Candidate(candidate.candidate_id, candidate.name) if candidate else None
 
-    def add_voter(self, voter: Voter):
+    def get_all_candidates(self) -> List[Candidate]:
+        """
+        Gets ALL the candidates, from the candidate index
+        """
+        return [
+            Candidate(candidate.candidate_id, candidate.name)
+            for candidate in self.candidate_index.candidates
+        ]
+
+    def add_voter(self, voter: Voter, key: Optional[VoterKey] = None):
         """
         Adds a voter into the voter table, overwriting an existing entry if one exists
+
+        :param: key The voter's key, if the caller already has one
         """
-        minimal_voter = voter.get_minimal_voter()
+        minimal_voter = voter.get_minimal_voter(key)
         self.connection.execute(
-            """INSERT INTO voters (first_name, last_name, national_id, fraud_commited, voted) VALUES (?, ?, ?, ?, ?)""",
+            """INSERT INTO voters (first_name, last_name, national_id, fraud_commited, voted, first_name_index, last_name_index, precinct) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
             (
                 minimal_voter.obfuscated_first_name,
                 minimal_voter.obfuscated_last_name,
                 minimal_voter.obfuscated_national_id,
                 minimal_voter.fraud_commited,
                 minimal_voter.voted,
+                minimal_voter.first_name_index,
+                minimal_voter.last_name_index,
+                minimal_voter.precinct,
             ),
         )
         self.connection.commit()
 
+    def load_fixture(
+        self,
+        candidate_names: List[str],
+        minimal_voters: List[MinimalVoter],
+        invalid_ballot_numbers: Optional[List[str]] = None,
+    ):
+        """
+        Bulk loads candidates, already-minimized voters and invalidated ballot numbers in a single transaction
+        """
+        with VotingStore._candidate_index_lock:
+            with self.connection:
+                self.connection.executemany(
+                    """INSERT INTO invalid_ballots (ballot_number) VALUES (?)""",
+                    [
+                        (ballot_number,)
+                        for ballot_number in invalid_ballot_numbers or []
+                    ],
+                )
+                self.connection.executemany(
+                    """INSERT INTO candidates (name) VALUES (?)""",
+                    [(candidate_name,) for candidate_name in candidate_names],
+                )
+                self.connection.executemany(
+                    """INSERT INTO voters (first_name, last_name, national_id, fraud_commited, voted, first_name_index, last_name_index, precinct) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [
+                        (
+                            minimal_voter.obfuscated_first_name,
+                            minimal_voter.obfuscated_last_name,
+                            minimal_voter.obfuscated_national_id,
+                            minimal_voter.fraud_commited,
+                            minimal_voter.voted,
+                            minimal_voter.first_name_index,
+                            minimal_voter.last_name_index,
+                            minimal_voter.precinct,
+                        )
+                        for minimal_voter in minimal_voters
+                    ],
+                )
+            self._rebuild_candidate_index()
+
     def get_voter(self, voter_id: str) -> Voter | None:
         """
         Returns the voter specified, if that voter is registered. Otherwise returns None.
@@ -148,7 +651,14 @@ class VotingStore:
         cursor.execute("""SELECT * FROM voters WHERE voter_id=?""", (voter_id,))
         voter_row = cursor.fetchone()
         voter = (
-            Voter(voter_row[1], voter_row[2], voter_row[3], voter_row[4], voter_row[5])
+            Voter(
+                voter_row[1],
+                voter_row[2],
+                voter_row[3],
+                voter_row[4],
+                voter_row[5],
+                voter_row[8] or DEFAULT_PRECINCT,
+            )
             if voter_row
             else None
         )
@@ -157,11 +667,16 @@ class VotingStore:
         return voter
 
     def fraud_voter(self, national_id):
-        of_national_id = obfuscate_national_id(national_id)
+        self.fraud_voter_by_key(VoterKey(national_id))
+
+    def fraud_voter_by_key(self, key: VoterKey):
+        """
+        Flags the voter as having committed fraud
+        """
         cursor = self.connection.cursor()
         cursor.execute(
             """UPDATE voters SET fraud_commited = true WHERE national_id=?""",
-            (of_national_id,),
+            (key.obfuscated_national_id,),
         )
         self.connection.commit()
 
@@ -169,14 +684,27 @@ class VotingStore:
         """
         Returns the voter with the national_id specified, if exists. Otherwise returns None.
         """
-        of_national_id = obfuscate_national_id(national_id)
+        return self.get_voter_by_key(VoterKey(national_id))
+
+    def get_voter_by_key(self, key: VoterKey) -> Voter | None:
+        """
+        Returns the voter with the key specified, if exists. Otherwise returns None.
+        """
         cursor = self.connection.cursor()
         cursor.execute(
-            """SELECT * FROM voters WHERE national_id=?""", (of_national_id,)
+            """SELECT * FROM voters WHERE national_id=?""",
+            (key.obfuscated_national_id,),
         )
         voter_row = cursor.fetchone()
         voter = (
-            Voter(voter_row[1], voter_row[2], voter_row[3], voter_row[4], voter_row[5])
+            Voter(
+                voter_row[1],
+                voter_row[2],
+                voter_row[3],
+                voter_row[4],
+                voter_row[5],
+                voter_row[8] or DEFAULT_PRECINCT,
+            )
             if voter_row
             else None
         )
@@ -184,50 +712,501 @@ class VotingStore:
 
         return voter
 
-    def get_all_voters(self) -> List[Voter]:
+    def find_voters_by_name_index(
+        self, last_name_index: str, first_name_index: Optional[str] = None
+    ) -> List[MinimalVoter]:
         """
-        Gets ALL the voters from the database
+        Returns the voters whose blind name indexes match. Blind indexes are truncated, so the caller has to decrypt the
+        names of the returned voters to weed out collisions.
         """
         cursor = self.connection.cursor()
-        cursor.execute("""SELECT * FROM voters""")
-        all_voter_rows = cursor.fetchall()
-        all_voters = [
-            Voter(voter_row[1], voter_row[2], voter_row[3])
-            for voter_row in all_voter_rows
+        if first_name_index is None:
+            cursor.execute(
+                """SELECT * FROM voters WHERE last_name_index=?""", (last_name_index,)
+            )
+        else:
+            cursor.execute(
+                """SELECT * FROM voters WHERE last_name_index=? AND first_name_index=?""",
+                (last_name_index, first_name_index),
+            )
+        voters = [
+            MinimalVoter(
+                voter_row[1],
+                voter_row[2],
+                voter_row[3],
+                voter_row[4],
+                voter_row[5],
+                voter_row[6],
+                voter_row[7],
+                voter_row[8] or DEFAULT_PRECINCT,
+            )
+            for voter_row in cursor.fetchall()
         ]
         self.connection.commit()
 
-        return all_voters
+        return voters
+
+    def get_max_voter_id(self) -> int:
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COALESCE(MAX(voter_id), 0) FROM voters""")
+        max_voter_id = cursor.fetchone()[0]
+        self.connection.commit()
+
+        return max_voter_id
+
+    def get_voter_names_not_under_key(
+        self, kid: str, after_voter_id: int, batch_size: int
+    ) -> List[Tuple[int, str, str]]:
+        """
+        Returns the (voter id, encrypted first name, encrypted last name) of the voters with ids in
+        (after_voter_id, after_voter_id + batch_size] whose names aren't encrypted under the key with the given id
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """
+            SELECT voter_id, first_name, last_name FROM voters
+            WHERE voter_id > ? AND voter_id <= ?
+            AND (json_extract(first_name, '$.kid') IS NOT ? OR json_extract(last_name, '$.kid') IS NOT ?)
+            """,
+            (after_voter_id, after_voter_id + batch_size, kid, kid),
+        )
+        voter_rows = cursor.fetchall()
+        self.connection.commit()
+
+        return voter_rows
+
+    def replace_voter_names(self, replacements: List[Tuple[int, str, str, str, str]]):
+        """
+        Replaces the encrypted names of voters in a single transaction. Each replacement is (voter id, old first name,
+        old last name, new first name, new last name), and only applies if the voter's names are still the old ones.
+
+        :returns: The number of voters updated
+        """
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                """UPDATE voters SET first_name=?, last_name=? WHERE voter_id=? AND first_name=? AND last_name=?""",
+                [
+                    (new_first, new_last, voter_id, old_first, old_last)
+                    for voter_id, old_first, old_last, new_first, new_last in replacements
+                ],
+            )
+            return self.connection.total_changes - before
+
+    def get_all_voters(self) -> List[Voter]:
+        """
+        Gets ALL the voters from the database. Use iter_voters to read them without holding them all in memory.
+        """
+        return [Voter(*voter_row) for voter_row in self.iter_voters()]
+
+    def iter_voters(
+        self, batch_size: int = DEFAULT_FETCH_BATCH_SIZE
+    ) -> Iterator[VoterRow]:
+        """
+        Yields every voter, fetching batch_size rows at a time
+        """
+        yield from map(
+            VoterRow._make,
+            self._iter_rows(
+                """SELECT first_name, last_name, national_id FROM voters""",
+                (),
+                batch_size,
+            ),
+        )
+
+    def _iter_rows(
+        self, query: str, parameters: tuple, batch_size: int
+    ) -> Iterator[tuple]:
+        """
+        Runs a query and yields its rows, fetching batch_size rows at a time, so that no more than a batch is held in
+        memory. The query keeps reading the database until the rows are exhausted or the iterator is closed.
+        """
+        cursor = self.connection.execute(query, parameters)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
 
     def delete_voter_by_national_id(self, national_id: str):
         """
         Delete a voter from the database by national_id
         """
-        of_national_id = obfuscate_national_id(national_id)
+        self.delete_voter_by_key(VoterKey(national_id))
+
+    def delete_voter_by_key(self, key: VoterKey):
+        """
+        Delete a voter from the database by key
+        """
         cursor = self.connection.cursor()
-        cursor.execute("""DELETE FROM voters where national_id=?""", (of_national_id,))
+        cursor.execute(
+            """DELETE FROM voters where national_id=?""", (key.obfuscated_national_id,)
+        )
         self.connection.commit()
 
+    def delete_voters_by_keys(self, keys: List[VoterKey]) -> Tuple[List[str], int]:
+        """
+        Deletes the voters with the keys specified, except those who committed fraud, in a single transaction
+
+        :returns: The obfuscated national ids of the deleted voters, and the number of voters kept because they committed
+                  fraud
+        """
+        placeholders = ", ".join("?" * len(keys))
+        obfuscated_national_ids = [key.obfuscated_national_id for key in keys]
+        with VotingStore._transaction_lock, self.connection:
+            (fraud_voters,) = self.connection.execute(
+                """SELECT COUNT(*) FROM voters WHERE national_id IN ({0}) AND fraud_commited""".format(
+                    placeholders
+                ),
+                obfuscated_national_ids,
+            ).fetchone()
+            cursor = self.connection.execute(
+                """DELETE FROM voters WHERE national_id IN ({0}) AND NOT COALESCE(fraud_commited, false) RETURNING national_id""".format(
+                    placeholders
+                ),
+                obfuscated_national_ids,
+            )
+            return [row[0] for row in cursor.fetchall()], fraud_voters
+
+    def get_page_usage(self) -> Tuple[int, int, int]:
+        """
+        :returns: The page size in bytes, the number of pages in the database, and the number of free pages among them
+        """
+        (page_size,) = self.connection.execute("""PRAGMA page_size""").fetchone()
+        (page_count,) = self.connection.execute("""PRAGMA page_count""").fetchone()
+        (free_pages,) = self.connection.execute("""PRAGMA freelist_count""").fetchone()
+
+        return page_size, page_count, free_pages
+
+    def is_incrementally_vacuumed(self) -> bool:
+        """
+        Whether free pages can be reclaimed with incremental_vacuum, rather than a full VACUUM
+        """
+        (auto_vacuum,) = self.connection.execute("""PRAGMA auto_vacuum""").fetchone()
+        # 2 is INCREMENTAL
+        return auto_vacuum == 2
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """
+        Hands up to the number of free pages specified back to the file system
+
+        :returns: The number of pages reclaimed
+        """
+        with VotingStore._transaction_lock:
+            _, page_count_before, _ = self.get_page_usage()
+            # The pragma frees one page per row it returns, so it must be read to the end
+            self.connection.execute(
+                """PRAGMA incremental_vacuum({0})""".format(int(pages))
+            ).fetchall()
+            self.connection.commit()
+            _, page_count_after, _ = self.get_page_usage()
+
+        return page_count_before - page_count_after
+
+    def vacuum(self):
+        """
+        Rebuilds the whole database file, which also switches an older file to incremental vacuuming. Holds the database
+        for as long as it takes.
+        """
+        with VotingStore._transaction_lock:
+            self.connection.commit()
+            self.connection.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
+            self.connection.execute("""VACUUM""")
+
+    def checkpoint(self):
+        """
+        Copies the write-ahead log of a shared store into the database file and truncates it, so that the file shrinks
+        """
+        if self.is_shared():
+            self.connection.execute("""PRAGMA wal_checkpoint(TRUNCATE)""").fetchall()
+
     def add_ballot(self, ballot: Ballot, national_id: str):
         """
         Adds a voter into the voter table, overwriting an existing entry if one exists
         """
+        self.add_ballot_by_key(ballot, VoterKey(national_id))
+
+    def add_ballot_by_key(self, ballot: Ballot, key: VoterKey):
+        """
+        Adds a ballot into the ballot table, and marks the voter with the key specified as having voted
+        """
         cursor = self.connection.cursor()
         cursor.execute(
-            """INSERT INTO ballots (ballot_number, candidate_id, comment) VALUES (?, ?, ?)""",
+            """INSERT INTO ballots (ballot_number, candidate_id, comment, precinct) VALUES (?, ?, ?, (SELECT precinct FROM voters WHERE national_id=?))""",
             (
                 ballot.ballot_number,
                 ballot.chosen_candidate_id,
                 ballot.voter_comments,
+                key.obfuscated_national_id,
             ),
         )
         # Update voter status
-        of_national_id = obfuscate_national_id(national_id)
         cursor.execute(
-            """UPDATE voters SET voted = true WHERE national_id=?""", (of_national_id,)
+            """UPDATE voters SET voted = true WHERE national_id=?""",
+            (key.obfuscated_national_id,),
         )
         self.connection.commit()
 
+    def cast_ballot_by_key(
+        self,
+        ballot: Ballot,
+        key: VoterKey,
+        quarantined_comment: Optional[str] = None,
+        idempotency_record: Optional[IdempotencyRecord] = None,
+    ) -> bool:
+        """
+        Atomically marks the voter with the key specified as having voted and adds their ballot, unless the voter has
+        already voted or isn't registered. The voter is updated first, which takes SQLite's write lock, so two processes
+        casting for the same voter at once can't both see them as not having voted.
+
+        :param: quarantined_comment The encrypted raw comment of the ballot, if it is to be redacted in the background.
+                It is quarantined in the same transaction.
+        :param: idempotency_record Claims the idempotency key of the request in the same transaction, so that whoever
+                sees the ballot counted also sees the key claimed
+        :returns: True if the ballot was added, False if the voter has already voted or isn't registered, or the
+                  idempotency key is already claimed
+        """
+        with VotingStore._transaction_lock, self.connection:
+            # A refused idempotency claim only undoes this ballot, not whatever else is pending on the shared connection
+            self.connection.execute("""SAVEPOINT cast_ballot""")
+            cursor = self.connection.execute(
+                """UPDATE voters SET voted = true WHERE national_id=? AND NOT COALESCE(voted, false)""",
+                (key.obfuscated_national_id,),
+            )
+            if cursor.rowcount == 0:
+                self.connection.execute("""RELEASE cast_ballot""")
+                return False
+            # The ballot is filed under the voter's precinct, so that precincts can be tallied separately
+            self.connection.execute(
+                """INSERT INTO ballots (ballot_number, candidate_id, comment, precinct) VALUES (?, ?, ?, (SELECT precinct FROM voters WHERE national_id=?))""",
+                (
+                    ballot.ballot_number,
+                    ballot.chosen_candidate_id,
+                    ballot.voter_comments,
+                    key.obfuscated_national_id,
+                ),
+            )
+            if quarantined_comment is not None:
+                self.connection.execute(
+                    """INSERT INTO quarantined_comments (ballot_number, encrypted_comment) VALUES (?, ?)""",
+                    (ballot.ballot_number, quarantined_comment),
+                )
+            if idempotency_record is not None and not self._claim_idempotency_key(
+                idempotency_record
+            ):
+                self.connection.execute("""ROLLBACK TO cast_ballot""")
+                self.connection.execute("""RELEASE cast_ballot""")
+                return False
+            self.connection.execute("""RELEASE cast_ballot""")
+            return True
+
+    def get_idempotency_record(
+        self, endpoint: str, idempotency_key: str
+    ) -> Optional[IdempotencyRecord]:
+        """
+        :returns: The record of the request made with the idempotency key, or None if there is none or it expired
+        """
+        cursor = self.connection.execute(
+            """SELECT endpoint, idempotency_key, fingerprint, status, expires_at FROM idempotency_records WHERE endpoint=? AND idempotency_key=? AND expires_at > ?""",
+            (endpoint, idempotency_key, time.time()),
+        )
+        row = cursor.fetchone()
+        return IdempotencyRecord(*row) if row is not None else None
+
+    def _claim_idempotency_key(self, record: IdempotencyRecord) -> bool:
+        """
+        Adds the record, unless its key is already claimed. Expired records are dropped first. Must be called within a
+        transaction.
+
+        :returns: True if the record was added
+        """
+        self.connection.execute(
+            """DELETE FROM idempotency_records WHERE expires_at <= ?""",
+            (time.time(),),
+        )
+        cursor = self.connection.execute(
+            """INSERT OR IGNORE INTO idempotency_records (endpoint, idempotency_key, fingerprint, status, expires_at) VALUES (?, ?, ?, ?, ?)""",
+            record,
+        )
+        return cursor.rowcount == 1
+
+    def add_issuance_job(self, record: IssuanceJobRecord, now: float):
+        """
+        Adds a ballot issuance job. Expired jobs are dropped first.
+        """
+        with VotingStore._transaction_lock, self.connection:
+            self.connection.execute(
+                """DELETE FROM issuance_jobs WHERE expires_at <= ?""", (now,)
+            )
+            self.connection.execute(
+                """INSERT INTO issuance_jobs (job_id, status, encrypted_ballot_number, expires_at) VALUES (?, ?, ?, ?)""",
+                record,
+            )
+
+    def finish_issuance_job(self, record: IssuanceJobRecord) -> bool:
+        """
+        Records the outcome of a ballot issuance job
+
+        :returns: False if the job expired while it was pending
+        """
+        with VotingStore._transaction_lock, self.connection:
+            cursor = self.connection.execute(
+                """UPDATE issuance_jobs SET status=?, encrypted_ballot_number=?, expires_at=? WHERE job_id=?""",
+                (
+                    record.status,
+                    record.encrypted_ballot_number,
+                    record.expires_at,
+                    record.job_id,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def remove_issuance_job(self, job_id: str):
+        with VotingStore._transaction_lock, self.connection:
+            self.connection.execute(
+                """DELETE FROM issuance_jobs WHERE job_id=?""", (job_id,)
+            )
+
+    def get_issuance_job(self, job_id: str, now: float) -> Optional[IssuanceJobRecord]:
+        """
+        :returns: The ballot issuance job, or None if there is none or it expired
+        """
+        cursor = self.connection.execute(
+            """SELECT job_id, status, encrypted_ballot_number, expires_at FROM issuance_jobs WHERE job_id=? AND expires_at > ?""",
+            (job_id, now),
+        )
+        row = cursor.fetchone()
+        self.connection.commit()
+        return IssuanceJobRecord(*row) if row is not None else None
+
+    def collect_issued_ballot_number(self, job_id: str, now: float) -> Optional[str]:
+        """
+        Returns the encrypted ballot number of a ballot issuance job and clears it, so that only the first caller gets
+        it.
+
+        :returns: The encrypted ballot number, or None if the job expired, has no ballot number or was already collected
+        """
+        with VotingStore._transaction_lock, self.connection:
+            # Takes the write lock before reading, so that two processes can't both read the ballot number
+            self.connection.execute("""BEGIN IMMEDIATE""")
+            row = self.connection.execute(
+                """SELECT encrypted_ballot_number FROM issuance_jobs WHERE job_id=? AND expires_at > ?""",
+                (job_id, now),
+            ).fetchone()
+            if row is None or row[0] is None:
+                return None
+            self.connection.execute(
+                """UPDATE issuance_jobs SET encrypted_ballot_number = NULL WHERE job_id=?""",
+                (job_id,),
+            )
+            return row[0]
+
+    def count_issuance_jobs(self, now: float) -> int:
+        cursor = self.connection.execute(
+            """SELECT COUNT(*) FROM issuance_jobs WHERE expires_at > ?""", (now,)
+        )
+        count = cursor.fetchone()[0]
+        self.connection.commit()
+        return count
+
+    def claim_quarantined_comments(
+        self, batch_size: int, lease_seconds: float, max_failures: int
+    ) -> List[Tuple[int, str, str]]:
+        """
+        Claims up to batch_size quarantined comments that no one else holds a claim on. A claim expires after
+        lease_seconds, so that the comments of a redaction worker that died are picked up again. Comments that failed
+        to redact max_failures times are set aside, and never claimed again.
+
+        :returns: The (quarantine id, ballot number, encrypted comment) of the claimed comments
+        """
+        now = time.time()
+        with VotingStore._transaction_lock, self.connection:
+            cursor = self.connection.execute(
+                """
+                UPDATE quarantined_comments SET claimed_until = ?
+                WHERE quarantine_id IN (
+                    SELECT quarantine_id FROM quarantined_comments
+                    WHERE claimed_until < ? AND failures < ?
+                    ORDER BY quarantine_id LIMIT ?
+                )
+                RETURNING quarantine_id, ballot_number, encrypted_comment
+                """,
+                (now + lease_seconds, now, max_failures, batch_size),
+            )
+            return cursor.fetchall()
+
+    def record_comment_redaction_failures(
+        self, quarantine_ids: List[int], max_failures: int
+    ) -> List[int]:
+        """
+        Counts one more failure to redact each of the quarantined comments. They are retried once their claim expires,
+        until they have failed max_failures times. The encrypted comment of a comment set aside is destroyed.
+
+        :returns: The ids of the comments set aside by this failure
+        """
+        set_aside = []
+        with VotingStore._transaction_lock, self.connection:
+            for quarantine_id in quarantine_ids:
+                rows = self.connection.execute(
+                    """UPDATE quarantined_comments SET failures = failures + 1 WHERE quarantine_id = ? RETURNING failures""",
+                    (quarantine_id,),
+                ).fetchall()
+                if rows and rows[0][0] == max_failures:
+                    self.connection.execute(
+                        """UPDATE quarantined_comments SET encrypted_comment = NULL WHERE quarantine_id = ?""",
+                        (quarantine_id,),
+                    )
+                    set_aside.append(quarantine_id)
+
+        return set_aside
+
+    def count_set_aside_comments(self, max_failures: int) -> int:
+        """
+        Counts the quarantined comments that failed to redact max_failures times, and are no longer claimed
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """SELECT COUNT(*) FROM quarantined_comments WHERE failures >= ?""",
+            (max_failures,),
+        )
+        set_aside = cursor.fetchone()[0]
+        self.connection.commit()
+
+        return set_aside
+
+    def complete_comment_redactions(self, redactions: List[Tuple[int, str, str]]):
+        """
+        Writes redacted comments to their ballots and destroys the quarantined raw comments, in a single transaction.
+
+        :param: redactions (quarantine id, ballot number, redacted comment) for each comment
+        """
+        with VotingStore._transaction_lock, self.connection:
+            self.connection.executemany(
+                """UPDATE ballots SET comment = ? WHERE ballot_number = ? AND comment IS NULL""",
+                [
+                    (redacted_comment, ballot_number)
+                    for _, ballot_number, redacted_comment in redactions
+                ],
+            )
+            self.connection.executemany(
+                """DELETE FROM quarantined_comments WHERE quarantine_id = ?""",
+                [(quarantine_id,) for quarantine_id, _, _ in redactions],
+            )
+
+    def count_quarantined_comments(self) -> int:
+        """
+        Counts the comments waiting to be redacted
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COUNT(*) FROM quarantined_comments""")
+        backlog = cursor.fetchone()[0]
+        self.connection.commit()
+
+        return backlog
+
     def is_ballot_counted(self, ballot_number: str) -> bool:
         """
         Get ballot from a ballot number. Return None if no ballot found
@@ -270,6 +1249,47 @@ class VotingStore:
 
         return False
 
+    def get_turnout(self) -> Tuple[int, int, int]:
+        """
+        Reads the turnout counters, without scanning the voters table
+
+        :returns: The number of registered voters, of those who voted, and of those flagged for fraud
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT registered, voted, fraud_flagged FROM turnout""")
+        registered, voted, fraud_flagged = cursor.fetchone()
+        self.connection.commit()
+
+        return registered, voted, fraud_flagged
+
+    def get_ballots_by_candidate(self) -> Dict[str, int]:
+        """
+        Reads the per-candidate ballot counters, without scanning the ballots table
+
+        :returns: The number of ballots cast for each candidate id, as written on the ballots. Ids need not belong to a
+                  registered candidate.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT candidate_id, ballots FROM ballots_by_candidate""")
+        return dict(cursor.fetchall())
+
+    def get_ballots_cast_by_minute(self, first_minute: int) -> Dict[int, int]:
+        """
+        Reads the turnout ring buffer
+
+        :param: first_minute The earliest minute to read, in minutes since the Unix epoch
+        :returns: The number of ballots cast in each minute since first_minute that had any
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """SELECT minute, ballots FROM turnout_by_minute WHERE minute >= ?""",
+            (first_minute,),
+        )
+        ballots_by_minute = dict(cursor.fetchall())
+        self.connection.commit()
+
+        return ballots_by_minute
+
     def get_top_candidate(self) -> Candidate:
         """
         Get the candidate with the most votes
@@ -289,40 +1309,248 @@ class VotingStore:
 
         return top_candidate
 
-    def get_all_non_empty_ballot_comments(self) -> Set[str]:
+    def iter_ballot_candidate_ids(self, batch_size: int) -> Iterator[str]:
         """
-        Get all ballots with non-empty comments
+        Yields the candidate ids of the cast ballots, batch_size rows at a time. Each batch is a single space-separated
+        string built by SQLite, which is much cheaper than fetching a Python tuple per row. Ids that aren't written
+        as integers come back as 0 (see CANDIDATE_ID_AS_INTEGER), which is never a registered candidate id.
+
+        Only ballots cast before the call are included.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COALESCE(MAX(rowid), 0) FROM ballots""")
+        max_rowid = cursor.fetchone()[0]
+        self.connection.commit()
+
+        for low in range(0, max_rowid, batch_size):
+            cursor.execute(
+                """
+                SELECT group_concat({0}, ' ') FROM ballots
+                WHERE rowid > ? AND rowid <= ?
+                """.format(
+                    CANDIDATE_ID_AS_INTEGER
+                ),
+                (low, min(low + batch_size, max_rowid)),
+            )
+            batch = cursor.fetchone()[0]
+            self.connection.commit()
+            if batch:
+                yield batch
+
+    def get_precincts(self) -> List[str]:
+        """
+        Returns the precincts that have registered voters or cast ballots, in order
         """
-        comment_set = set()
         cursor = self.connection.cursor()
         cursor.execute(
             """
-            SELECT comment FROM ballots WHERE comment IS NOT NULL
-            """
+            SELECT COALESCE(precinct, ?) FROM voters
+            UNION
+            SELECT COALESCE(precinct, ?) FROM ballots
+            ORDER BY 1
+            """,
+            (DEFAULT_PRECINCT, DEFAULT_PRECINCT),
         )
-        all_comments = cursor.fetchall()
-        for comment in all_comments:
-            comment_set.add(comment[0])
+        precincts = [precinct_row[0] for precinct_row in cursor.fetchall()]
+        self.connection.commit()
+
+        return precincts
+
+    def iter_precinct_ballot_candidate_ids(
+        self, batch_size: int
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        Like iter_ballot_candidate_ids above, but split by precinct: yields (precinct, space-separated candidate ids)
+        pairs, for batch_size rows at a time.
 
+        Only ballots cast before the call are included.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COALESCE(MAX(rowid), 0) FROM ballots""")
+        max_rowid = cursor.fetchone()[0]
         self.connection.commit()
 
-        return comment_set
+        for low in range(0, max_rowid, batch_size):
+            cursor.execute(
+                """
+                SELECT COALESCE(precinct, ?), group_concat({0}, ' ')
+                FROM ballots
+                WHERE rowid > ? AND rowid <= ?
+                GROUP BY 1
+                """.format(
+                    CANDIDATE_ID_AS_INTEGER
+                ),
+                (DEFAULT_PRECINCT, low, min(low + batch_size, max_rowid)),
+            )
+            batches = cursor.fetchall()
+            self.connection.commit()
+            yield from batches
+
+    def iter_voters_by_national_id(
+        self, batch_size: int
+    ) -> Iterator[Tuple[str, str, bool]]:
+        """
+        Yields the (obfuscated national id, precinct, voted) of every registered voter, in national id order. Voters are
+        paged through the national id index, batch_size at a time, so no more than a batch is held in memory.
+        """
+        cursor = self.connection.cursor()
+        last_national_id = ""
+        while True:
+            cursor.execute(
+                """
+                SELECT national_id, COALESCE(precinct, ?), COALESCE(voted, false) FROM voters
+                WHERE national_id > ?
+                ORDER BY national_id
+                LIMIT ?
+                """,
+                (DEFAULT_PRECINCT, last_national_id, batch_size),
+            )
+            voter_rows = cursor.fetchall()
+            self.connection.commit()
+            for national_id, precinct, voted in voter_rows:
+                yield national_id, precinct, bool(voted)
+            if len(voter_rows) < batch_size:
+                return
+            last_national_id = voter_rows[-1][0]
+
+    def iter_ballot_columns(self, batch_size: int) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the columns of the cast ballots that are safe to analyze, batch_size rows at a time, as space-separated
+        strings: the candidate id (0 if it isn't written as an integer) and whether the ballot carries a comment (0 or 1). Ballot
+        numbers and comments are never included.
+
+        Only ballots cast before the call are included.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COALESCE(MAX(rowid), 0) FROM ballots""")
+        max_rowid = cursor.fetchone()[0]
+        self.connection.commit()
+
+        for low in range(0, max_rowid, batch_size):
+            cursor.execute(
+                """
+                SELECT
+                    group_concat({0}, ' '),
+                    group_concat(comment IS NOT NULL AND comment != '', ' ')
+                FROM ballots
+                WHERE rowid > ? AND rowid <= ?
+                """.format(
+                    CANDIDATE_ID_AS_INTEGER
+                ),
+                (low, min(low + batch_size, max_rowid)),
+            )
+            batch = cursor.fetchone()
+            self.connection.commit()
+            if batch[0]:
+                yield batch
+
+    def iter_voter_status_flags(self, batch_size: int) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the status flags of the registered voters, batch_size rows at a time, as space-separated strings of 0s
+        and 1s: whether the voter has voted, and whether they were flagged for fraud. No names or ids are included.
+
+        Only voters registered before the call are included.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT COALESCE(MAX(rowid), 0) FROM voters""")
+        max_rowid = cursor.fetchone()[0]
+        self.connection.commit()
+
+        for low in range(0, max_rowid, batch_size):
+            cursor.execute(
+                """
+                SELECT
+                    group_concat(CASE WHEN voted THEN 1 ELSE 0 END, ' '),
+                    group_concat(CASE WHEN fraud_commited THEN 1 ELSE 0 END, ' ')
+                FROM voters
+                WHERE rowid > ? AND rowid <= ?
+                """,
+                (low, min(low + batch_size, max_rowid)),
+            )
+            batch = cursor.fetchone()
+            self.connection.commit()
+            if batch[0]:
+                yield batch
+
+    def get_all_non_empty_ballot_comments(self) -> Set[str]:
+        """
+        Get all ballots with non-empty comments
+        """
+        return set(self.iter_non_empty_ballot_comments())
+
+    def iter_non_empty_ballot_comments(
+        self, batch_size: int = DEFAULT_FETCH_BATCH_SIZE
+    ) -> Iterator[str]:
+        """
+        Yields the comment of every ballot that has one, fetching batch_size rows at a time. The same comment is yielded
+        once per ballot.
+        """
+        for (comment,) in self._iter_rows(
+            """SELECT comment FROM ballots WHERE comment IS NOT NULL""", (), batch_size
+        ):
+            yield comment
+
+    def search_ballot_comments(
+        self, fts_query: str, limit: int, after: Optional[Tuple[float, int]] = None
+    ) -> List[Tuple[float, int, str]]:
+        """
+        Searches the full-text index of ballot comments, best matches first.
+
+        :param: fts_query An FTS5 query expression
+        :param: limit The maximum number of comments to return
+        :param: after The (rank, rowid) of the last comment of the previous page, to return the page after it
+        :returns: The (rank, rowid, comment) of the matching comments, by rank then rowid
+        """
+        cursor = self.connection.cursor()
+        if after is None:
+            cursor.execute(
+                """
+                SELECT rank, rowid, comment FROM ballot_comments
+                WHERE ballot_comments MATCH ?
+                ORDER BY rank, rowid
+                LIMIT ?
+                """,
+                (fts_query, limit),
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT rank, rowid, comment FROM ballot_comments
+                WHERE ballot_comments MATCH ? AND (rank > ? OR (rank = ? AND rowid > ?))
+                ORDER BY rank, rowid
+                LIMIT ?
+                """,
+                (fts_query, after[0], after[0], after[1], limit),
+            )
+        results = cursor.fetchall()
+        self.connection.commit()
+
+        return results
 
     def get_fraud_voters(self) -> List[Voter]:
         """
         Get all fraud voters
         """
-        fraud_voters = list()
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """
-            SELECT first_name, last_name, national_id FROM voters WHERE fraud_commited = true
-            """
+        return [Voter(*voter_row) for voter_row in self.iter_fraud_voters()]
+
+    def iter_fraud_voters(
+        self, batch_size: int = DEFAULT_FETCH_BATCH_SIZE
+    ) -> Iterator[VoterRow]:
+        """
+        Yields every voter flagged for fraud, fetching batch_size rows at a time
+        """
+        yield from map(
+            VoterRow._make,
+            self._iter_rows(
+                """SELECT first_name, last_name, national_id FROM voters WHERE fraud_commited = true""",
+                (),
+                batch_size,
+            ),
         )
-        all_voters = cursor.fetchall()
-        for voter in all_voters:
-            fraud_voters.append(Voter(voter[0], voter[1], voter[2]))
 
-        self.connection.commit()
 
-        return fraud_voters
+# Connections of file-backed stores that were open when the process forked. See VotingStore._after_fork_in_child.
+_connections_inherited_across_fork: List[Connection] = []
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=VotingStore._after_fork_in_child)
@@ -0,0 +1,314 @@
+#
+# This file exports the election for post-election analysis. Ballots, voter status flags and the tally are written as
+# one .npy file per column, so that analysts can memory-map exactly the columns they need instead of pulling rows out
+# of sqlite. Only fixed-width, anonymized columns are exported: no ballot numbers, comments, names or national ids.
+#
+# Columns are streamed from the store in batches, so exporting takes memory proportional to the batch size rather than
+# to the number of ballots. A file-backed store is read from a snapshot (see VotingStore.open_snapshot), so the columns
+# are consistent with each other even while ballots are being cast. ElectionExport reads an export back, and computes
+# tallies and turnout from the memory-mapped columns one chunk at a time.
+#
+# To export the store, run the following from the /backend directory
+#
+# $ python -m main.store.export <output directory> --database <database path>
+#
+# The database defaults to VOTING_STORE_DATABASE.
+#
+# numpy is imported inside the functions that use it, so that importing this module stays cheap.
+#
+
+import json
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from ..objects.candidate import Candidate
+from ..objects.tally import ElectionTally
+from .data_registry import VotingStore
+from .tally_engine import (
+    DEFAULT_BATCH_SIZE,
+    bin_candidate_ids,
+    max_candidate_id,
+    tally_from_bins,
+)
+
+EXPORT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+# Column name -> numpy dtype. Each column is stored in "<column name>.npy".
+BALLOT_COLUMNS = {
+    "ballots.candidate_id": "<i8",
+    "ballots.has_comment": "|b1",
+}
+VOTER_COLUMNS = {
+    "voters.voted": "|b1",
+    "voters.fraud_flagged": "|b1",
+}
+TALLY_COLUMNS = {
+    "tally.candidate_id": "<i8",
+    "tally.votes": "<i8",
+}
+
+# Size of the .npy header reserved at the start of each column file. The length of a column is only known once it has
+# been fully streamed, so the header is written last, into this fixed-size slot.
+NPY_HEADER_SIZE = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+class _NpyColumnWriter:
+    """
+    Appends chunks of values to a .npy file without holding the whole column in memory
+    """
+
+    def __init__(self, path: str, dtype: str):
+        import numpy as np
+
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._file = open(path, "wb")
+        self._file.write(b"\x00" * NPY_HEADER_SIZE)
+
+    def append(self, values):
+        import numpy as np
+
+        chunk = np.ascontiguousarray(values, dtype=self.dtype)
+        self._file.write(chunk.tobytes())
+        self.length += len(chunk)
+
+    def close(self):
+        import numpy as np
+
+        header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), self.length
+        ).encode("latin1")
+        # The header is padded with spaces and ends with a newline, as the .npy format requires
+        header_length = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+        self._file.seek(0)
+        self._file.write(
+            NPY_MAGIC
+            + struct.pack("<H", header_length)
+            + header.ljust(header_length - 1)
+            + b"\n"
+        )
+        self._file.close()
+
+
+def _parse_batch(batch: str, dtype: str):
+    import numpy as np
+
+    return np.array(batch.split(" "), dtype=np.int64).astype(dtype)
+
+
+def export_election(
+    directory: str,
+    store: Optional[VotingStore] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """
+    Exports the ballots, the voter status flags and the tally of the store into a directory of .npy columns, plus a
+    manifest.json that describes them.
+
+    :param: directory The directory to export into. It is created if it doesn't exist.
+    :param: store The store to export. Defaults to the VotingStore singleton. A file-backed store is read from a
+            snapshot; an in-memory one is read as it changes.
+    :param: batch_size The number of rows streamed from the database at a time
+    :returns: The manifest of the export
+    """
+    store = store or VotingStore.get_instance()
+    if not store.is_shared():
+        return _export_election(directory, store, batch_size)
+
+    snapshot = store.open_snapshot()
+    try:
+        return _export_election(directory, snapshot, batch_size)
+    finally:
+        snapshot.connection.close()
+
+
+def _export_election(directory: str, store: VotingStore, batch_size: int) -> dict:
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    candidates = store.get_all_candidates()
+    max_id = max_candidate_id(candidates)
+    bins = np.zeros(max_id + 1, dtype=np.int64)
+
+    lengths: Dict[str, int] = {}
+
+    writers = _open_writers(directory, BALLOT_COLUMNS)
+    for batch in store.iter_ballot_columns(batch_size):
+        chunks = [
+            _parse_batch(values, dtype)
+            for values, dtype in zip(batch, BALLOT_COLUMNS.values())
+        ]
+        for writer, chunk in zip(writers, chunks):
+            writer.append(chunk)
+        bins += bin_candidate_ids(chunks[0], max_id)
+    lengths.update(_close_writers(writers, BALLOT_COLUMNS))
+
+    writers = _open_writers(directory, VOTER_COLUMNS)
+    for batch in store.iter_voter_status_flags(batch_size):
+        for writer, values, dtype in zip(writers, batch, VOTER_COLUMNS.values()):
+            writer.append(_parse_batch(values, dtype))
+    lengths.update(_close_writers(writers, VOTER_COLUMNS))
+
+    tally = tally_from_bins(bins, candidates)
+    writers = _open_writers(directory, TALLY_COLUMNS)
+    writers[0].append([int(candidate.candidate_id) for candidate in candidates])
+    writers[1].append(
+        [tally.counts[candidate.candidate_id] for candidate in candidates]
+    )
+    lengths.update(_close_writers(writers, TALLY_COLUMNS))
+
+    manifest = {
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "candidates": [
+            {"candidate_id": candidate.candidate_id, "name": candidate.name}
+            for candidate in candidates
+        ],
+        "rejected_ballots": tally.rejected,
+        "columns": {
+            name: {"file": name + ".npy", "dtype": dtype, "length": lengths[name]}
+            for name, dtype in {
+                **BALLOT_COLUMNS,
+                **VOTER_COLUMNS,
+                **TALLY_COLUMNS,
+            }.items()
+        },
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+        manifest_file.write("\n")
+
+    return manifest
+
+
+def _open_writers(directory: str, columns: Dict[str, str]) -> List[_NpyColumnWriter]:
+    return [
+        _NpyColumnWriter(os.path.join(directory, name + ".npy"), dtype)
+        for name, dtype in columns.items()
+    ]
+
+
+def _close_writers(
+    writers: List[_NpyColumnWriter], columns: Dict[str, str]
+) -> Dict[str, int]:
+    for writer in writers:
+        writer.close()
+    return {name: writer.length for name, writer in zip(columns, writers)}
+
+
+class ElectionExport:
+    """
+    Reads an export written by export_election. Columns are memory-mapped, so only the pages that are actually read
+    are loaded.
+
+    >>> election_export = ElectionExport("/path/to/export")
+    >>> election_export.column("ballots.candidate_id")   # a read-only numpy memmap
+    >>> election_export.tally()                          # recomputed from the ballots, chunk by chunk
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest["version"] != EXPORT_FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported export version: {0}".format(self.manifest["version"])
+            )
+
+        self.directory = directory
+        self.candidates = [
+            Candidate(candidate["candidate_id"], candidate["name"])
+            for candidate in self.manifest["candidates"]
+        ]
+
+    def column(self, name: str):
+        """
+        Memory-maps a column of the export.
+
+        :raises: ValueError if the column doesn't match the manifest
+        """
+        import numpy as np
+
+        description = self.manifest["columns"][name]
+        values = np.load(
+            os.path.join(self.directory, description["file"]), mmap_mode="r"
+        )
+        if values.dtype != np.dtype(description["dtype"]) or len(values) != (
+            description["length"]
+        ):
+            raise ValueError("Column {0} doesn't match the manifest".format(name))
+
+        return values
+
+    def tally(self, batch_size: int = DEFAULT_BATCH_SIZE) -> ElectionTally:
+        """
+        Recomputes the tally from the ballot columns, batch_size ballots at a time.
+
+        :param: batch_size The number of ballots read into memory at a time
+        :returns: The tally of the exported ballots
+        """
+        import numpy as np
+
+        candidate_ids = self.column("ballots.candidate_id")
+        max_id = max_candidate_id(self.candidates)
+        bins = np.zeros(max_id + 1, dtype=np.int64)
+
+        for start in range(0, len(candidate_ids), batch_size):
+            chunk = np.asarray(candidate_ids[start : start + batch_size])
+            bins += bin_candidate_ids(chunk, max_id)
+
+        return tally_from_bins(bins, self.candidates)
+
+    def turnout(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Counts registered voters, voters who voted and voters flagged for fraud, batch_size voters at a time
+        """
+        import numpy as np
+
+        voted = self.column("voters.voted")
+        fraud_flagged = self.column("voters.fraud_flagged")
+        turnout = {"registered": len(voted), "voted": 0, "fraud_flagged": 0}
+        for start in range(0, len(voted), batch_size):
+            turnout["voted"] += int(np.count_nonzero(voted[start : start + batch_size]))
+            turnout["fraud_flagged"] += int(
+                np.count_nonzero(fraud_flagged[start : start + batch_size])
+            )
+
+        return turnout
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from .data_registry import VOTING_STORE_DATABASE
+
+    parser = argparse.ArgumentParser(description="Export the election to .npy columns")
+    parser.add_argument("directory", help="The directory to export into")
+    parser.add_argument(
+        "--database",
+        default=os.getenv(VOTING_STORE_DATABASE),
+        help="The database file of the store",
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not args.database:
+        sys.exit(
+            "The in-memory store would be empty: pass --database or set {0}".format(
+                VOTING_STORE_DATABASE
+            )
+        )
+    os.environ[VOTING_STORE_DATABASE] = args.database
+
+    manifest = export_election(args.directory, batch_size=args.batch_size)
+    print(
+        "Exported {0} ballots and {1} voters to {2}".format(
+            manifest["columns"]["ballots.candidate_id"]["length"],
+            manifest["columns"]["voters.voted"]["length"],
+            args.directory,
+        )
+    )
@@ -0,0 +1,150 @@
+#
+# This file contains a pre-serialized seed for development and testing. Seeding the store through the registry API
+# encrypts every name and runs a full bcrypt hash for every ballot, which makes each server boot take seconds. The seed
+# stores the obfuscated national ids and already-issued ballot numbers, so loading it is a single bulk insert.
+#
+# Seeds hold development data only, and never a key: voter names are stored in plaintext and encrypted at load time,
+# under the name encryption key of the deployment loading them.
+#
+# To regenerate the bundled seed, run the following from the /backend directory
+#
+# $ python -m main.store.fixtures
+#
+
+import json
+import os
+from typing import List, Optional, Tuple
+
+from ..objects.ballot import generate_ballot_number
+from ..objects.voter import (
+    DEFAULT_PRECINCT,
+    MinimalVoter,
+    Voter,
+    VoterKey,
+    blind_index_name,
+    encrypt_name,
+)
+from .data_registry import VotingStore
+
+# Version 1 seeds carried the key their names were encrypted under
+SEED_FORMAT_VERSION = 2
+DEFAULT_SEED_PATH = os.path.join(os.path.dirname(__file__), "seed.json")
+
+DEFAULT_CANDIDATE_NAMES = [
+    "Joseph Klimek",
+    "Rose Hervey",
+    "Yeong Qi",
+    "Karthik Banerjee",
+    "Courtney Yu",
+    "Hugo Jennings",
+    "Maia Kift",
+    "Arnav Arora",
+]
+
+DEFAULT_VOTERS = [
+    Voter("Adam", "Smith", "111111111"),
+    Voter("Thien", "Huynh", "222222222"),
+    Voter("Neel", "Banerjee", "333333333"),
+    Voter("Linda", "Qi", "444444444"),
+    Voter("Shoujit", "Gande", "555555555"),
+]
+
+
+def build_seed(
+    candidate_names: List[str], voters: List[Voter], ballots_per_voter: int = 1
+) -> dict:
+    """
+    Builds a seed for the given candidates and voters. This is the slow path: it issues ballots_per_voter ballots to
+    every voter.
+
+    The seed holds the voters' names in plaintext. It is meant for development data only.
+
+    :param: candidate_names The names of the candidates to register
+    :param: voters The voters to register
+    :param: ballots_per_voter How many ballots to pre-issue to each voter
+    :returns: A JSON-serializable seed
+    """
+    return {
+        "version": SEED_FORMAT_VERSION,
+        "candidates": list(candidate_names),
+        "voters": [
+            {
+                "first_name": voter.first_name.strip(),
+                "last_name": voter.last_name.strip(),
+                "national_id": VoterKey(voter.national_id).obfuscated_national_id,
+                "precinct": voter.precinct,
+            }
+            for voter in voters
+        ],
+        "ballots": [
+            {
+                "voter_national_id": voter.national_id,
+                "ballot_number": generate_ballot_number(voter.national_id),
+            }
+            for voter in voters
+            for _ in range(ballots_per_voter)
+        ],
+    }
+
+
+def write_seed(seed: dict, path: str = DEFAULT_SEED_PATH):
+    """
+    Writes a seed produced by build_seed to disk
+    """
+    with open(path, "w") as seed_file:
+        json.dump(seed, seed_file, indent=2)
+        seed_file.write("\n")
+
+
+def load_seed(
+    path: str = DEFAULT_SEED_PATH, store: Optional[VotingStore] = None
+) -> List[Tuple[str, str]]:
+    """
+    Bulk loads a seed into the store in a single transaction.
+
+    Names are encrypted, and blind name indexes computed, under the keys of the deployment loading the seed.
+
+    A seed may also list "invalidated_ballots", the numbers of pre-issued ballots that are loaded as invalidated.
+
+    :param: path The path to a seed written by write_seed
+    :param: store The store to load into. Defaults to the VotingStore singleton.
+    :returns: The pre-issued ballots, as (voter national id, ballot number) pairs
+    :raises: ValueError if the seed was written in another format
+    """
+    with open(path) as seed_file:
+        seed = json.load(seed_file)
+    if seed["version"] != SEED_FORMAT_VERSION:
+        raise ValueError(
+            "Unsupported seed version: {0}. Regenerate it with python -m main.store.fixtures".format(
+                seed["version"]
+            )
+        )
+
+    def _minimal_voter(voter: dict) -> MinimalVoter:
+        return MinimalVoter(
+            encrypt_name(voter["first_name"]),
+            encrypt_name(voter["last_name"]),
+            voter["national_id"],
+            False,
+            False,
+            blind_index_name(voter["first_name"]),
+            blind_index_name(voter["last_name"]),
+            voter.get("precinct", DEFAULT_PRECINCT),
+        )
+
+    minimal_voters = [_minimal_voter(voter) for voter in seed["voters"]]
+
+    store = store or VotingStore.get_instance()
+    store.load_fixture(
+        seed["candidates"], minimal_voters, seed.get("invalidated_ballots", [])
+    )
+
+    return [
+        (ballot["voter_national_id"], ballot["ballot_number"])
+        for ballot in seed["ballots"]
+    ]
+
+
+if __name__ == "__main__":
+    write_seed(build_seed(DEFAULT_CANDIDATE_NAMES, DEFAULT_VOTERS))
+    print("Wrote {0}".format(DEFAULT_SEED_PATH))
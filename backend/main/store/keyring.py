@@ -0,0 +1,246 @@
+#
+# This file is the keyring of versioned encryption keys. Keys are read from the secret registry once and cached in
+# memory, instead of being read and base64-decoded from the environment on every encryption.
+#
+# A keyring has one current key, which encrypts, and any number of previous keys, which only decrypt. Every key is
+# identified by a key id derived from the key itself, and ciphertexts record the id of the key they were encrypted
+# under, so that decryption never has to guess. To rotate a key:
+#
+# 1. Set the new key as <SECRET NAME>, and move the old one into <SECRET NAME>_PREVIOUS (a comma-separated list of
+#    base64 keys), or call Keyring.rotate in-process
+# 2. Let the background re-encryption job (main/store/reencryption.py) move every row to the new key
+# 3. Remove the old key from <SECRET NAME>_PREVIOUS
+#
+# A keyring with no key configured refuses to encrypt, unless ALLOW_GENERATED_KEYS=1 lets it generate a key that only
+# the process knows, which is only fit for tests and local development.
+#
+
+import hashlib
+import json
+import os
+import threading
+import warnings
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple
+
+from . import secret_registry
+
+PREVIOUS_KEYS_SUFFIX = "_PREVIOUS"
+KEY_ID_BYTES = 4
+ALLOW_GENERATED_KEYS = "ALLOW_GENERATED_KEYS"
+
+
+class KeyNotConfigured(Exception):
+    """
+    Raised when a key is needed, none is configured, and ALLOW_GENERATED_KEYS isn't set
+    """
+
+
+def generated_keys_allowed() -> bool:
+    """
+    Whether a missing key may be replaced by one generated for this process only
+    """
+    return os.getenv(ALLOW_GENERATED_KEYS) == "1"
+
+
+def key_id(key: bytes) -> str:
+    """
+    The id of a key: a short, non-secret fingerprint of it
+    """
+    return hashlib.sha256(b"key id" + key).digest()[:KEY_ID_BYTES].hex()
+
+
+def ciphertext_key_id(ciphertext: str) -> Optional[str]:
+    """
+    Returns the id of the key a ciphertext was encrypted under, or None for ciphertexts written before key ids existed
+    """
+    return json.loads(ciphertext).get("kid")
+
+
+class Keyring:
+    """
+    The cached, versioned keys of one secret. There is one keyring per secret name.
+
+    >>> keyring = Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV)
+    >>> kid, key = keyring.current()        # the key to encrypt with, and its id
+    >>> keyring.decryption_keys(ciphertext)  # the keys that may decrypt a ciphertext
+    """
+
+    keyring_instances: Dict[str, "Keyring"] = {}
+    _instances_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance(secret_name: str, key_bytes: int = 64) -> "Keyring":
+        keyring = Keyring.keyring_instances.get(secret_name)
+        if keyring is None:
+            with Keyring._instances_lock:
+                keyring = Keyring.keyring_instances.get(secret_name)
+                if keyring is None:
+                    keyring = Keyring(secret_name, key_bytes)
+                    Keyring.keyring_instances[secret_name] = keyring
+
+        return keyring
+
+    @staticmethod
+    def refresh_instances():
+        """
+        Only to be used for testing. Drops every cached keyring, so that secrets changed directly in the environment
+        are picked up.
+        """
+        with Keyring._instances_lock:
+            Keyring.keyring_instances = {}
+
+    def __init__(self, secret_name: str, key_bytes: int):
+        """
+        DO NOT call this method directly - instead use the Keyring.get_instance method above.
+        """
+        self.secret_name = secret_name
+        self.key_bytes = key_bytes
+        self._lock = threading.Lock()
+        self._generation = -1
+        self._current: Optional[Tuple[str, bytes]] = None
+        self._keys: Dict[str, bytes] = {}
+
+    def _load(self):
+        """
+        Reloads the keys if a secret was overwritten since they were last loaded. The caller must hold self._lock.
+        """
+        generation = secret_registry.get_generation()
+        if generation == self._generation:
+            return
+
+        current_key = secret_registry.get_secret_bytes(self.secret_name)
+        previous_keys = [
+            b64decode(encoded)
+            for encoded in (
+                secret_registry.get_secret_str(self.secret_name + PREVIOUS_KEYS_SUFFIX)
+                or ""
+            ).split(",")
+            if encoded
+        ]
+
+        self._current = (key_id(current_key), current_key) if current_key else None
+        self._keys = {key_id(key): key for key in previous_keys}
+        if self._current is not None:
+            self._keys[self._current[0]] = current_key
+        self._generation = generation
+
+    def has_key(self) -> bool:
+        with self._lock:
+            self._load()
+            return self._current is not None
+
+    def current(self) -> Tuple[str, bytes]:
+        """
+        Returns the id and the value of the key to encrypt with.
+
+        If no key is configured and ALLOW_GENERATED_KEYS is set, a random key is generated with a warning. Ciphertexts
+        under a generated key can't be read by any other process, nor after a restart.
+
+        :raises: KeyNotConfigured if no key is configured, and generated keys aren't allowed
+        """
+        with self._lock:
+            self._load()
+            if self._current is not None:
+                return self._current
+
+        if not generated_keys_allowed():
+            raise KeyNotConfigured(
+                "{0} is not set. Set it to a base64-encoded {1} byte key, or set {2}=1 in tests and local "
+                "development".format(
+                    self.secret_name, self.key_bytes, ALLOW_GENERATED_KEYS
+                )
+            )
+        warnings.warn(
+            "{0} is not set: generated a key that only this process knows".format(
+                self.secret_name
+            ),
+            RuntimeWarning,
+        )
+        from Crypto.Random import get_random_bytes
+
+        with self._lock:
+            self._load()
+            if self._current is None:
+                secret_registry.overwrite_secret_bytes(
+                    self.secret_name, get_random_bytes(self.key_bytes)
+                )
+                self._load()
+            assert self._current is not None
+            return self._current
+
+    def get(self, kid: str) -> Optional[bytes]:
+        """
+        Returns the key with the given id, if it is current or previous
+        """
+        with self._lock:
+            self._load()
+            return self._keys.get(kid)
+
+    def previous_key_ids(self) -> List[str]:
+        """
+        Returns the ids of the keys that only decrypt
+        """
+        with self._lock:
+            self._load()
+            return [
+                kid
+                for kid in self._keys
+                if self._current is None or kid != self._current[0]
+            ]
+
+    def decryption_keys(self, ciphertext: str) -> List[bytes]:
+        """
+        Returns the keys to try to decrypt a ciphertext with: the key it names, or every known key (current first) for
+        ciphertexts that don't name one
+        """
+        kid = ciphertext_key_id(ciphertext)
+        with self._lock:
+            self._load()
+            if kid is not None:
+                return [self._keys[kid]] if kid in self._keys else []
+
+            current = [self._current[1]] if self._current is not None else []
+            return current + [key for key in self._keys.values() if key not in current]
+
+    def rotate(self, new_key: Optional[bytes] = None) -> str:
+        """
+        Makes a new key current, keeping the old current key for decryption. The keys are written back to the secret
+        registry.
+
+        :param: new_key The new key. Defaults to a random key.
+        :returns: The id of the new key
+        """
+        from Crypto.Random import get_random_bytes
+
+        new_key = new_key or get_random_bytes(self.key_bytes)
+        with self._lock:
+            self._load()
+            previous_keys = [key for key in self._keys.values() if key != new_key]
+            secret_registry.overwrite_secret_str(
+                self.secret_name + PREVIOUS_KEYS_SUFFIX,
+                ",".join(b64encode(key).decode("utf-8") for key in previous_keys),
+            )
+            secret_registry.overwrite_secret_bytes(self.secret_name, new_key)
+            self._load()
+
+        return key_id(new_key)
+
+    def retire(self, kid: str):
+        """
+        Forgets a previous key, once nothing is encrypted under it anymore
+        """
+        with self._lock:
+            self._load()
+            if self._current is not None and self._current[0] == kid:
+                raise ValueError("The current key can't be retired")
+            previous_keys = [
+                key for other_kid, key in self._keys.items() if other_kid != kid
+            ]
+            if self._current is not None:
+                previous_keys.remove(self._current[1])
+            secret_registry.overwrite_secret_str(
+                self.secret_name + PREVIOUS_KEYS_SUFFIX,
+                ",".join(b64encode(key).decode("utf-8") for key in previous_keys),
+            )
+            self._load()
@@ -0,0 +1,328 @@
+#
+# This file merges the results of precincts counted on separate machines into national results.
+#
+# Each precinct machine either ships its database file, or exports a precinct tally file with:
+#
+# $ python -m main.store.precincts export <tally file> --database <database path>
+#
+# The database defaults to VOTING_STORE_DATABASE.
+#
+# A tally file is JSON lines. The first line is a header with the per-candidate counts of every precinct in the store.
+# Every following line is one registered voter, as [obfuscated national id, precinct, voted], sorted by obfuscated
+# national id. No names, comments or ballot numbers are included.
+#
+# The central merge takes any mix of database files and tally files. Database files are only ever opened read-only:
+#
+# $ python -m main.store.precincts merge <database or tally file>... [--output <results path>]
+#
+# Candidate ids are local to a database, so counts are merged by candidate name, and a store where two candidates share
+# a name is refused. The voters of every input are read in a single streaming pass: the inputs are already sorted by
+# obfuscated national id, so they are merged with heapq.merge, holding one voter per input in memory, and a voter that
+# appears in more than one precinct shows up as a run of equal ids. Such voters are reported as conflicts; those who
+# voted in more than one precinct were counted more than once.
+#
+
+import heapq
+import itertools
+import json
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from ..objects.candidate import Candidate
+from ..objects.tally import ElectionTally
+from .data_registry import VotingStore
+from .tally_engine import DEFAULT_BATCH_SIZE, compute_precinct_tallies
+
+PRECINCT_TALLY_FORMAT_VERSION = 1
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+# A registered voter, as (obfuscated national id, precinct, voted)
+PrecinctVoter = Tuple[str, str, bool]
+
+
+class PrecinctConflict(NamedTuple):
+    """
+    A voter registered in more than one precinct
+    """
+
+    obfuscated_national_id: str
+    precincts: List[str]
+    votes: int
+
+
+class PrecinctMerge(NamedTuple):
+    """
+    The national results merged from several precincts
+    """
+
+    national: ElectionTally
+    precincts: Dict[str, ElectionTally]
+    conflicts: List[PrecinctConflict]
+
+    @property
+    def double_votes(self) -> int:
+        """
+        The number of ballots counted for voters who had already voted in another precinct
+        """
+        return sum(max(0, conflict.votes - 1) for conflict in self.conflicts)
+
+
+def _precinct_header(precinct_tallies: Dict[str, ElectionTally]) -> dict:
+    """
+    The header of a precinct tally file, with the per-candidate counts of each precinct by candidate name
+
+    :raises: ValueError if two candidates share a name, since their counts couldn't be told apart once merged
+    """
+    for tally in precinct_tallies.values():
+        names = [candidate.name for candidate in tally.ranked_candidates]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(
+                "Candidates are merged by name, but more than one candidate is named {0}".format(
+                    ", ".join(duplicates)
+                )
+            )
+
+    return {
+        "version": PRECINCT_TALLY_FORMAT_VERSION,
+        "precincts": {
+            precinct: {
+                "counts": {
+                    candidate.name: tally.counts[candidate.candidate_id]
+                    for candidate in sorted(
+                        tally.ranked_candidates,
+                        key=lambda candidate: int(candidate.candidate_id),
+                    )
+                },
+                "rejected": tally.rejected,
+            }
+            for precinct, tally in precinct_tallies.items()
+        },
+    }
+
+
+def export_precinct_tallies(
+    path: str,
+    store: Optional[VotingStore] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """
+    Writes the per-precinct tallies and the registered voters of the store to a precinct tally file.
+
+    :param: path The path of the tally file to write
+    :param: store The store to export. Defaults to the VotingStore singleton.
+    :param: batch_size The number of rows streamed from the database at a time
+    :returns: The header of the tally file
+    :raises: ValueError if two candidates share a name
+    """
+    store = store or VotingStore.get_instance()
+    header = _precinct_header(compute_precinct_tallies(store, batch_size))
+    with open(path, "w") as tally_file:
+        tally_file.write(json.dumps(header) + "\n")
+        for voter in store.iter_voters_by_national_id(batch_size):
+            tally_file.write(json.dumps(voter) + "\n")
+
+    return header
+
+
+class PrecinctSource:
+    """
+    The results of one or more precincts, read from a database file or a precinct tally file
+    """
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        with open(path, "rb") as source_file:
+            self.is_database = source_file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+        if self.is_database:
+            store = VotingStore.open_database_read_only(path)
+            try:
+                self.header = _precinct_header(
+                    compute_precinct_tallies(store, batch_size)
+                )
+            finally:
+                store.connection.close()
+        else:
+            with open(path) as tally_file:
+                self.header = json.loads(tally_file.readline())
+            if self.header["version"] != PRECINCT_TALLY_FORMAT_VERSION:
+                raise ValueError(
+                    "Unsupported precinct tally version: {0}".format(
+                        self.header["version"]
+                    )
+                )
+
+    @property
+    def precincts(self) -> Dict[str, dict]:
+        """
+        The per-candidate counts and rejected ballots of each precinct, by precinct
+        """
+        return self.header["precincts"]
+
+    def iter_voters(self) -> Iterator[PrecinctVoter]:
+        """
+        Yields the registered voters, sorted by obfuscated national id
+        """
+        if self.is_database:
+            store = VotingStore.open_database_read_only(self.path)
+            try:
+                yield from store.iter_voters_by_national_id(self.batch_size)
+            finally:
+                store.connection.close()
+            return
+
+        with open(self.path) as tally_file:
+            tally_file.readline()
+            for line in tally_file:
+                national_id, precinct, voted = json.loads(line)
+                yield national_id, precinct, voted
+
+
+def merge_precincts(sources: List[PrecinctSource]) -> PrecinctMerge:
+    """
+    Merges the results of several sources into national results, in a single pass over their voters.
+
+    :param: sources The precinct sources to merge
+    :returns: The national tally, the tally of each precinct, and the voters found in more than one precinct
+    :raises: ValueError if two sources report the same precinct
+    """
+    counts_by_precinct: Dict[str, dict] = {}
+    for source in sources:
+        for precinct, precinct_counts in source.precincts.items():
+            if precinct in counts_by_precinct:
+                raise ValueError(
+                    "Precinct {0} is reported by more than one source".format(precinct)
+                )
+            counts_by_precinct[precinct] = precinct_counts
+
+    # Candidates are numbered in the order they are first seen, which follows each source's own candidate ids
+    candidates: Dict[str, Candidate] = {}
+    for precinct_counts in counts_by_precinct.values():
+        for name in precinct_counts["counts"]:
+            if name not in candidates:
+                candidates[name] = Candidate(str(len(candidates) + 1), name)
+    candidate_list = list(candidates.values())
+
+    def tally(counts: Dict[str, int], rejected: int) -> ElectionTally:
+        return ElectionTally(
+            candidate_list,
+            [counts.get(candidate.name, 0) for candidate in candidate_list],
+            rejected,
+        )
+
+    national_counts: Dict[str, int] = {}
+    for precinct_counts in counts_by_precinct.values():
+        for name, count in precinct_counts["counts"].items():
+            national_counts[name] = national_counts.get(name, 0) + count
+
+    conflicts = []
+    voters = heapq.merge(
+        *[source.iter_voters() for source in sources], key=lambda voter: voter[0]
+    )
+    for national_id, registrations in itertools.groupby(
+        voters, key=lambda voter: voter[0]
+    ):
+        registrations = list(registrations)
+        if len(registrations) > 1:
+            conflicts.append(
+                PrecinctConflict(
+                    national_id,
+                    [precinct for _, precinct, _ in registrations],
+                    sum(1 for _, _, voted in registrations if voted),
+                )
+            )
+
+    return PrecinctMerge(
+        tally(
+            national_counts,
+            sum(
+                precinct_counts["rejected"]
+                for precinct_counts in counts_by_precinct.values()
+            ),
+        ),
+        {
+            precinct: tally(precinct_counts["counts"], precinct_counts["rejected"])
+            for precinct, precinct_counts in sorted(counts_by_precinct.items())
+        },
+        conflicts,
+    )
+
+
+def _tally_to_json(tally: ElectionTally) -> dict:
+    return {
+        "counts": {
+            candidate.name: tally.counts[candidate.candidate_id]
+            for candidate in tally.ranked_candidates
+        },
+        "rejected": tally.rejected,
+        "tied_leaders": [candidate.name for candidate in tally.tied_leaders()],
+    }
+
+
+def merge_to_json(merge: PrecinctMerge) -> dict:
+    return {
+        "national": _tally_to_json(merge.national),
+        "precincts": {
+            precinct: _tally_to_json(tally)
+            for precinct, tally in merge.precincts.items()
+        },
+        "conflicts": [conflict._asdict() for conflict in merge.conflicts],
+        "double_votes": merge.double_votes,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    from .data_registry import VOTING_STORE_DATABASE
+
+    parser = argparse.ArgumentParser(description="Export and merge precinct tallies")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export a precinct tally file")
+    export_parser.add_argument("path", help="The tally file to write")
+    export_parser.add_argument(
+        "--database",
+        default=os.getenv(VOTING_STORE_DATABASE),
+        help="The database file of the store",
+    )
+    merge_parser = subparsers.add_parser("merge", help="Merge precinct results")
+    merge_parser.add_argument(
+        "paths", nargs="+", help="Precinct database files or tally files"
+    )
+    merge_parser.add_argument("--output", help="Where to write the national results")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not args.database:
+            sys.exit(
+                "The in-memory store would be empty: pass --database or set {0}".format(
+                    VOTING_STORE_DATABASE
+                )
+            )
+        os.environ[VOTING_STORE_DATABASE] = args.database
+
+        header = export_precinct_tallies(args.path)
+        print(
+            "Exported {0} precincts to {1}".format(len(header["precincts"]), args.path)
+        )
+    else:
+        results = merge_to_json(
+            merge_precincts([PrecinctSource(path) for path in args.paths])
+        )
+        if args.output:
+            with open(args.output, "w") as results_file:
+                json.dump(results, results_file, indent=2)
+                results_file.write("\n")
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        if results["conflicts"]:
+            print(
+                "{0} voters appear in more than one precinct, {1} ballots were counted twice".format(
+                    len(results["conflicts"]), results["double_votes"]
+                ),
+                file=sys.stderr,
+            )
@@ -0,0 +1,142 @@
+#
+# This file is the background job that re-encrypts voter names under the current name encryption key after a key
+# rotation (see main/store/keyring.py). It walks the voters table in small voter id ranges, and only holds the database
+# for one range at a time, so balloting keeps going while it runs. Its crypto runs at the lowest executor priority, and
+# it is rate limited to NAME_REENCRYPTION_ROWS_PER_SECOND rows per second.
+#
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from ..crypto.executor import Priority
+from ..objects.voter import NAME_ENCRYPTION_KEY_AES_SIV, decrypt_name, encrypt_name
+from .data_registry import VotingStore
+from .keyring import Keyring
+
+NAME_REENCRYPTION_ROWS_PER_SECOND = "NAME_REENCRYPTION_ROWS_PER_SECOND"
+DEFAULT_ROWS_PER_SECOND = 200.0
+DEFAULT_BATCH_SIZE = 256
+
+
+class NameReencryptionJob:
+    """
+    Re-encrypts every voter name that isn't under the current key.
+
+    >>> job = NameReencryptionJob()
+    >>> job.start()   # one pass over the voters table, in a background thread
+    >>> job.reencrypted, job.finished
+    """
+
+    def __init__(
+        self,
+        store: Optional[VotingStore] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        rows_per_second: Optional[float] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.store = store or VotingStore.get_instance()
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second or float(
+            os.getenv(NAME_REENCRYPTION_ROWS_PER_SECOND, DEFAULT_ROWS_PER_SECOND)
+        )
+        self._sleep = sleep
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.reencrypted = 0
+        self.failed = 0
+        self.finished = False
+
+    def run_batch(self, after_voter_id: int) -> int:
+        """
+        Re-encrypts the names of the voters with ids in (after_voter_id, after_voter_id + batch_size].
+
+        :returns: The number of voters whose names were re-encrypted
+        """
+        kid, _ = Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV).current()
+        replacements = []
+        for voter_id, first_name, last_name in self.store.get_voter_names_not_under_key(
+            kid, after_voter_id, self.batch_size
+        ):
+            try:
+                replacements.append(
+                    (
+                        voter_id,
+                        first_name,
+                        last_name,
+                        _reencrypt(first_name),
+                        _reencrypt(last_name),
+                    )
+                )
+            except Exception:
+                # Encrypted under a key that is no longer in the keyring, so it can't be moved to the current key
+                self.failed += 1
+
+        # Names that changed in the meantime are left alone, and picked up by the next pass
+        return self.store.replace_voter_names(replacements)
+
+    def run(self) -> int:
+        """
+        Makes one rate-limited pass over the voters table.
+
+        :returns: The number of voters whose names were re-encrypted
+        """
+        reencrypted_before = self.reencrypted
+        max_voter_id = self.store.get_max_voter_id()
+        for after_voter_id in range(0, max_voter_id, self.batch_size):
+            if self._stopped.is_set():
+                break
+
+            start = time.perf_counter()
+            reencrypted = self.run_batch(after_voter_id)
+            self.reencrypted += reencrypted
+
+            # Pace the job so that it re-encrypts at most rows_per_second rows per second on average
+            remaining = reencrypted / self.rows_per_second - (
+                time.perf_counter() - start
+            )
+            if remaining > 0:
+                self._sleep(remaining)
+        else:
+            self.finished = True
+
+        return self.reencrypted - reencrypted_before
+
+    def start(self):
+        """
+        Runs one pass in a background thread
+        """
+        self._thread = threading.Thread(
+            target=self.run, name="name-reencryption", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _reencrypt(encrypted_name: str) -> str:
+    return encrypt_name(
+        decrypt_name(encrypted_name, priority=Priority.REPORTING),
+        priority=Priority.REPORTING,
+    )
+
+
+def start_if_rotated(
+    store: Optional[VotingStore] = None,
+) -> Optional[NameReencryptionJob]:
+    """
+    Starts a re-encryption pass in the background if the keyring holds previous keys, i.e. a rotation is under way.
+
+    :returns: The running job, or None if there is nothing to re-encrypt
+    """
+    if not Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV).previous_key_ids():
+        return None
+
+    job = NameReencryptionJob(store)
+    job.start()
+    return job
@@ -7,10 +7,18 @@ import os
 from base64 import b64decode, b64encode
 from typing import Optional
 
-import bcrypt
-
 UTF_8 = "utf-8"
 
+# Bumped every time a secret is overwritten, so that caches of secrets (such as the keyring) know to reload
+_generation = 0
+
+
+def get_generation() -> int:
+    """
+    Returns a number that changes every time a secret is overwritten through this module
+    """
+    return _generation
+
 
 def get_secret_str(secret_name: str) -> Optional[str]:
     """
@@ -23,7 +31,9 @@ def overwrite_secret_str(secret_name: str, secret_value: str):
     """
     Will overwrite the secret, even if there already is a secret present for the given secret_name
     """
+    global _generation
     os.environ[secret_name] = secret_value
+    _generation += 1
 
 
 def get_secret_bytes(secret_name: str) -> Optional[bytes]:
@@ -40,8 +50,10 @@ def overwrite_secret_bytes(secret_name: str, secret_value: bytes):
     """
     Will overwrite the secret, even if there already is a secret present for the given secret_name
     """
-    os.environ[secret_name] = b64encode(secret_value).decode(UTF_8)
+    overwrite_secret_str(secret_name, b64encode(secret_value).decode(UTF_8))
 
 
 def gen_salt() -> bytes:
+    import bcrypt
+
     return bcrypt.gensalt()
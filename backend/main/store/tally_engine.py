@@ -0,0 +1,128 @@
+#
+# This file computes election tallies. Instead of aggregating in SQL on every request, the candidate id column of the
+# ballots table is loaded into a contiguous integer array, batch by batch, and counted with numpy's bincount.
+#
+# numpy is imported inside the functions that use it, so that importing this module stays cheap.
+#
+
+from typing import Dict, Optional
+
+from ..objects.tally import ElectionTally
+from .data_registry import VotingStore
+
+DEFAULT_BATCH_SIZE = 65536
+
+
+def load_candidate_ids(
+    store: Optional[VotingStore] = None, batch_size: int = DEFAULT_BATCH_SIZE
+):
+    """
+    Loads the candidate id of every cast ballot into a contiguous int64 numpy array, batch_size rows at a time.
+
+    :param: store The store to read from. Defaults to the VotingStore singleton.
+    :param: batch_size The number of rows fetched from the database at a time
+    :returns: A numpy array with one candidate id per cast ballot
+    """
+    import numpy as np
+
+    store = store or VotingStore.get_instance()
+    batches = [
+        np.array(batch.split(" "), dtype=np.int64)
+        for batch in store.iter_ballot_candidate_ids(batch_size)
+    ]
+    if not batches:
+        return np.zeros(0, dtype=np.int64)
+
+    return np.concatenate(batches)
+
+
+def bin_candidate_ids(candidate_ids, max_id: int):
+    """
+    Counts the ballots for each candidate id from 1 to max_id. Ids out of that range are counted in slot 0, which is
+    never a registered candidate id. Bins of separate chunks of ballots can be summed.
+
+    :param: candidate_ids A numpy integer array with one candidate id per ballot
+    :param: max_id The largest registered candidate id
+    :returns: A numpy array of max_id + 1 counts
+    """
+    import numpy as np
+
+    # bincount can't take negative ids, so anything out of range is folded into slot 0
+    in_range = (candidate_ids > 0) & (candidate_ids <= max_id)
+    return np.bincount(np.where(in_range, candidate_ids, 0), minlength=max_id + 1)
+
+
+def max_candidate_id(candidates) -> int:
+    return max((int(candidate.candidate_id) for candidate in candidates), default=0)
+
+
+def tally_from_bins(bins, candidates) -> ElectionTally:
+    """
+    Builds the tally of the registered candidates from bins produced by bin_candidate_ids.
+
+    :param: bins The per-id counts, of length max_candidate_id(candidates) + 1
+    :param: candidates Every registered candidate
+    :returns: The tally of the binned ballots
+    """
+    counts = [int(bins[int(candidate.candidate_id)]) for candidate in candidates]
+    return ElectionTally(candidates, counts, rejected=int(bins.sum()) - sum(counts))
+
+
+def tally_candidate_ids(candidate_ids, candidates) -> ElectionTally:
+    """
+    Counts an array of candidate ids. Ids that don't belong to a registered candidate are counted as rejected.
+
+    :param: candidate_ids A numpy integer array with one candidate id per ballot
+    :param: candidates Every registered candidate
+    :returns: The tally of the given ballots
+    """
+    return tally_from_bins(
+        bin_candidate_ids(candidate_ids, max_candidate_id(candidates)), candidates
+    )
+
+
+def compute_tally(
+    store: Optional[VotingStore] = None, batch_size: int = DEFAULT_BATCH_SIZE
+) -> ElectionTally:
+    """
+    Tallies every ballot cast so far.
+
+    :param: store The store to read from. Defaults to the VotingStore singleton.
+    :param: batch_size The number of rows fetched from the database at a time
+    :returns: The tally of all cast ballots
+    """
+    store = store or VotingStore.get_instance()
+    return tally_candidate_ids(
+        load_candidate_ids(store, batch_size), store.get_all_candidates()
+    )
+
+
+def compute_precinct_tallies(
+    store: Optional[VotingStore] = None, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict[str, ElectionTally]:
+    """
+    Tallies every ballot cast so far, separately for each precinct.
+
+    :param: store The store to read from. Defaults to the VotingStore singleton.
+    :param: batch_size The number of rows fetched from the database at a time
+    :returns: The tally of each precinct that has registered voters or cast ballots, by precinct
+    """
+    import numpy as np
+
+    store = store or VotingStore.get_instance()
+    candidates = store.get_all_candidates()
+    max_id = max_candidate_id(candidates)
+    bins = {
+        precinct: np.zeros(max_id + 1, dtype=np.int64)
+        for precinct in store.get_precincts()
+    }
+
+    for precinct, batch in store.iter_precinct_ballot_candidate_ids(batch_size):
+        bins[precinct] += bin_candidate_ids(
+            np.array(batch.split(" "), dtype=np.int64), max_id
+        )
+
+    return {
+        precinct: tally_from_bins(precinct_bins, candidates)
+        for precinct, precinct_bins in bins.items()
+    }
@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+from main.api import metrics
+from main.api.admission import (
+    AdmissionController,
+    Overloaded,
+    RateLimited,
+    TokenBucketLimiter,
+    admission_controlled,
+)
+
+WORK_SECONDS = 0.05
+
+
+class TestAdmission:
+    def test_overload_keeps_p99_bounded(self):
+        """
+        Fires far more concurrent requests than the endpoint can serve, and checks that the excess is shed quickly with
+        a Retry-After, while the latency of every request stays bounded by the queue length.
+        """
+        controller = AdmissionController(
+            "overload_test", max_in_flight=2, max_queue=4, queue_timeout_seconds=5
+        )
+
+        @admission_controlled(controller)
+        def slow_view():
+            time.sleep(WORK_SECONDS)
+            return "ok"
+
+        results = []
+        results_lock = threading.Lock()
+        start_barrier = threading.Barrier(50)
+
+        def client():
+            start_barrier.wait()
+            start = time.perf_counter()
+            response = slow_view()
+            latency = time.perf_counter() - start
+            with results_lock:
+                results.append((response, latency))
+
+        threads = [threading.Thread(target=client) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        served = [latency for response, latency in results if response == "ok"]
+        shed = [
+            (response, latency) for response, latency in results if response != "ok"
+        ]
+        assert 2 <= len(served) <= 6
+        assert len(shed) == 50 - len(served)
+        for response, _ in shed:
+            assert response[1] == 503
+            assert int(response[2]["Retry-After"]) >= 1
+
+        # Each request waits for at most (queue + in flight) / in flight rounds of work
+        latencies = sorted(latency for _, latency in results)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        assert p99 < (4 + 2) / 2 * WORK_SECONDS + 0.5
+        assert max(latency for _, latency in shed) < 0.5
+
+        snapshot = metrics.snapshot()
+        assert snapshot["admission.overload_test.shed"] == len(shed)
+        assert snapshot["admission.overload_test.queue_depth"] == 0
+
+    def test_queue_timeout(self):
+        """
+        Checks that a queued request is shed once it has waited longer than the queue timeout.
+        """
+        controller = AdmissionController(
+            "timeout_test", max_in_flight=1, max_queue=1, queue_timeout_seconds=0.01
+        )
+        with controller.admit():
+            with pytest.raises(Overloaded):
+                with controller.admit():
+                    pass
+
+    def test_waiters_are_admitted_in_order(self):
+        """
+        Checks that queued requests are admitted oldest first, and that a new request doesn't overtake them.
+        """
+        controller = AdmissionController(
+            "fifo_test", max_in_flight=1, max_queue=8, queue_timeout_seconds=5
+        )
+        admitted = []
+
+        def request(index):
+            with controller.admit():
+                admitted.append(index)
+
+        with controller.admit():
+            threads = []
+            for index in range(5):
+                thread = threading.Thread(target=request, args=(index,))
+                thread.start()
+                threads.append(thread)
+                while controller.queue_depth < index + 1:
+                    time.sleep(0.001)
+        # Arrives as the slot frees up, but the waiters were there first
+        request(5)
+        for thread in threads:
+            thread.join()
+
+        assert admitted == list(range(6))
+        assert controller.in_flight == 0
+        assert controller.queue_depth == 0
+
+    def test_metrics_endpoint_requires_the_admin_token(self, monkeypatch):
+        """
+        Checks that /api/metrics, which reports queue depths, only exists with an admin token, and requires it.
+        """
+        from main.api import backend_rest_api
+
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        client = backend_rest_api.app.test_client()
+        monkeypatch.delenv(metrics.METRICS_ADMIN_TOKEN, raising=False)
+        assert client.get("/api/metrics").status_code == 404
+
+        monkeypatch.setenv(metrics.METRICS_ADMIN_TOKEN, "secret")
+        assert client.get("/api/metrics").status_code == 401
+        response = client.get("/api/metrics", headers={"Authorization": "Bearer wrong"})
+        assert response.status_code == 401
+        response = client.get(
+            "/api/metrics", headers={"Authorization": "Bearer secret"}
+        )
+        assert response.status_code == 200
+        assert "admission.count_ballot.in_flight" in response.get_json()
+
+    def test_token_bucket(self):
+        """
+        Checks that each client gets its burst, is limited after that, and is refilled over time.
+        """
+        now = [0.0]
+        limiter = TokenBucketLimiter(
+            "bucket_test", rate_per_second=1, burst=2, clock=lambda: now[0]
+        )
+
+        limiter.acquire("client-1")
+        limiter.acquire("client-1")
+        with pytest.raises(RateLimited) as overloaded:
+            limiter.acquire("client-1")
+        assert overloaded.value.retry_after_seconds == pytest.approx(1)
+
+        # Other clients have their own bucket
+        limiter.acquire("client-2")
+
+        now[0] = 1.0
+        limiter.acquire("client-1")
+
+    def test_rate_limited_requests_get_429(self):
+        """
+        Checks that a rate limited client gets a 429, while a request shed because the queue is full gets a 503.
+        """
+        limiter = TokenBucketLimiter(
+            "status_test", rate_per_second=1, burst=1, clock=lambda: 0.0
+        )
+        controller = AdmissionController(
+            "status_test", max_in_flight=1, max_queue=0, queue_timeout_seconds=0
+        )
+
+        @admission_controlled(controller, limiter)
+        def view():
+            return "ok"
+
+        assert view() == "ok"
+        response = view()
+        assert response[:2] == ({"status": "rate limited"}, 429)
+
+        with controller.admit():
+            response = admission_controlled(controller)(lambda: "ok")()
+        assert response[1] == 503
@@ -0,0 +1,164 @@
+import os
+
+import main.api.balloting as balloting
+import main.api.registry as registry
+import pytest
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter
+from main.store.audit_log import (
+    RECORD,
+    AuditEvent,
+    AuditLog,
+    AuditLogReader,
+    ballot_subject,
+    voter_subject,
+)
+from main.store.data_registry import VotingStore
+
+
+class TestAuditLog:
+    def test_balloting_events_are_logged(self, tmp_path):
+        """
+        Checks that issuing, counting, invalidating, fraud and de-registration are all recorded in order.
+        """
+        path = str(tmp_path / "audit.log")
+        AuditLog.configure(path)
+
+        voter = Voter("Adam", "Smith", "111111111")
+        other_voter = Voter("Linda", "Qi", "444444444")
+        registry.register_voter(voter)
+        registry.register_voter(other_voter)
+        candidate = registry.get_all_candidates()[0]
+
+        spoiled = balloting.issue_ballot(voter.national_id)
+        balloting.invalidate_ballot(spoiled)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        ballot = Ballot(ballot_number, candidate.candidate_id, "")
+        balloting.count_ballot(ballot, voter.national_id)
+        balloting.count_ballot(ballot, voter.national_id)
+        registry.de_register_voter(other_voter.national_id)
+        AuditLog.configure(None)
+
+        with AuditLogReader(path) as reader:
+            reader.verify()
+            events = list(reader.replay())
+
+        assert [event.event for event in events] == [
+            AuditEvent.BALLOT_ISSUED,
+            AuditEvent.BALLOT_INVALIDATED,
+            AuditEvent.BALLOT_ISSUED,
+            AuditEvent.BALLOT_COUNTED,
+            AuditEvent.FRAUD_FLAGGED,
+            AuditEvent.VOTER_DEREGISTERED,
+        ]
+        assert events[1].subject == ballot_subject(spoiled)
+        assert events[3].subject == ballot_subject(ballot_number)
+        assert events[3].candidate_id == int(candidate.candidate_id)
+        assert events[4].subject == voter_subject(voter.national_id)
+
+    def test_log_only_holds_obfuscated_identifiers(self, tmp_path):
+        """
+        Checks that neither national ids nor ballot numbers appear in the log file.
+        """
+        path = str(tmp_path / "audit.log")
+        AuditLog.configure(path)
+
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        balloting.invalidate_ballot(ballot_number)
+        AuditLog.configure(None)
+
+        with open(path, "rb") as log_file:
+            contents = log_file.read()
+        assert voter.national_id.encode("utf-8") not in contents
+        assert ballot_number.encode("utf-8") not in contents
+
+    def test_rebuild_counts_and_recover_torn_tail(self, tmp_path):
+        """
+        Checks that tallies can be rebuilt from the log, and that a torn record at the tail is dropped on reopen.
+        """
+        path = str(tmp_path / "audit.log")
+        audit_log = AuditLog.configure(path, fsync_batch=2)
+        for index in range(5):
+            audit_log.append(
+                AuditEvent.BALLOT_COUNTED, ballot_subject(str(index)), index % 2 + 1
+            )
+        AuditLog.configure(None)
+
+        with open(path, "ab") as log_file:
+            log_file.write(b"\x00" * (RECORD.size // 2))
+
+        audit_log = AuditLog.configure(path)
+        audit_log.append(AuditEvent.BALLOT_COUNTED, ballot_subject("5"), 2)
+        AuditLog.configure(None)
+
+        with AuditLogReader(path) as reader:
+            reader.verify()
+            assert len(reader) == 6
+            assert reader.rebuild_counts() == {"1": 3, "2": 3}
+
+    def test_verify_detects_gaps(self, tmp_path):
+        """
+        Checks that verification catches a record that was removed from the middle of the log.
+        """
+        path = str(tmp_path / "audit.log")
+        audit_log = AuditLog.configure(path)
+        for index in range(3):
+            audit_log.append(AuditEvent.BALLOT_INVALIDATED, ballot_subject(str(index)))
+        AuditLog.configure(None)
+
+        with open(path, "rb") as log_file:
+            contents = log_file.read()
+        header_size = len(contents) - 3 * RECORD.size
+        with open(path, "wb") as log_file:
+            log_file.write(contents[: header_size + RECORD.size])
+            log_file.write(contents[header_size + 2 * RECORD.size :])
+
+        with AuditLogReader(path) as reader:
+            with pytest.raises(ValueError):
+                reader.verify()
+
+    def test_processes_share_the_log(self, tmp_path):
+        """
+        Checks that a forked process appending to the same log doesn't reuse sequence ids, nor rewrite the records the
+        parent had buffered when it forked.
+        """
+        path = str(tmp_path / "audit.log")
+        audit_log = AuditLog.configure(path, fsync_interval_seconds=60)
+        for index in range(3):
+            audit_log.append(AuditEvent.BALLOT_ISSUED, ballot_subject(str(index)))
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                child_log = AuditLog.configure(path, fsync_batch=1)
+                for index in range(50):
+                    child_log.append(
+                        AuditEvent.BALLOT_COUNTED, ballot_subject(str(index)), 1
+                    )
+                AuditLog.configure(None)
+            finally:
+                os._exit(0)
+
+        for index in range(50):
+            audit_log.append(AuditEvent.BALLOT_COUNTED, ballot_subject(str(index)), 2)
+            if index % 10 == 0:
+                audit_log.flush()
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        AuditLog.configure(None)
+
+        with AuditLogReader(path) as reader:
+            reader.verify()
+            assert len(reader) == 103
+            assert reader.rebuild_counts() == {"1": 50, "2": 50}
+
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+
+        yield
+
+        AuditLog.configure(None)
@@ -1,6 +1,8 @@
 import main.api.balloting as balloting
 import main.api.registry as registry
 import pytest
+from main.api.verification_cache import VerificationCache
+from main.crypto import primitives
 from main.objects.ballot import Ballot
 from main.objects.voter import BallotStatus, Voter, VoterStatus
 from main.store.data_registry import VotingStore
@@ -302,6 +304,104 @@ class TestBalloting:
             == BallotStatus.BALLOT_COUNTED
         )
 
+    def test_unknown_candidate_is_rejected_before_crypto(self, monkeypatch):
+        """
+        Ensures that a ballot for a candidate that isn't registered is rejected without checking the ballot number, and
+        that the voter can still vote afterwards
+        """
+        voter = all_voters[0]
+        ballot_number = balloting.issue_ballot(voter.national_id)
+
+        bcrypt_check = primitives.bcrypt_check
+        monkeypatch.setattr(
+            primitives,
+            "bcrypt_check",
+            lambda *args: pytest.fail("bcrypt ran for an unknown candidate"),
+        )
+        for bogus_candidate_id in ["999", "", "1 OR 1=1", None]:
+            assert (
+                balloting.count_ballot(
+                    Ballot(ballot_number, bogus_candidate_id, ""), voter.national_id
+                )
+                == BallotStatus.INVALID_CANDIDATE
+            )
+        monkeypatch.setattr(primitives, "bcrypt_check", bcrypt_check)
+
+        all_candidates = registry.get_all_candidates()
+        ballot = Ballot(ballot_number, all_candidates[0].candidate_id, "")
+        assert balloting.count_ballot(ballot, voter.national_id) == (
+            BallotStatus.BALLOT_COUNTED
+        )
+
+    def test_verified_ballot_is_counted_without_second_check(self, monkeypatch):
+        """
+        Ensures that counting a ballot that was just verified for the same voter doesn't check the ballot number again
+        """
+        voter = all_voters[0]
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
+
+        monkeypatch.setattr(
+            primitives,
+            "bcrypt_check",
+            lambda *args: pytest.fail("bcrypt ran for a verified ballot"),
+        )
+        candidate = registry.get_all_candidates()[0]
+        ballot = Ballot(ballot_number, candidate.candidate_id, "")
+        assert (
+            balloting.count_ballot(ballot, voter.national_id)
+            == BallotStatus.BALLOT_COUNTED
+        )
+        cache = VerificationCache.get_instance()
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert cache.hit_rate == 1.0
+        assert cache.seconds_saved > 0
+
+    def test_verification_cache_misses(self, monkeypatch):
+        """
+        Ensures that the ballot number is checked again for another voter, after the ballot is invalidated, and once
+        the verification has expired
+        """
+        now = [0.0]
+        cache = VerificationCache.configure(100, 60.0, clock=lambda: now[0])
+        voter, other_voter = all_voters[:2]
+        candidate = registry.get_all_candidates()[0]
+        checks = []
+        bcrypt_check = primitives.bcrypt_check
+
+        def counting_bcrypt_check(*args):
+            checks.append(args)
+            return bcrypt_check(*args)
+
+        monkeypatch.setattr(primitives, "bcrypt_check", counting_bcrypt_check)
+
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
+        ballot = Ballot(ballot_number, candidate.candidate_id, "")
+        assert (
+            balloting.count_ballot(ballot, other_voter.national_id)
+            == BallotStatus.VOTER_BALLOT_MISMATCH
+        )
+        assert len(checks) == 2
+
+        assert balloting.invalidate_ballot(ballot_number)
+        assert (
+            balloting.count_ballot(ballot, voter.national_id)
+            == BallotStatus.INVALID_BALLOT
+        )
+        assert len(checks) == 3
+
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
+        now[0] = 61.0
+        ballot = Ballot(ballot_number, candidate.candidate_id, "")
+        assert (
+            balloting.count_ballot(ballot, voter.national_id)
+            == BallotStatus.BALLOT_COUNTED
+        )
+        assert len(checks) == 5
+        assert (cache.hits, cache.misses) == (0, 3)
+
     def test_invalidate_ballot_after_use(self):
         """
         Ensures that a ballot that is cast cannot be invalidated
@@ -415,6 +515,7 @@ class TestBalloting:
         Sets up the candidates and voters
         """
         VotingStore.refresh_instance()
+        VerificationCache.configure(100, 60.0)
 
         # Populate candidates
         expected_candidate_names = {"Kathryn Collins", "Aditya Guha", "Rina Harvey"}
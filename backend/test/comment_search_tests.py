@@ -0,0 +1,101 @@
+import pytest
+
+from main.api import backend_rest_api, balloting
+from main.objects.ballot import Ballot
+from main.store.data_registry import VotingStore
+
+COMMENTS = [
+    "The voting machine was broken when I arrived",
+    "Long line at the booth, but the staff were kind",
+    "Waited in a long line for two hours",
+    "Machines broke down and the lines were long",
+    "Great experience!",
+    "",
+    None,
+]
+
+
+class TestCommentSearch:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        for index, comment in enumerate(COMMENTS):
+            store.add_ballot(Ballot("ballot-{0}".format(index), "1", comment), "")
+        yield
+
+    def test_search_matches_every_word(self):
+        """
+        Checks that comments match when they contain every word of the query, by stem, and that quoted words match as a
+        phrase
+        """
+        assert balloting.search_ballot_comments("machine broken").comments == [
+            COMMENTS[0]
+        ]
+        assert set(balloting.search_ballot_comments("long lines").comments) == {
+            COMMENTS[1],
+            COMMENTS[2],
+            COMMENTS[3],
+        }
+        assert set(balloting.search_ballot_comments('"long line"').comments) == {
+            COMMENTS[1],
+            COMMENTS[2],
+        }
+        assert balloting.search_ballot_comments("ballot").comments == []
+        assert balloting.search_ballot_comments('"" -- ()').comments == []
+        # FTS5 operators in user input are searched for as plain words
+        assert balloting.search_ballot_comments("long OR NEAR(great").comments == []
+
+    def test_search_is_kept_in_sync(self):
+        """
+        Checks that ballots cast after the index was created are searchable
+        """
+        store = VotingStore.get_instance()
+        store.add_ballot(Ballot("ballot-late", "1", "The machine jammed"), "")
+
+        assert balloting.search_ballot_comments("jammed").comments == [
+            "The machine jammed"
+        ]
+
+    def test_search_pagination(self):
+        """
+        Checks that paging through the results returns every match exactly once, in rank order
+        """
+        all_results = balloting.search_ballot_comments("line", limit=10)
+        assert all_results.next_cursor is None
+        assert len(all_results.comments) == 3
+
+        paged = []
+        cursor = None
+        while True:
+            page = balloting.search_ballot_comments("line", limit=1, cursor=cursor)
+            paged.extend(page.comments)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        assert paged == all_results.comments
+
+        with pytest.raises(ValueError):
+            balloting.search_ballot_comments("line", cursor="not a cursor")
+
+    def test_search_endpoint(self, monkeypatch):
+        """
+        Checks the search endpoint, including malformed cursors
+        """
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        client = backend_rest_api.app.test_client()
+
+        response = client.get("/api/ballot_comments/search?q=long+line&limit=2")
+        assert response.status_code == 200
+        first_page = response.get_json()
+        assert len(first_page["comments"]) == 2
+
+        response = client.get(
+            "/api/ballot_comments/search",
+            query_string={"q": "long line", "cursor": first_page["next_cursor"]},
+        )
+        assert len(response.get_json()["comments"]) == 1
+        assert response.get_json()["next_cursor"] is None
+
+        response = client.get("/api/ballot_comments/search?q=line&cursor=AAAA")
+        assert response.status_code == 400
@@ -0,0 +1,24 @@
+import os
+from base64 import b64encode
+
+import pytest
+from main.api.idempotency import IDEMPOTENCY_FINGERPRINT_KEY_HMAC
+from main.detection.redaction_pipeline import COMMENT_QUARANTINE_KEY_AES_SIV
+from main.objects.voter import NAME_BLIND_INDEX_KEY_HMAC, NAME_ENCRYPTION_KEY_AES_SIV
+
+# Keyrings refuse to generate keys unless told to (see main/store/keyring.py), so the tests configure their own
+TEST_KEYS = {
+    NAME_ENCRYPTION_KEY_AES_SIV: 64,
+    NAME_BLIND_INDEX_KEY_HMAC: 32,
+    COMMENT_QUARANTINE_KEY_AES_SIV: 64,
+    IDEMPOTENCY_FINGERPRINT_KEY_HMAC: 32,
+}
+
+
+@pytest.fixture(autouse=True, scope="session")
+def configure_keys():
+    for secret_name, key_bytes in TEST_KEYS.items():
+        os.environ.setdefault(
+            secret_name, b64encode(os.urandom(key_bytes)).decode("utf-8")
+        )
+    yield
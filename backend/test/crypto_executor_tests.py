@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+from main.crypto import primitives
+from main.crypto.executor import CryptoExecutor, CryptoQueueFull, Priority
+
+KEY = bytes(range(64))
+
+
+class TestCryptoExecutor:
+    def test_inline_executor(self):
+        """
+        Checks that with no workers, tasks run on the calling thread and both front-ends return their results.
+        """
+        executor = CryptoExecutor.configure(0)
+        ciphertext = executor.run(
+            Priority.ISSUANCE, primitives.aes_siv_encrypt, KEY, "Adam"
+        )
+        assert (
+            asyncio.run(
+                executor.run_async(
+                    Priority.REPORTING, primitives.aes_siv_decrypt, KEY, ciphertext
+                )
+            )
+            == "Adam"
+        )
+
+    def test_worker_pool_runs_by_priority(self):
+        """
+        Checks that while the only worker is busy, queued tasks are run casting first, then issuance, then reporting.
+        """
+        executor = CryptoExecutor.configure(1)
+        blocker = executor.submit(Priority.REPORTING, primitives.bcrypt_hash, b"busy")
+        while executor.busy_workers == 0:
+            time.sleep(0.001)
+
+        completed = []
+        for priority in [Priority.REPORTING, Priority.ISSUANCE, Priority.CASTING]:
+            future = executor.submit(
+                priority, primitives.aes_siv_encrypt, KEY, priority.name
+            )
+            future.add_done_callback(
+                lambda _, priority=priority: completed.append(priority)
+            )
+
+        assert primitives.bcrypt_check(b"busy", blocker.result())
+        executor.shutdown()
+        assert completed == [Priority.CASTING, Priority.ISSUANCE, Priority.REPORTING]
+
+    def test_worker_pool_queue_is_bounded(self):
+        """
+        Checks that submissions beyond the queue bound are refused rather than queued.
+        """
+        executor = CryptoExecutor.configure(1, max_queue=1)
+        executor.submit(Priority.CASTING, primitives.bcrypt_hash, b"busy")
+        while executor.busy_workers == 0:
+            time.sleep(0.001)
+
+        executor.submit(Priority.CASTING, primitives.aes_siv_encrypt, KEY, "queued")
+        with pytest.raises(CryptoQueueFull):
+            executor.submit(Priority.CASTING, primitives.aes_siv_encrypt, KEY, "full")
+
+    def test_lower_priorities_are_refused_first(self):
+        """
+        Checks that issuance and reporting tasks can't fill the whole queue, so that casting always finds room.
+        """
+        executor = CryptoExecutor.configure(1, max_queue=4)
+        executor.submit(Priority.CASTING, primitives.bcrypt_hash, b"busy")
+        while executor.busy_workers == 0:
+            time.sleep(0.001)
+
+        for priority, admitted in [
+            (Priority.REPORTING, 2),
+            (Priority.ISSUANCE, 1),
+            (Priority.CASTING, 1),
+        ]:
+            for _ in range(admitted):
+                executor.submit(priority, primitives.aes_siv_encrypt, KEY, "queued")
+            with pytest.raises(CryptoQueueFull):
+                executor.submit(priority, primitives.aes_siv_encrypt, KEY, "full")
+        assert executor.queue_depth == 4
+
+    def test_queue_full_is_shed_with_retry_after(self, monkeypatch):
+        """
+        Checks that the REST API answers a full crypto queue with a 503 and a Retry-After header, and that the metrics
+        don't start the executor.
+        """
+        from main.api import backend_rest_api, balloting, metrics
+
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        monkeypatch.setenv(metrics.METRICS_ADMIN_TOKEN, "secret")
+        CryptoExecutor.crypto_executor_instance = None
+        client = backend_rest_api.app.test_client()
+        response = client.get(
+            "/api/metrics", headers={"Authorization": "Bearer secret"}
+        )
+        assert "crypto.queue_depth" not in response.get_json()
+        assert CryptoExecutor.crypto_executor_instance is None
+
+        def queue_full(*args):
+            raise CryptoQueueFull("4 crypto tasks are already queued")
+
+        monkeypatch.setattr(balloting, "count_ballot", queue_full)
+        response = client.post(
+            "/api/count_ballot",
+            json={
+                "ballot_number": "ballot",
+                "chosen_candidate_id": "1",
+                "voter_comments": "",
+                "voter_national_id": "111-11-1111",
+            },
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+    def test_worker_pool_propagates_exceptions(self):
+        """
+        Checks that an exception raised in a worker process is raised to the caller.
+        """
+        executor = CryptoExecutor.configure(1)
+        with pytest.raises(ValueError):
+            executor.run(
+                Priority.CASTING, primitives.bcrypt_check, b"id", b"not a hash"
+            )
+
+    @pytest.fixture(autouse=True)
+    def restore_inline_executor(self):
+        yield
+
+        CryptoExecutor.configure(0)
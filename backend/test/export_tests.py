@@ -0,0 +1,160 @@
+import os
+import subprocess
+import sys
+
+import main.api.balloting as balloting
+import main.api.registry as registry
+import main.store.export as export
+import numpy as np
+import pytest
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter
+from main.store.data_registry import VOTING_STORE_DATABASE, VotingStore
+from main.store.export import ElectionExport, export_election
+
+
+def cast_ballots(candidate_ids, comment=""):
+    """
+    Stores ballots directly, without going through voter validation
+    """
+    store = VotingStore.get_instance()
+    start = len(list(store.iter_ballot_candidate_ids(1)))
+    for index, candidate_id in enumerate(candidate_ids):
+        store.add_ballot(
+            Ballot("ballot-{0}".format(start + index), candidate_id, comment), ""
+        )
+
+
+class TestExport:
+    def test_export_round_trip(self, tmp_path):
+        """
+        Checks that the exported columns, tally and turnout match the store, and that no identifying data is exported.
+        """
+        first, second, third = registry.get_all_candidates()
+        cast_ballots([first.candidate_id] * 2 + [third.candidate_id, "junk"])
+        cast_ballots([third.candidate_id], comment="Great job")
+
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        registry.register_voter(Voter("Jane", "Doe", "222222222"))
+        VotingStore.get_instance().fraud_voter(voter.national_id)
+
+        manifest = export_election(str(tmp_path))
+        election_export = ElectionExport(str(tmp_path))
+
+        assert list(election_export.column("ballots.candidate_id")) == [
+            int(first.candidate_id),
+            int(first.candidate_id),
+            int(third.candidate_id),
+            0,
+            int(third.candidate_id),
+        ]
+        assert list(election_export.column("ballots.has_comment")) == [
+            False,
+            False,
+            False,
+            False,
+            True,
+        ]
+        assert election_export.turnout() == {
+            "registered": 2,
+            "voted": 0,
+            "fraud_flagged": 1,
+        }
+
+        expected = balloting.compute_election_tally()
+        tally = election_export.tally()
+        assert tally.counts == expected.counts
+        assert tally.rejected == expected.rejected == manifest["rejected_ballots"]
+        assert list(election_export.column("tally.votes")) == [
+            expected.counts[candidate.candidate_id]
+            for candidate in [first, second, third]
+        ]
+
+        exported = b"".join(path.read_bytes() for path in tmp_path.iterdir())
+        assert b"ballot-" not in exported and b"Great job" not in exported
+
+    def test_export_is_written_in_batches(self, tmp_path):
+        """
+        Checks that streaming the store in small batches produces standard .npy files with every row.
+        """
+        first, second, _ = registry.get_all_candidates()
+        candidate_ids = [first.candidate_id, second.candidate_id] * 50
+        cast_ballots(candidate_ids)
+
+        export_election(str(tmp_path), batch_size=7)
+
+        candidate_column = np.load(tmp_path / "ballots.candidate_id.npy")
+        assert candidate_column.dtype == np.int64
+        assert list(candidate_column) == [int(c) for c in candidate_ids]
+        assert (
+            ElectionExport(str(tmp_path)).tally(batch_size=3).counts
+            == balloting.compute_election_tally().counts
+        )
+
+    def test_export_reads_one_snapshot(self, tmp_path, monkeypatch):
+        """
+        Checks that a file-backed store is exported as it was when the export started, even if ballots are cast and
+        voters registered halfway through
+        """
+        monkeypatch.setenv(VOTING_STORE_DATABASE, str(tmp_path / "store.sqlite3"))
+        VotingStore.refresh_instance()
+        for candidate_name in ["Kathryn Collins", "Aditya Guha", "Rina Harvey"]:
+            registry.register_candidate(candidate_name)
+        first, second, _ = registry.get_all_candidates()
+        cast_ballots([first.candidate_id, second.candidate_id] * 5)
+        registry.register_voter(Voter("Adam", "Smith", "111111111"))
+
+        parse_batch = export._parse_batch
+
+        def parse_batch_while_voting(batch, dtype):
+            cast_ballots([first.candidate_id])
+            registry.register_voter(Voter("Jane", "Doe", "{0:09d}".format(len(calls))))
+            calls.append(batch)
+            return parse_batch(batch, dtype)
+
+        calls = []
+        monkeypatch.setattr(export, "_parse_batch", parse_batch_while_voting)
+        manifest = export_election(str(tmp_path / "export"), batch_size=3)
+
+        assert calls
+        assert manifest["columns"]["ballots.candidate_id"]["length"] == 10
+        assert manifest["columns"]["voters.voted"]["length"] == 1
+        election_export = ElectionExport(str(tmp_path / "export"))
+        assert sum(election_export.tally().counts.values()) == 10
+        assert list(election_export.column("tally.votes")) == [5, 5, 0]
+
+        VotingStore.get_instance().connection.close()
+        monkeypatch.delenv(VOTING_STORE_DATABASE)
+        VotingStore.refresh_instance()
+
+    def test_command_line_requires_a_database(self, tmp_path):
+        """
+        Checks that the command line refuses to export the empty in-memory store
+        """
+        command = [sys.executable, "-m", "main.store.export", str(tmp_path / "export")]
+        environment = {
+            name: value
+            for name, value in os.environ.items()
+            if name != VOTING_STORE_DATABASE
+        }
+        result = subprocess.run(
+            command, env=environment, capture_output=True, text=True
+        )
+        assert result.returncode != 0
+        assert "--database" in result.stderr
+
+        result = subprocess.run(
+            command + ["--database", str(tmp_path / "store.sqlite3")],
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert (tmp_path / "export" / "manifest.json").exists()
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
+        for candidate_name in ["Kathryn Collins", "Aditya Guha", "Rina Harvey"]:
+            registry.register_candidate(candidate_name)
@@ -0,0 +1,79 @@
+import os
+
+import main.api.balloting as balloting
+import main.api.registry as registry
+import pytest
+from main.objects.voter import NAME_ENCRYPTION_KEY_AES_SIV, VoterStatus, decrypt_name
+from main.store import fixtures, secret_registry
+from main.store.data_registry import VotingStore
+from main.store.keyring import Keyring, ciphertext_key_id, key_id
+
+
+class TestFixtures:
+    def test_load_seed(self):
+        """
+        Checks that the bundled seed registers every candidate and voter, and that its pre-issued ballots are valid.
+        """
+        pre_issued_ballots = fixtures.load_seed()
+
+        candidate_names = [c.name for c in registry.get_all_candidates()]
+        assert candidate_names == fixtures.DEFAULT_CANDIDATE_NAMES
+
+        for voter in fixtures.DEFAULT_VOTERS:
+            assert (
+                registry.get_voter_status(voter.national_id)
+                == VoterStatus.REGISTERED_NOT_VOTED
+            )
+
+        assert len(pre_issued_ballots) == len(fixtures.DEFAULT_VOTERS)
+        for voter_national_id, ballot_number in pre_issued_ballots:
+            assert balloting.verify_ballot(voter_national_id, ballot_number)
+
+    def test_load_seed_names_are_decryptable(self):
+        """
+        Checks that the seed carries no key, and that seeded names are encrypted under the configured key.
+        """
+        with open(fixtures.DEFAULT_SEED_PATH) as seed_file:
+            assert "key" not in seed_file.read()
+        configured_key = bytes(range(64))
+        secret_registry.overwrite_secret_bytes(
+            NAME_ENCRYPTION_KEY_AES_SIV, configured_key
+        )
+
+        fixtures.load_seed()
+
+        store = VotingStore.get_instance()
+        expected = fixtures.DEFAULT_VOTERS[0]
+        seeded = store.get_voter_by_national_id(expected.national_id)
+        assert seeded is not None
+        assert ciphertext_key_id(seeded.first_name) == key_id(configured_key)
+        assert decrypt_name(seeded.first_name, configured_key) == expected.first_name
+        assert decrypt_name(seeded.last_name, configured_key) == expected.last_name
+
+    def test_load_seed_invalidated_ballots(self, tmp_path):
+        """
+        Checks that ballots listed as invalidated in a seed are loaded as invalid.
+        """
+        voter = fixtures.DEFAULT_VOTERS[0]
+        seed = fixtures.build_seed(["Kathryn Collins"], [voter], ballots_per_voter=2)
+        invalidated = seed["ballots"][1]["ballot_number"]
+        seed["invalidated_ballots"] = [invalidated]
+        fixtures.write_seed(seed, str(tmp_path / "seed.json"))
+
+        fixtures.load_seed(str(tmp_path / "seed.json"))
+
+        store = VotingStore.get_instance()
+        assert store.is_ballot_valid(seed["ballots"][0]["ballot_number"])
+        assert not store.is_ballot_valid(invalidated)
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
+        saved_key = os.environ.get(NAME_ENCRYPTION_KEY_AES_SIV)
+        yield
+
+        if saved_key is None:
+            os.environ.pop(NAME_ENCRYPTION_KEY_AES_SIV, None)
+        else:
+            os.environ[NAME_ENCRYPTION_KEY_AES_SIV] = saved_key
+        Keyring.refresh_instances()
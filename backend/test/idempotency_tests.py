@@ -0,0 +1,260 @@
+import os
+import signal
+import threading
+import time
+from base64 import b64encode
+
+import main.api.balloting as balloting
+import main.api.registry as registry
+import pytest
+from main.api import backend_rest_api
+from main.api.idempotency import (
+    IDEMPOTENCY_FINGERPRINT_KEY_HMAC,
+    IdempotencyCache,
+    IdempotencyKeyReused,
+    fingerprint,
+)
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter, VoterKey, VoterStatus
+from main.store.data_registry import IdempotencyRecord, VotingStore
+from main.store.keyring import Keyring
+
+
+class TestIdempotency:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch):
+        VotingStore.refresh_instance()
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        monkeypatch.setattr(
+            backend_rest_api,
+            "count_ballot_idempotency",
+            IdempotencyCache("count_ballot_test", 100, 60.0),
+        )
+        yield
+
+    def test_retry_is_replayed(self, monkeypatch):
+        """
+        Checks that a retried ballot gets the first attempt's status back without being counted again, so the voter
+        isn't flagged for fraud
+        """
+        registry.register_candidate("Candidate")
+        voter = Voter("Sara", "Jenkins", "234-23-2342")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        body = {
+            "ballot_number": ballot_number,
+            "chosen_candidate_id": "1",
+            "voter_comments": "",
+            "voter_national_id": voter.national_id,
+        }
+        client = backend_rest_api.app.test_client()
+        headers = {"Idempotency-Key": "retry-1"}
+
+        first = client.post("/api/count_ballot", json=body, headers=headers)
+        assert first.status_code == 202
+        assert "Idempotent-Replayed" not in first.headers
+
+        counted = []
+        monkeypatch.setattr(
+            balloting, "count_ballot", lambda *args: counted.append(args)
+        )
+        retry = client.post("/api/count_ballot", json=body, headers=headers)
+        assert retry.status_code == 202
+        assert retry.get_json() == first.get_json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert counted == []
+        assert (
+            registry.get_voter_status(voter.national_id) == VoterStatus.BALLOT_COUNTED
+        )
+
+        other_ballot = dict(body, chosen_candidate_id="2")
+        response = client.post("/api/count_ballot", json=other_ballot, headers=headers)
+        assert response.status_code == 422
+        response = client.post(
+            "/api/count_ballot", json=body, headers={"Idempotency-Key": ""}
+        )
+        assert response.status_code == 400
+
+    def test_retry_on_another_worker_is_replayed(self, monkeypatch):
+        """
+        Checks that a retry reaching another pre-fork worker, whose in-memory cache hasn't seen the key, finds the key
+        claimed in the shared store and is replayed rather than flagged for fraud
+        """
+        registry.register_candidate("Candidate")
+        voter = Voter("Sara", "Jenkins", "234-23-2342")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        body = {
+            "ballot_number": ballot_number,
+            "chosen_candidate_id": "1",
+            "voter_comments": "",
+            "voter_national_id": voter.national_id,
+        }
+        client = backend_rest_api.app.test_client()
+        headers = {"Idempotency-Key": "retry-1"}
+        assert (
+            client.post("/api/count_ballot", json=body, headers=headers).status_code
+            == 202
+        )
+
+        monkeypatch.setattr(
+            backend_rest_api,
+            "count_ballot_idempotency",
+            IdempotencyCache("count_ballot_test", 100, 60.0),
+        )
+        retry = client.post("/api/count_ballot", json=body, headers=headers)
+        assert retry.status_code == 202
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert (
+            registry.get_voter_status(voter.national_id) == VoterStatus.BALLOT_COUNTED
+        )
+        assert balloting.get_all_fraudulent_voters() == set()
+
+        other_ballot = dict(body, chosen_candidate_id="2")
+        monkeypatch.setattr(
+            backend_rest_api,
+            "count_ballot_idempotency",
+            IdempotencyCache("count_ballot_test", 100, 60.0),
+        )
+        response = client.post("/api/count_ballot", json=other_ballot, headers=headers)
+        assert response.status_code == 422
+
+    def test_concurrent_duplicates_run_once(self):
+        """
+        Checks that concurrent duplicates wait for the first attempt and share its result
+        """
+        cache = IdempotencyCache("concurrent_test", 100, 60.0)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "counted"
+
+        results = []
+
+        def attempt():
+            results.append(cache.run("key", "fingerprint", compute))
+
+        first = threading.Thread(target=attempt)
+        first.start()
+        started.wait()
+        duplicates = [threading.Thread(target=attempt) for _ in range(4)]
+        for duplicate in duplicates:
+            duplicate.start()
+        release.set()
+        for thread in [first] + duplicates:
+            thread.join()
+
+        assert len(calls) == 1
+        assert sorted(results) == [("counted", False)] + [("counted", True)] * 4
+
+    def test_forked_child_starts_empty(self):
+        """
+        Checks that a forked child neither inherits a held lock nor waits on an attempt in flight in the parent
+        """
+        cache = IdempotencyCache("fork_test", 100, 60.0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def compute():
+            started.set()
+            release.wait()
+            return "counted"
+
+        first = threading.Thread(target=cache.run, args=("key", "fingerprint", compute))
+        first.start()
+        started.wait()
+        with cache._lock:
+            pid = os.fork()
+        if pid == 0:
+            # Dies rather than hangs if the child inherited the held lock
+            signal.alarm(10)
+            os._exit(
+                0
+                if cache.run("key", "fingerprint", lambda: "child") == ("child", False)
+                else 1
+            )
+
+        _, status = os.waitpid(pid, 0)
+        release.set()
+        first.join()
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert cache.run("key", "fingerprint", lambda: "again") == ("counted", True)
+
+    def test_failures_expiry_and_bound(self):
+        """
+        Checks that failed attempts aren't cached, that results expire, that the cache is bounded, and that a key can't
+        be reused for a different request
+        """
+        now = [0.0]
+        cache = IdempotencyCache("expiry_test", 2, 10.0, clock=lambda: now[0])
+
+        def fail():
+            raise RuntimeError("database is locked")
+
+        with pytest.raises(RuntimeError):
+            cache.run("a", "fingerprint", fail)
+        assert cache.run("a", "fingerprint", lambda: 1) == (1, False)
+        assert cache.run("a", "fingerprint", lambda: 2) == (1, True)
+        with pytest.raises(IdempotencyKeyReused):
+            cache.run("a", "other fingerprint", lambda: 3)
+
+        now[0] = 11.0
+        assert cache.run("a", "fingerprint", lambda: 4) == (4, False)
+
+        cache.run("b", "fingerprint", lambda: 5)
+        cache.run("c", "fingerprint", lambda: 6)
+        assert cache.run("a", "fingerprint", lambda: 7) == (7, False)
+
+    def test_refused_claim_only_undoes_its_ballot(self):
+        """
+        Checks that a ballot whose idempotency key is already claimed is undone without rolling back other writes
+        pending on the shared connection
+        """
+        store = VotingStore.get_instance()
+        store.add_candidate("Candidate")
+        record = IdempotencyRecord(
+            "count_ballot", "key", "fingerprint", "", time.time() + 60
+        )
+        for national_id in ["111111111", "222222222"]:
+            store.add_voter(Voter("Sara", "Jenkins", national_id))
+        assert store.cast_ballot_by_key(
+            Ballot("ballot-1", "1", ""),
+            VoterKey("111111111"),
+            idempotency_record=record,
+        )
+
+        store.connection.execute("""INSERT INTO candidates (name) VALUES ('Pending')""")
+        assert not store.cast_ballot_by_key(
+            Ballot("ballot-2", "1", ""),
+            VoterKey("222222222"),
+            idempotency_record=record,
+        )
+        assert not store.is_ballot_counted("ballot-2")
+        assert (
+            registry.get_voter_status("222222222") == VoterStatus.REGISTERED_NOT_VOTED
+        )
+        cursor = store.connection.execute("""SELECT name FROM candidates""")
+        assert [name for name, in cursor.fetchall()] == ["Candidate", "Pending"]
+
+    def test_fingerprint_is_keyed(self, monkeypatch):
+        """
+        Checks that fingerprints depend on the configured secret, so they can't be reversed by hashing every national id
+        """
+        try:
+            first = fingerprint("234-23-2342", "1")
+            assert first == fingerprint("234-23-2342", "1")
+
+            monkeypatch.setenv(
+                IDEMPOTENCY_FINGERPRINT_KEY_HMAC,
+                b64encode(os.urandom(32)).decode("utf-8"),
+            )
+            Keyring.refresh_instances()
+            assert fingerprint("234-23-2342", "1") != first
+        finally:
+            monkeypatch.undo()
+            Keyring.refresh_instances()
@@ -0,0 +1,34 @@
+import pytest
+from benchmarks.import_time_benchmark import (
+    ENTRY_POINTS,
+    imported_modules,
+    lazy_dependencies_in,
+)
+
+# How many modules importing an entry point may add to a fresh interpreter. Module counts don't depend on how busy the
+# machine is, unlike import times. These are generous on purpose: they catch an eager import of a heavy dependency, not
+# small regressions.
+MODULE_BUDGETS = {
+    "main.api.backend_rest_api": 450,
+}
+DEFAULT_MODULE_BUDGET = 150
+
+
+class TestImportBudget:
+    @pytest.mark.parametrize("entry_point", ENTRY_POINTS)
+    def test_heavy_dependencies_are_lazy(self, entry_point):
+        """
+        Checks that importing an entry point doesn't pull in crypto, serialization or numeric dependencies.
+        """
+        assert lazy_dependencies_in(imported_modules(entry_point)) == []
+
+    @pytest.mark.parametrize("entry_point", ENTRY_POINTS)
+    def test_module_budget(self, entry_point):
+        """
+        Checks that the number of modules an entry point imports stays within its budget.
+        """
+        modules = imported_modules(entry_point)
+        budget = MODULE_BUDGETS.get(entry_point, DEFAULT_MODULE_BUDGET)
+        assert len(modules) <= budget, "{0} imported {1} modules".format(
+            entry_point, len(modules)
+        )
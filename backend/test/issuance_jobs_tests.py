@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+from main.api import backend_rest_api, balloting, issuance_jobs, metrics, registry
+from main.api.issuance_jobs import (
+    DEFAULT_MAX_QUEUE,
+    DEFAULT_TTL_SECONDS,
+    IssuanceJobs,
+    IssuanceQueueFull,
+    JobStatus,
+)
+from main.objects.voter import Voter
+from main.store.data_registry import VotingStore
+
+VOTER = Voter("Kathryn", "Collins", "111-11-1111")
+
+
+class TestIssuanceJobs:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch):
+        VotingStore.refresh_instance()
+        registry.register_voter(VOTER)
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        yield
+        IssuanceJobs.configure(0)
+
+    def test_inline_jobs_and_expiry(self):
+        """
+        Checks that without workers jobs run when submitted, that the ballot number is handed out once, and that results
+        are forgotten after the TTL
+        """
+        now = [0.0]
+        jobs = IssuanceJobs.configure(0, ttl_seconds=10.0, clock=lambda: now[0])
+        job_id = jobs.submit(VOTER.national_id)
+        not_registered_job_id = jobs.submit("999-99-9999")
+
+        encrypted_ballot_number = (
+            VotingStore.get_instance()
+            .get_issuance_job(job_id, now[0])
+            .encrypted_ballot_number
+        )
+        result = jobs.poll(job_id)
+        assert result.status == JobStatus.ISSUED
+        assert balloting.verify_ballot(VOTER.national_id, result.ballot_number)
+        assert encrypted_ballot_number != result.ballot_number
+        assert jobs.poll(job_id) == (JobStatus.COLLECTED, None)
+        assert (
+            VotingStore.get_instance()
+            .get_issuance_job(job_id, now[0])
+            .encrypted_ballot_number
+            is None
+        )
+        assert jobs.poll(not_registered_job_id).status == JobStatus.NOT_REGISTERED
+        assert jobs.poll("no such job") is None
+
+        now[0] = 10.0
+        assert jobs.poll(job_id) is None
+        assert jobs.held == 0
+
+    def test_workers_and_long_polling(self, monkeypatch):
+        """
+        Checks that submitting returns before the ballot is issued, that a poll can wait for it, and that a full queue
+        is refused
+        """
+        release = threading.Event()
+        issue_ballot_by_key = balloting.issue_ballot_by_key
+
+        def blocked_issue_ballot_by_key(key):
+            release.wait()
+            return issue_ballot_by_key(key)
+
+        monkeypatch.setattr(
+            balloting, "issue_ballot_by_key", blocked_issue_ballot_by_key
+        )
+        jobs = IssuanceJobs.configure(1, max_queue=1)
+        job_id = jobs.submit(VOTER.national_id)
+        assert jobs.poll(job_id, wait_seconds=0.05).status == JobStatus.PENDING
+
+        # The worker holds the first job, and the second one fills the queue
+        while jobs.pending:
+            time.sleep(0.001)
+        jobs.submit(VOTER.national_id)
+        with pytest.raises(IssuanceQueueFull):
+            jobs.submit(VOTER.national_id)
+
+        release.set()
+        result = jobs.poll(job_id, wait_seconds=10)
+        assert result.status == JobStatus.ISSUED
+        assert balloting.verify_ballot(VOTER.national_id, result.ballot_number)
+
+    def test_poll_on_another_worker(self):
+        """
+        Checks that a job can be polled, and waited for, on a worker other than the one it was submitted to
+        """
+        submitting_worker = IssuanceJobs.configure(1)
+        polling_worker = IssuanceJobs(0, DEFAULT_TTL_SECONDS, DEFAULT_MAX_QUEUE)
+        job_id = submitting_worker.submit(VOTER.national_id)
+
+        result = polling_worker.poll(job_id, wait_seconds=10)
+        assert result.status == JobStatus.ISSUED
+        assert balloting.verify_ballot(VOTER.national_id, result.ballot_number)
+        assert submitting_worker.poll(job_id).status == JobStatus.COLLECTED
+        assert polling_worker.held == 1
+
+    def test_gauges_dont_start_the_pool(self, monkeypatch):
+        """
+        Checks that the issuance gauges report 0 until the pool exists, without creating it
+        """
+        monkeypatch.setattr(IssuanceJobs, "issuance_jobs_instance", None)
+        snapshot = metrics.snapshot()
+        assert IssuanceJobs.issuance_jobs_instance is None
+        for gauge in ["pending", "held", "issued", "failed"]:
+            assert snapshot["ballot_issuance." + gauge] == 0
+
+        IssuanceJobs.get_instance().submit(VOTER.national_id)
+        snapshot = metrics.snapshot()
+        assert snapshot["ballot_issuance.held"] == 1
+        assert snapshot["ballot_issuance.issued"] == 1
+
+    def test_endpoints(self, monkeypatch):
+        client = backend_rest_api.app.test_client()
+        body = {"national_id": VOTER.national_id}
+        response = client.post("/api/admin/issuance_jobs", json=body)
+        assert response.status_code == 404
+
+        monkeypatch.setenv(issuance_jobs.ISSUANCE_ADMIN_TOKEN, "secret")
+        monkeypatch.setattr(IssuanceJobs, "issuance_jobs_instance", None)
+        response = client.post(
+            "/api/admin/issuance_jobs",
+            json=body,
+            headers={"Authorization": "Bearer wrong"},
+        )
+        assert response.status_code == 401
+
+        headers = {"Authorization": "Bearer secret"}
+        response = client.post("/api/admin/issuance_jobs", json=body, headers=headers)
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+        assert IssuanceJobs.get_instance().workers == 1
+
+        response = client.get(
+            "/api/admin/issuance_jobs/{0}?wait=5".format(job_id), headers=headers
+        )
+        assert response.get_json()["status"] == JobStatus.ISSUED.value
+        assert balloting.verify_ballot(
+            VOTER.national_id, response.get_json()["ballot_number"]
+        )
+        response = client.get(
+            "/api/admin/issuance_jobs/{0}".format(job_id), headers=headers
+        )
+        assert response.get_json() == {
+            "status": JobStatus.COLLECTED.value,
+            "ballot_number": None,
+        }
+        response = client.get("/api/admin/issuance_jobs/unknown", headers=headers)
+        assert response.status_code == 404
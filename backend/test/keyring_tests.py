@@ -0,0 +1,142 @@
+import os
+
+import main.api.registry as registry
+import pytest
+from main.crypto import primitives
+from main.objects.voter import (
+    NAME_BLIND_INDEX_KEY_HMAC,
+    NAME_ENCRYPTION_KEY_AES_SIV,
+    Voter,
+    blind_index_name,
+    decrypt_name,
+    encrypt_name,
+)
+from main.store import secret_registry
+from main.store.data_registry import VotingStore
+from main.store.keyring import (
+    ALLOW_GENERATED_KEYS,
+    PREVIOUS_KEYS_SUFFIX,
+    Keyring,
+    KeyNotConfigured,
+    ciphertext_key_id,
+    key_id,
+)
+from main.store.reencryption import NameReencryptionJob
+
+
+class TestKeyring:
+    def test_keys_are_loaded_once(self, monkeypatch):
+        """
+        Checks that encrypting and decrypting names doesn't read the key from the environment every time.
+        """
+        encrypt_name("Adam")
+        reads = []
+        get_secret_bytes = secret_registry.get_secret_bytes
+        monkeypatch.setattr(
+            secret_registry,
+            "get_secret_bytes",
+            lambda name: reads.append(name) or get_secret_bytes(name),
+        )
+
+        for _ in range(10):
+            assert decrypt_name(encrypt_name("Adam")) == "Adam"
+        assert reads == []
+
+    def test_rotation(self):
+        """
+        Checks that ciphertexts record their key, and that names encrypted before a rotation (or before key ids existed)
+        still decrypt.
+        """
+        keyring = Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV)
+        old_kid, old_key = keyring.current()
+        before_rotation = encrypt_name("Adam")
+        without_key_id = primitives.aes_siv_encrypt(old_key, "Jane")
+        assert ciphertext_key_id(before_rotation) == old_kid
+
+        new_kid = keyring.rotate()
+        after_rotation = encrypt_name("Adam")
+        assert ciphertext_key_id(after_rotation) == new_kid != old_kid
+        assert keyring.previous_key_ids() == [old_kid]
+        assert decrypt_name(before_rotation) == "Adam"
+        assert decrypt_name(after_rotation) == "Adam"
+        assert decrypt_name(without_key_id) == "Jane"
+
+        keyring.retire(old_kid)
+        assert keyring.previous_key_ids() == []
+        with pytest.raises(Exception):
+            decrypt_name(before_rotation)
+
+    def test_missing_key_raises(self, monkeypatch):
+        """
+        Checks that a missing key is refused, and that generating one for tests and local development is not silent.
+        """
+        os.environ.pop(NAME_ENCRYPTION_KEY_AES_SIV, None)
+        os.environ.pop(NAME_BLIND_INDEX_KEY_HMAC, None)
+        Keyring.refresh_instances()
+
+        monkeypatch.delenv(ALLOW_GENERATED_KEYS, raising=False)
+        with pytest.raises(KeyNotConfigured):
+            encrypt_name("Adam")
+        with pytest.raises(KeyNotConfigured):
+            blind_index_name("Adam")
+        assert secret_registry.get_secret_bytes(NAME_BLIND_INDEX_KEY_HMAC) is None
+
+        monkeypatch.setenv(ALLOW_GENERATED_KEYS, "1")
+        with pytest.warns(RuntimeWarning):
+            ciphertext = encrypt_name("Adam")
+        assert ciphertext_key_id(ciphertext) == key_id(
+            secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY_AES_SIV)
+        )
+
+    def test_reencryption_job(self):
+        """
+        Checks that the re-encryption job moves every voter's names to the current key, in rate-limited batches.
+        """
+        voters = [
+            Voter("First{0}".format(i), "Last{0}".format(i), "{0:09d}".format(i))
+            for i in range(5)
+        ]
+        for voter in voters:
+            registry.register_voter(voter)
+        new_kid = Keyring.get_instance(NAME_ENCRYPTION_KEY_AES_SIV).rotate()
+
+        sleeps = []
+        job = NameReencryptionJob(
+            batch_size=2, rows_per_second=1.0, sleep=sleeps.append
+        )
+        assert job.run() == 5
+        assert job.finished
+        assert len(sleeps) == 3
+
+        store = VotingStore.get_instance()
+        for voter in voters:
+            stored = store.get_voter_by_national_id(voter.national_id)
+            assert ciphertext_key_id(stored.first_name) == new_kid
+            assert ciphertext_key_id(stored.last_name) == new_kid
+            assert decrypt_name(stored.first_name) == voter.first_name
+        assert [
+            decrypt_name(m.obfuscated_first_name)
+            for m in registry.find_voters_by_name("Last3")
+        ] == ["First3"]
+
+        assert NameReencryptionJob().run() == 0
+
+    @pytest.fixture(autouse=True)
+    def restore_keys(self):
+        VotingStore.refresh_instance()
+        saved = {
+            name: os.environ.get(name)
+            for name in [
+                NAME_ENCRYPTION_KEY_AES_SIV,
+                NAME_ENCRYPTION_KEY_AES_SIV + PREVIOUS_KEYS_SUFFIX,
+                NAME_BLIND_INDEX_KEY_HMAC,
+            ]
+        }
+        yield
+
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        Keyring.refresh_instances()
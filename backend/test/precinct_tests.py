@@ -0,0 +1,196 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from main.api import balloting, registry
+from main.objects.ballot import Ballot
+from main.objects.voter import DEFAULT_PRECINCT, Voter, VoterKey
+from main.store import precincts
+from main.store.data_registry import VOTING_STORE_DATABASE, VotingStore
+
+
+def cast(store: VotingStore, national_id: str, candidate_id: str):
+    assert store.cast_ballot_by_key(
+        Ballot("ballot-" + national_id, candidate_id, ""), VoterKey(national_id)
+    )
+
+
+def precinct_database(path: str, precinct: str, voters: dict) -> VotingStore:
+    """
+    Builds a precinct database with two candidates, and voters by national id -> the candidate they voted for, if any
+    """
+    store = VotingStore.open_database(path)
+    store.add_candidate("Kathryn Collins")
+    store.add_candidate("Aditya Guha")
+    for national_id, candidate_id in voters.items():
+        store.add_voter(Voter("Rina", "Harvey", national_id, precinct=precinct))
+        if candidate_id is not None:
+            cast(store, national_id, candidate_id)
+
+    return store
+
+
+class TestPrecincts:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        yield
+
+    def test_precinct_tallies(self):
+        """
+        Checks that ballots are counted in the precinct of the voter who cast them
+        """
+        registry.register_candidate("Kathryn Collins")
+        registry.register_candidate("Aditya Guha")
+        for national_id, precinct in [
+            ("111111111", "north"),
+            ("222222222", "north"),
+            ("333333333", "south"),
+            ("444444444", "south"),
+        ]:
+            registry.register_voter(
+                Voter("Rina", "Harvey", national_id, precinct=precinct)
+            )
+        registry.register_voter(Voter("Aditya", "Guha", "555555555"))
+
+        store = VotingStore.get_instance()
+        assert store.get_voter_by_national_id("333333333").precinct == "south"
+        cast(store, "111111111", "1")
+        cast(store, "222222222", "2")
+        cast(store, "333333333", "1")
+
+        tallies = balloting.compute_precinct_tallies()
+        assert sorted(tallies) == [DEFAULT_PRECINCT, "north", "south"]
+        assert tallies["north"].counts == {"1": 1, "2": 1}
+        assert tallies["south"].counts == {"1": 1, "2": 0}
+        assert tallies[DEFAULT_PRECINCT].total_votes == 0
+        assert balloting.compute_election_tally().counts == {"1": 2, "2": 1}
+
+    def test_merge_databases_and_tally_files(self, tmp_path):
+        """
+        Checks that precinct databases and tally files merge into the same national results, and that a voter
+        registered in two precincts is reported as a conflict
+        """
+        north = precinct_database(
+            str(tmp_path / "north.sqlite3"),
+            "north",
+            {"111111111": "1", "222222222": "2", "333333333": None},
+        )
+        # Candidate ids are local to each database: here, Aditya Guha is candidate 1
+        south = VotingStore.open_database(str(tmp_path / "south.sqlite3"))
+        south.add_candidate("Aditya Guha")
+        south.add_candidate("Kathryn Collins")
+        for national_id in ["111111111", "444444444", "555555555"]:
+            south.add_voter(Voter("Rina", "Harvey", national_id, precinct="south"))
+            cast(south, national_id, "1")
+
+        precincts.export_precinct_tallies(str(tmp_path / "north.jsonl"), north)
+        precincts.export_precinct_tallies(
+            str(tmp_path / "south.jsonl"), south, batch_size=2
+        )
+        # As written before the turnout counters existed, which opening it for writing would add
+        with north.connection:
+            north.connection.execute("""DROP TABLE turnout""")
+        north.connection.close()
+        south.connection.close()
+        databases = {path: path.read_bytes() for path in tmp_path.glob("*.sqlite3")}
+
+        for paths in [
+            ["north.sqlite3", "south.sqlite3"],
+            ["north.jsonl", "south.jsonl"],
+            ["north.sqlite3", "south.jsonl"],
+        ]:
+            merge = precincts.merge_precincts(
+                [
+                    precincts.PrecinctSource(str(tmp_path / path), batch_size=2)
+                    for path in paths
+                ]
+            )
+            names = {
+                candidate.candidate_id: candidate.name
+                for candidate in merge.national.ranked_candidates
+            }
+            assert {
+                names[candidate_id]: count
+                for candidate_id, count in merge.national.counts.items()
+            } == {"Kathryn Collins": 1, "Aditya Guha": 4}
+            assert sorted(merge.precincts) == ["north", "south"]
+            assert merge.precincts["south"].total_votes == 3
+            assert [
+                (conflict.precincts, conflict.votes) for conflict in merge.conflicts
+            ] == [(["north", "south"], 2)]
+            assert merge.conflicts[0].obfuscated_national_id == (
+                VoterKey("111111111").obfuscated_national_id
+            )
+            assert merge.double_votes == 1
+
+        # Database files are read without being written to or migrated
+        assert {path: path.read_bytes() for path in databases} == databases
+
+    def test_merge_rejects_duplicate_precincts(self, tmp_path):
+        """
+        Checks that the same precinct can't be merged twice
+        """
+        precinct_database(
+            str(tmp_path / "north.sqlite3"), "north", {"111111111": "1"}
+        ).connection.close()
+        source = precincts.PrecinctSource(str(tmp_path / "north.sqlite3"))
+
+        with pytest.raises(ValueError):
+            precincts.merge_precincts([source, source])
+
+    def test_rejects_duplicate_candidate_names(self, tmp_path):
+        """
+        Checks that candidates sharing a name are refused, instead of having their counts merged into one
+        """
+        store = precinct_database(
+            str(tmp_path / "north.sqlite3"), "north", {"111111111": "1"}
+        )
+        store.add_candidate("Kathryn Collins")
+
+        with pytest.raises(ValueError):
+            precincts.export_precinct_tallies(str(tmp_path / "north.jsonl"), store)
+        store.connection.close()
+        with pytest.raises(ValueError):
+            precincts.PrecinctSource(str(tmp_path / "north.sqlite3"))
+
+    def test_command_line_export_requires_a_database(self, tmp_path):
+        """
+        Checks that the command line refuses to export the empty in-memory store, and exports the database it is given
+        """
+        command = [
+            sys.executable,
+            "-m",
+            "main.store.precincts",
+            "export",
+            str(tmp_path / "tally.jsonl"),
+        ]
+        environment = {
+            name: value
+            for name, value in os.environ.items()
+            if name != VOTING_STORE_DATABASE
+        }
+        result = subprocess.run(
+            command, env=environment, capture_output=True, text=True
+        )
+        assert result.returncode != 0
+        assert "--database" in result.stderr
+        assert not (tmp_path / "tally.jsonl").exists()
+
+        precinct_database(
+            str(tmp_path / "north.sqlite3"), "north", {"111111111": "1"}
+        ).connection.close()
+        result = subprocess.run(
+            command + ["--database", str(tmp_path / "north.sqlite3")],
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        source = precincts.PrecinctSource(str(tmp_path / "tally.jsonl"))
+        assert source.precincts["north"]["counts"] == {
+            "Kathryn Collins": 1,
+            "Aditya Guha": 0,
+        }
@@ -0,0 +1,121 @@
+import json
+import os
+import pstats
+import threading
+
+import pytest
+
+from main.api import backend_rest_api, profiling, registry
+from main.store.data_registry import VotingStore
+
+ADMIN_TOKEN = "admin-token"
+
+
+class TestProfiling:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Candidate")
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        yield
+        # A cProfile capture leaves its middleware installed
+        if isinstance(backend_rest_api.app.wsgi_app, profiling.ProfilingMiddleware):
+            backend_rest_api.app.wsgi_app = backend_rest_api.app.wsgi_app.wsgi_app
+
+    def under_load(self, run_capture):
+        """
+        Runs a capture while another thread keeps requesting all candidates
+        """
+        stopped = threading.Event()
+
+        def load():
+            client = backend_rest_api.app.test_client()
+            while not stopped.is_set():
+                client.get("/api/get_all_candidates")
+
+        load_thread = threading.Thread(target=load)
+        load_thread.start()
+        try:
+            return run_capture()
+        finally:
+            stopped.set()
+            load_thread.join()
+
+    def test_endpoint_requires_admin_token(self, monkeypatch):
+        """
+        Checks that the profiling endpoint doesn't exist without an admin token, and refuses other tokens
+        """
+        client = backend_rest_api.app.test_client()
+        monkeypatch.delenv(profiling.PROFILING_ADMIN_TOKEN, raising=False)
+        assert client.post("/api/admin/profile").status_code == 404
+
+        monkeypatch.setenv(profiling.PROFILING_ADMIN_TOKEN, ADMIN_TOKEN)
+        assert client.post("/api/admin/profile").status_code == 401
+        response = client.post(
+            "/api/admin/profile", headers={"Authorization": "Bearer wrong-token"}
+        )
+        assert response.status_code == 401
+        response = client.post(
+            "/api/admin/profile",
+            json={"seconds": 0},
+            headers={"Authorization": "Bearer {0}".format(ADMIN_TOKEN)},
+        )
+        assert response.status_code == 400
+
+    def test_sampling_capture(self, monkeypatch, tmp_path):
+        """
+        Checks that a sampling capture through the endpoint writes pstats and collapsed stacks for the whole process and
+        per endpoint
+        """
+        monkeypatch.setenv(profiling.PROFILING_ADMIN_TOKEN, ADMIN_TOKEN)
+        monkeypatch.setenv(profiling.PROFILING_OUTPUT_DIRECTORY, str(tmp_path))
+        client = backend_rest_api.app.test_client()
+
+        response = self.under_load(
+            lambda: client.post(
+                "/api/admin/profile",
+                json={"seconds": 0.5},
+                headers={"Authorization": "Bearer {0}".format(ADMIN_TOKEN)},
+            )
+        )
+        assert response.status_code == 200
+        summary = response.get_json()
+        directory = summary["directory"]
+        assert summary["endpoints"]["get_all_candidates"]["samples"] > 0
+        for name in ["all", "get_all_candidates"]:
+            stats = pstats.Stats(os.path.join(directory, name + ".pstats"))
+            assert stats.total_calls > 0
+            with open(os.path.join(directory, name + ".collapsed")) as collapsed:
+                stack, count = collapsed.readline().rsplit(" ", 1)
+                assert ";" in stack and int(count) > 0
+        with open(os.path.join(directory, "summary.json")) as summary_file:
+            assert json.load(summary_file) == summary
+
+    def test_cprofile_capture_with_memory(self, tmp_path):
+        """
+        Checks that a cProfile capture profiles requests per endpoint, breaks the registry functions down, takes
+        tracemalloc snapshots, and leaves requests unprofiled once it's over
+        """
+        summary = self.under_load(
+            lambda: profiling.capture(
+                backend_rest_api.app,
+                0.5,
+                profiling.CPROFILE,
+                memory=True,
+                output_directory=str(tmp_path),
+            )
+        )
+        directory = summary["directory"]
+        assert summary["endpoints"]["get_all_candidates"]["requests"] > 0
+        assert "registry.get_all_candidates" in [
+            function["function"] for function in summary["functions"]
+        ]
+        assert pstats.Stats(os.path.join(directory, "get_all_candidates.pstats"))
+        assert pstats.Stats(os.path.join(directory, "all.pstats"))
+        assert os.path.exists(os.path.join(directory, "memory-start.tracemalloc"))
+        assert os.path.exists(os.path.join(directory, "memory-end.tracemalloc"))
+        assert isinstance(summary["memory"], list)
+        assert backend_rest_api.app.wsgi_app.capture is None
+
+        with pytest.raises(ValueError):
+            profiling.capture(backend_rest_api.app, 1, "tracing")
@@ -0,0 +1,148 @@
+import json
+import time
+
+import pytest
+
+from main.api import balloting, registry
+from main.crypto import primitives
+from main.detection import redaction_pipeline
+from main.detection.redaction_pipeline import (
+    COMMENT_QUARANTINE_KEY_AES_SIV,
+    MAX_REDACTION_FAILURES,
+    CommentRedactionPool,
+)
+from main.objects.ballot import Ballot
+from main.objects.voter import BallotStatus, Voter
+from main.store.data_registry import VotingStore
+from main.store.keyring import ALLOW_GENERATED_KEYS, Keyring, KeyNotConfigured
+
+COMMENT = "Thanks! Call Sara Jenkins at (345) 553-2335 about the broken machine"
+REDACTED_COMMENT = "Thanks! Call [REDACTED NAME] [REDACTED NAME] at [REDACTED PHONE NUMBER] about the broken machine"
+
+
+def cast_with_comment(national_id: str) -> BallotStatus:
+    ballot_number = balloting.issue_ballot(national_id)
+    candidate_id = registry.get_all_candidates()[0].candidate_id
+    return balloting.count_ballot(
+        Ballot(ballot_number, candidate_id, COMMENT), national_id
+    )
+
+
+class TestRedactionPipeline:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        registry.register_voter(Voter("Sara", "Jenkins", "234-23-2342"))
+        registry.register_voter(Voter("Rina", "Harvey", "111-11-1111"))
+        yield
+        CommentRedactionPool.configure(0)
+
+    def test_comments_are_quarantined_until_redacted(self):
+        """
+        Checks that a comment is committed encrypted in quarantine, invisible until a worker has redacted it, and that
+        the raw copy is gone afterwards
+        """
+        pool = CommentRedactionPool.configure(1)
+        store = VotingStore.get_instance()
+
+        assert cast_with_comment("234-23-2342") == BallotStatus.BALLOT_COUNTED
+        assert store.count_quarantined_comments() == 1
+        assert balloting.get_all_ballot_comments() == set()
+        assert balloting.search_ballot_comments("machine").comments == []
+        (encrypted_comment,) = store.connection.execute(
+            "SELECT encrypted_comment FROM quarantined_comments"
+        ).fetchone()
+        assert "Jenkins" not in encrypted_comment
+        # The names are held in the clear inside the record, never as the ciphertexts stored with the voter, which
+        # would lead from the ballot number to the voter
+        _, quarantine_key = Keyring.get_instance(
+            COMMENT_QUARANTINE_KEY_AES_SIV
+        ).current()
+        assert json.loads(
+            primitives.aes_siv_decrypt(quarantine_key, encrypted_comment)
+        ) == [COMMENT, "Sara", "Jenkins"]
+
+        assert pool.drain() == 1
+        assert store.count_quarantined_comments() == 0
+        assert balloting.get_all_ballot_comments() == {REDACTED_COMMENT}
+        assert balloting.search_ballot_comments("machine").comments == [
+            REDACTED_COMMENT
+        ]
+        assert pool.drain() == 0
+
+    def test_workers_redact_in_the_background(self):
+        """
+        Checks that started workers pick quarantined comments up without being drained
+        """
+        pool = CommentRedactionPool.configure(2)
+        pool.start()
+        store = VotingStore.get_instance()
+
+        assert cast_with_comment("234-23-2342") == BallotStatus.BALLOT_COUNTED
+        assert cast_with_comment("111-11-1111") == BallotStatus.BALLOT_COUNTED
+
+        deadline = time.monotonic() + 10
+        while store.count_quarantined_comments() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.count_quarantined_comments() == 0
+        assert pool.redacted == 2
+        # Only the voter's own name is redacted
+        assert balloting.get_all_ballot_comments() == {
+            REDACTED_COMMENT,
+            REDACTED_COMMENT.replace("[REDACTED NAME] [REDACTED NAME]", "Sara Jenkins"),
+        }
+
+    def test_inline_redaction_by_default(self):
+        """
+        Checks that comments are redacted on the casting path when the pool is disabled
+        """
+        CommentRedactionPool.configure(0)
+
+        assert cast_with_comment("234-23-2342") == BallotStatus.BALLOT_COUNTED
+        assert VotingStore.get_instance().count_quarantined_comments() == 0
+        assert balloting.get_all_ballot_comments() == {REDACTED_COMMENT}
+
+    def test_workers_need_a_quarantine_key(self, monkeypatch):
+        """
+        Checks that background redaction isn't enabled without a configured quarantine key, even where keys may be
+        generated, since comments quarantined under a generated key couldn't be read after a restart
+        """
+        monkeypatch.delenv(COMMENT_QUARANTINE_KEY_AES_SIV)
+        monkeypatch.setenv(ALLOW_GENERATED_KEYS, "1")
+        Keyring.refresh_instances()
+        try:
+            with pytest.raises(KeyNotConfigured):
+                CommentRedactionPool.configure(1)
+            assert not CommentRedactionPool.configure(0).enabled
+        finally:
+            Keyring.refresh_instances()
+
+    def test_failing_comments_are_set_aside(self, monkeypatch, capsys):
+        """
+        Checks that a comment that keeps failing to redact is set aside and reported, rather than retried forever
+        """
+        pool = CommentRedactionPool.configure(1)
+        store = VotingStore.get_instance()
+        assert cast_with_comment("234-23-2342") == BallotStatus.BALLOT_COUNTED
+
+        def undecryptable(encrypted_comment):
+            raise ValueError("No quarantine key can decrypt this comment")
+
+        monkeypatch.setattr(
+            redaction_pipeline, "redact_quarantined_comment", undecryptable
+        )
+        # Claims expire at once, so that every batch retries the comment
+        monkeypatch.setattr(redaction_pipeline, "CLAIM_LEASE_SECONDS", -1.0)
+        for _ in range(MAX_REDACTION_FAILURES):
+            assert pool.run_batch() == 1
+        assert pool.run_batch() == 0
+
+        assert pool.failed == MAX_REDACTION_FAILURES
+        assert pool.set_aside == 1
+        assert store.count_set_aside_comments(MAX_REDACTION_FAILURES) == 1
+        assert store.count_quarantined_comments() == 1
+        assert store.connection.execute(
+            "SELECT encrypted_comment FROM quarantined_comments"
+        ).fetchall() == [(None,)]
+        assert "Set aside 1 quarantined comments" in capsys.readouterr().err
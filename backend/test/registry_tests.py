@@ -1,6 +1,17 @@
+import main.api.balloting as balloting
 import main.api.registry as registry
+import main.objects.voter as voter_module
 import pytest
-from main.objects.voter import Voter, VoterStatus
+from main.objects.ballot import Ballot
+from main.objects.candidate import Candidate
+from main.objects.voter import (
+    BallotStatus,
+    MinimalVoter,
+    Voter,
+    VoterKey,
+    VoterStatus,
+    decrypt_name,
+)
 from main.store.data_registry import VotingStore
 
 
@@ -22,6 +33,28 @@ class TestRegistry:
         for candidate in actual_candidates:
             assert registry.candidate_is_registered(candidate)
 
+    def test_candidates_are_served_from_memory(self):
+        """
+        Checks that candidate lookups don't query the database, and that newly added candidates show up immediately.
+        """
+        registry.register_candidate("Kathryn Collins")
+        store = VotingStore.get_instance()
+        statements = []
+        store.connection.set_trace_callback(statements.append)
+
+        candidate = registry.get_all_candidates()[0]
+        assert registry.candidate_is_registered(candidate)
+        assert not registry.candidate_is_registered(Candidate("2", "Nobody"))
+        assert statements == []
+
+        registry.register_candidate("Aditya Guha")
+        assert registry.candidate_is_registered(Candidate("2", "Aditya Guha"))
+        assert [c.name for c in registry.get_all_candidates()] == [
+            "Kathryn Collins",
+            "Aditya Guha",
+        ]
+        store.connection.set_trace_callback(None)
+
     def test_voter_registration(self):
         """
         Checks to see if the voters are actually registered successfully
@@ -100,6 +133,142 @@ class TestRegistry:
             registry.get_voter_status(voter.national_id) == VoterStatus.NOT_REGISTERED
         )
 
+    def test_find_voters_by_name(self):
+        """
+        Checks that voters can be found by name, regardless of case and surrounding whitespace.
+        """
+        adam_smith = Voter("Adam", "Smith", "111111111")
+        jane_smith = Voter("Jane", "Smith", "222222222")
+        adam_jones = Voter("Adam", "Jones", "333333333")
+        for voter in [adam_smith, jane_smith, adam_jones]:
+            registry.register_voter(voter)
+
+        matches = registry.find_voters_by_name(" smith ", "ADAM")
+        assert all(isinstance(m, MinimalVoter) for m in matches)
+        assert [
+            (
+                decrypt_name(m.obfuscated_first_name),
+                decrypt_name(m.obfuscated_last_name),
+            )
+            for m in matches
+        ] == [("Adam", "Smith")]
+        assert (
+            matches[0].obfuscated_national_id
+            == adam_smith.get_minimal_voter().obfuscated_national_id
+        )
+
+        all_smiths = registry.find_voters_by_name("Smith")
+        assert {decrypt_name(m.obfuscated_first_name) for m in all_smiths} == {
+            "Adam",
+            "Jane",
+        }
+
+        assert registry.find_voters_by_name("Nobody", "Adam") == []
+
+    def test_find_voters_by_name_uses_index(self):
+        """
+        Checks that name searches are index lookups rather than scans of the voters table.
+        """
+        store = VotingStore.get_instance()
+        plan = store.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM voters WHERE last_name_index=? AND first_name_index=?",
+            ("", ""),
+        ).fetchall()
+        assert any("voters_name_index" in row[-1] for row in plan)
+
+    def test_national_id_is_obfuscated_once_per_request(self, monkeypatch):
+        """
+        Checks that registering a voter, issuing a ballot and counting it each obfuscate the national id only once.
+        """
+        registry.register_candidate("Kathryn Collins")
+        obfuscations = []
+        obfuscate_national_id = voter_module.obfuscate_national_id
+        monkeypatch.setattr(
+            voter_module,
+            "obfuscate_national_id",
+            lambda national_id: obfuscations.append(national_id)
+            or obfuscate_national_id(national_id),
+        )
+
+        voter = Voter("Adam", "Smith", "111-11-1111")
+        assert registry.register_voter(voter)
+        assert len(obfuscations) == 1
+
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert len(obfuscations) == 2
+
+        key = VoterKey(voter.national_id)
+        status = balloting.count_ballot_by_key(Ballot(ballot_number, "1", ""), key)
+        assert status == BallotStatus.BALLOT_COUNTED
+        assert len(obfuscations) == 3
+        assert registry.get_voter_status_by_key(key) == VoterStatus.BALLOT_COUNTED
+        assert len(obfuscations) == 3
+
+    def test_voter_lookup_uses_index(self):
+        """
+        Checks that looking a voter up by national id is an index lookup rather than a scan of the voters table.
+        """
+        store = VotingStore.get_instance()
+        plan = store.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM voters WHERE national_id=?", ("",)
+        ).fetchall()
+        assert any("voters_national_id_index" in row[-1] for row in plan)
+
+    def test_de_register_voters_in_bulk(self):
+        """
+        Checks that bulk de-registration removes registered voters in chunks, keeps fraudulent voters, and counts national
+        ids that weren't registered
+        """
+        voters = [
+            Voter("Voter", str(index), "{0:09d}".format(index)) for index in range(10)
+        ]
+        for voter in voters:
+            registry.register_voter(voter)
+        VotingStore.get_instance().fraud_voter(voters[0].national_id)
+
+        report = registry.de_register_voters(
+            (voter.national_id for voter in voters + [Voter("No", "One", "999")]),
+            chunk_size=3,
+            compact=False,
+        )
+        assert (report.removed, report.fraud_kept, report.not_registered) == (9, 1, 1)
+        assert report.compaction is None
+        assert (
+            registry.get_voter_status(voters[0].national_id)
+            == VoterStatus.FRAUD_COMMITTED
+        )
+        for voter in voters[1:]:
+            assert (
+                registry.get_voter_status(voter.national_id)
+                == VoterStatus.NOT_REGISTERED
+            )
+
+    def test_de_registration_space_is_reclaimed(self):
+        """
+        Checks that the pages freed by a bulk de-registration are reclaimed by the background compaction
+        """
+        store = VotingStore.get_instance()
+        national_ids = ["{0:09d}".format(index) for index in range(2000)]
+        store.load_fixture(
+            [],
+            [
+                Voter("Voter", "Name", national_id).get_minimal_voter()
+                for national_id in national_ids
+            ],
+        )
+        _, pages_before, _ = store.get_page_usage()
+
+        report = registry.de_register_voters(national_ids)
+        report.compaction.join()
+        assert report.removed == len(national_ids)
+        assert report.compaction.finished
+        assert report.compaction.reclaimed_bytes > 0
+        page_size, pages_after, free_pages = store.get_page_usage()
+        assert free_pages == 0
+        assert (
+            pages_before - pages_after
+        ) * page_size == report.compaction.reclaimed_bytes
+
     @pytest.fixture(autouse=True)
     def clear_store_between_tests(self):
         VotingStore.refresh_instance()
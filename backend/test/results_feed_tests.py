@@ -0,0 +1,137 @@
+import time
+import uuid
+
+import main.api.balloting as balloting
+import main.api.registry as registry
+import pytest
+from main.api.results_feed import (
+    DELTA_EVENT,
+    HISTORY_SIZE,
+    SNAPSHOT_EVENT,
+    ResultsFeed,
+)
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter
+from main.store.data_registry import VotingStore
+
+
+def next_event(feed, last_seq):
+    return next(feed.subscribe(last_seq, heartbeat_seconds=0))
+
+
+def add_ballot(candidate_id):
+    store = VotingStore.get_instance()
+    store.add_ballot(Ballot("ballot-{0}".format(uuid.uuid4()), candidate_id, ""), "")
+
+
+class TestResultsFeed:
+    def test_new_subscriber_gets_snapshot(self):
+        """
+        Checks that a new subscriber starts from a snapshot of the counts taken when the feed started.
+        """
+        candidate = registry.get_all_candidates()[0]
+        add_ballot(candidate.candidate_id)
+
+        feed = ResultsFeed(VotingStore.get_instance(), interval_seconds=60)
+        event = next_event(feed, None)
+        assert event.kind == SNAPSHOT_EVENT
+        assert event.counts[candidate.candidate_id] == 1
+        assert event.turnout == 1
+
+    def test_deltas_are_coalesced(self):
+        """
+        Checks that ballots counted between two flushes are sent as one delta.
+        """
+        first, second, _ = registry.get_all_candidates()
+        feed = ResultsFeed(VotingStore.get_instance(), interval_seconds=60)
+        snapshot = next_event(feed, None)
+
+        add_ballot(first.candidate_id)
+        add_ballot(first.candidate_id)
+        add_ballot(second.candidate_id)
+        add_ballot("not a candidate")
+        feed.flush()
+
+        event = next_event(feed, snapshot.seq)
+        assert event.kind == DELTA_EVENT
+        assert event.seq == snapshot.seq + 1
+        assert event.counts == {first.candidate_id: 2, second.candidate_id: 1}
+        assert event.turnout == 4
+
+        feed.flush()
+        assert next_event(feed, event.seq) is None
+
+    def test_resume_from_sequence_id(self):
+        """
+        Checks that a reconnecting client gets the deltas it missed, and a snapshot if it fell too far behind.
+        """
+        candidate = registry.get_all_candidates()[0]
+        feed = ResultsFeed(VotingStore.get_instance(), interval_seconds=60)
+        for _ in range(3):
+            add_ballot(candidate.candidate_id)
+            feed.flush()
+
+        resumed = next_event(feed, 1)
+        assert resumed.kind == DELTA_EVENT
+        assert resumed.seq == 2
+
+        for _ in range(HISTORY_SIZE):
+            add_ballot(candidate.candidate_id)
+            feed.flush()
+
+        behind = next_event(feed, 1)
+        assert behind.kind == SNAPSHOT_EVENT
+        assert behind.counts[candidate.candidate_id] == HISTORY_SIZE + 3
+
+    def test_feed_sees_every_counted_ballot(self):
+        """
+        Checks that the feed picks up ballots counted through count_ballot, and ballots counted elsewhere, e.g. by
+        another process sharing the store, or while the feed was taking its snapshot.
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        candidate = registry.get_all_candidates()[0]
+
+        feed = ResultsFeed(VotingStore.get_instance(), interval_seconds=60)
+        snapshot = next_event(feed, None)
+
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        balloting.count_ballot(
+            Ballot(ballot_number, candidate.candidate_id, ""), voter.national_id
+        )
+        add_ballot(candidate.candidate_id)
+        feed.flush()
+
+        event = next_event(feed, snapshot.seq)
+        assert event.counts == {candidate.candidate_id: 2}
+        assert event.turnout == snapshot.turnout + 2
+
+    def test_feed_stops_when_the_store_is_replaced(self, monkeypatch):
+        """
+        Checks that the coalescing thread survives a failed read, and stops once the store it reads is replaced.
+        """
+        feed = ResultsFeed(VotingStore.get_instance(), interval_seconds=0.01)
+        failures = []
+
+        def fail():
+            failures.append(1)
+            raise RuntimeError("counters unavailable")
+
+        monkeypatch.setattr(feed, "flush", fail)
+        feed.start()
+        while len(failures) < 2:
+            time.sleep(0.01)
+        assert feed._thread.is_alive()
+
+        VotingStore.refresh_instance()
+        feed._thread.join(timeout=5)
+        assert not feed._thread.is_alive()
+        assert next(feed.subscribe(None, heartbeat_seconds=0), None) is None
+
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        for candidate_name in ["Kathryn Collins", "Aditya Guha", "Rina Harvey"]:
+            registry.register_candidate(candidate_name)
+
+        yield
@@ -0,0 +1,83 @@
+import jsons
+import pytest
+
+from main.api import backend_rest_api, registry, serialization
+from main.objects.candidate import Candidate
+from main.objects.voter import BallotStatus
+from main.store.data_registry import VotingStore
+
+CANDIDATE_NAMES = ["Kathryn Collins", 'Aditya "Adi" Guha', "Rina Hárvey"]
+BALLOT = {
+    "ballot_number": "not a ballot",
+    "chosen_candidate_id": "1",
+    "voter_comments": "",
+    "voter_national_id": "111-11-1111",
+}
+
+
+class TestSerialization:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch):
+        VotingStore.refresh_instance()
+        for candidate_name in CANDIDATE_NAMES:
+            registry.register_candidate(candidate_name)
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        monkeypatch.delenv(serialization.API_VERSION, raising=False)
+        yield
+
+    def test_version_1_matches_jsons(self):
+        """
+        Checks that the original wire format is kept byte for byte by default
+        """
+        candidates = registry.get_all_candidates()
+        assert serialization.encode_candidates(candidates) == jsons.dumps(candidates)
+        for ballot_status in BallotStatus:
+            original = '{{"status": {0}}}'.format(
+                jsons.dumps(jsons.dumps(ballot_status.value))
+            )
+            assert serialization.encode_ballot_status(
+                ballot_status, serialization.WIRE_FORMAT_V1
+            ) == original.encode("utf-8")
+
+        client = backend_rest_api.app.test_client()
+        response = client.get("/api/get_all_candidates")
+        assert response.mimetype == "text/html"
+        assert response.get_data(as_text=True) == jsons.dumps(candidates)
+
+        response = client.post("/api/count_ballot", json=BALLOT)
+        assert response.status_code == 409
+        assert response.get_json() == {
+            "status": jsons.dumps(BallotStatus.VOTER_NOT_REGISTERED.value)
+        }
+
+    def test_version_2_is_plain_json(self, monkeypatch):
+        """
+        Checks that version 2 is picked by the API-Version header or the API_VERSION default, and that unknown versions
+        are refused
+        """
+        client = backend_rest_api.app.test_client()
+        response = client.get("/api/get_all_candidates", headers={"API-Version": "2"})
+        assert response.mimetype == "application/json"
+        assert response.get_json() == [
+            {"candidate_id": str(index + 1), "name": name}
+            for index, name in enumerate(CANDIDATE_NAMES)
+        ]
+
+        monkeypatch.setenv(serialization.API_VERSION, "2")
+        response = client.post("/api/count_ballot", json=BALLOT)
+        assert response.get_json() == {
+            "status": BallotStatus.VOTER_NOT_REGISTERED.value
+        }
+        response = client.post(
+            "/api/count_ballot", json=BALLOT, headers={"API-Version": "1"}
+        )
+        assert response.get_json() == {
+            "status": jsons.dumps(BallotStatus.VOTER_NOT_REGISTERED.value)
+        }
+
+        response = client.get("/api/get_all_candidates", headers={"API-Version": "3"})
+        assert response.status_code == 400
+        assert serialization.encode_candidate(Candidate("1", "A")) == {
+            "candidate_id": "1",
+            "name": "A",
+        }
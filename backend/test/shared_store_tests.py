@@ -0,0 +1,119 @@
+import os
+import threading
+
+import pytest
+
+from main.api import backend_rest_api, balloting, registry
+from main.detection.redaction_pipeline import CommentRedactionPool
+from main.objects.ballot import Ballot
+from main.objects.voter import BallotStatus, Voter, VoterKey
+from main.store.data_registry import VOTING_STORE_DATABASE, VotingStore
+
+
+class TestSharedStore:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch, tmp_path):
+        monkeypatch.setenv(
+            VOTING_STORE_DATABASE, str(tmp_path / "voting-store.sqlite3")
+        )
+        VotingStore.refresh_instance()
+        yield
+        VotingStore.voting_store_instance.connection.close()
+        monkeypatch.delenv(VOTING_STORE_DATABASE)
+        VotingStore.refresh_instance()
+
+    def test_stores_share_the_database_file(self):
+        """
+        Checks that two stores opened on the same file, as two worker processes would, see each other's writes - and
+        that a candidate added by one is known to the other's candidate index.
+        """
+        store = VotingStore.get_instance()
+        assert store.is_shared()
+        other_store = VotingStore()
+
+        store.add_candidate("Kathryn Collins")
+        candidate_id = store.get_all_candidates()[0].candidate_id
+        assert other_store.is_candidate_registered(candidate_id)
+        assert other_store.get_candidate(candidate_id).name == "Kathryn Collins"
+
+        registry.register_voter(Voter("Rina", "Harvey", "111-11-1111"))
+        assert other_store.get_voter_by_key(VoterKey("111-11-1111")) is not None
+        other_store.connection.close()
+
+    def test_ballot_is_cast_once_across_stores(self):
+        """
+        Checks that once a voter has cast a ballot through one store, casting through another store fails, even though
+        that store read the voter before the first ballot was cast.
+        """
+        store = VotingStore.get_instance()
+        other_store = VotingStore()
+        store.add_candidate("Kathryn Collins")
+        registry.register_voter(Voter("Rina", "Harvey", "111-11-1111"))
+        key = VoterKey("111-11-1111")
+        assert other_store.get_voter_by_key(key).voted == False
+
+        assert store.cast_ballot_by_key(Ballot("ballot-1", "1", ""), key)
+        assert not other_store.cast_ballot_by_key(Ballot("ballot-2", "1", ""), key)
+        assert not store.cast_ballot_by_key(
+            Ballot("ballot-3", "1", ""), VoterKey("222-22-2222")
+        )
+        assert other_store.connection.execute(
+            "SELECT ballot_number FROM ballots"
+        ).fetchall() == [("ballot-1",)]
+        other_store.connection.close()
+
+    def test_count_ballot_on_shared_store(self):
+        """
+        Checks ballot counting end to end on a shared store, including fraud detection
+        """
+        registry.register_candidate("Kathryn Collins")
+        registry.register_voter(Voter("Rina", "Harvey", "111-11-1111"))
+        first_ballot = balloting.issue_ballot("111-11-1111")
+        second_ballot = balloting.issue_ballot("111-11-1111")
+
+        assert (
+            balloting.count_ballot(Ballot(first_ballot, "1", ""), "111-11-1111")
+            == BallotStatus.BALLOT_COUNTED
+        )
+        assert (
+            balloting.count_ballot(Ballot(second_ballot, "1", ""), "111-11-1111")
+            == BallotStatus.FRAUD_COMMITTED
+        )
+
+    def test_forked_child_opens_its_own_connection(self):
+        """
+        Checks that a forked child doesn't reuse the parent's connection to a shared store, but still sees its data
+        """
+        store = VotingStore.get_instance()
+        store.add_candidate("Kathryn Collins")
+
+        pid = os.fork()
+        if pid == 0:
+            child_store = VotingStore.get_instance()
+            os._exit(
+                0
+                if child_store is not store
+                and child_store.connection is not store.connection
+                and child_store.is_candidate_registered("1")
+                else 1
+            )
+
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert VotingStore.get_instance() is store
+
+    def test_seeding_starts_no_threads(self, monkeypatch):
+        """
+        Checks that seeding, which the pre-fork master does before forking the workers, starts no background threads
+        """
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", False)
+        monkeypatch.setattr(
+            CommentRedactionPool, "comment_redaction_pool_instance", None
+        )
+        monkeypatch.setenv(backend_rest_api.SEED_ENV, backend_rest_api.SEED_NONE)
+        threads = set(threading.enumerate())
+
+        backend_rest_api.seed_database_once()
+        assert backend_rest_api._database_seeded
+        assert set(threading.enumerate()) == threads
+        assert CommentRedactionPool.comment_redaction_pool_instance is None
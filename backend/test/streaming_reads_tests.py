@@ -0,0 +1,65 @@
+import pytest
+
+from main.api import balloting, registry
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter
+from main.store.data_registry import VoterRow, VotingStore
+
+VOTERS = [Voter("Voter", str(index), "{0:09d}".format(index)) for index in range(7)]
+
+
+class TestStreamingReads:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        yield
+
+    def test_iterators_match_bulk_reads(self):
+        """
+        Checks that the iterators yield what the bulk reads return, across batch boundaries
+        """
+        store = VotingStore.get_instance()
+        for voter in VOTERS:
+            registry.register_voter(voter)
+        for voter in VOTERS[:3]:
+            store.fraud_voter(voter.national_id)
+        for index, comment in enumerate(["", "long line", "long line", "no pens"]):
+            store.add_ballot(Ballot("ballot-{0}".format(index), "1", comment), "")
+
+        voters = list(store.iter_voters(batch_size=2))
+        assert all(isinstance(voter, VoterRow) for voter in voters)
+        assert [tuple(voter) for voter in voters] == [
+            (voter.first_name, voter.last_name, voter.national_id)
+            for voter in store.get_all_voters()
+        ]
+        assert len(voters) == len(VOTERS)
+        assert len(list(store.iter_fraud_voters(batch_size=2))) == 3
+        assert sorted(store.iter_non_empty_ballot_comments(batch_size=3)) == [
+            "",
+            "long line",
+            "long line",
+            "no pens",
+        ]
+        assert balloting.get_all_fraudulent_voters() == {
+            "Voter {0}".format(index) for index in range(3)
+        }
+
+    def test_writes_during_iteration(self):
+        """
+        Checks that the store can be written to while an iterator is only partly consumed
+        """
+        store = VotingStore.get_instance()
+        for voter in VOTERS:
+            registry.register_voter(voter)
+
+        voters = store.iter_voters(batch_size=2)
+        first_voter = next(voters)
+        store.fraud_voter(VOTERS[0].national_id)
+        registry.register_candidate("Aditya Guha")
+        assert len([first_voter] + list(voters)) == len(VOTERS)
+
+        voters = store.iter_voters(batch_size=2)
+        next(voters)
+        voters.close()
+        assert len(store.get_fraud_voters()) == 1
@@ -0,0 +1,110 @@
+import main.api.balloting as balloting
+import main.api.registry as registry
+import pytest
+from main.objects.ballot import Ballot
+from main.objects.tally import CountingRule
+from main.objects.voter import DEFAULT_PRECINCT
+from main.store.data_registry import VotingStore
+from main.store.tally_engine import compute_tally
+
+
+def cast_ballots(candidate_ids):
+    """
+    Stores ballots directly, without going through voter validation
+    """
+    store = VotingStore.get_instance()
+    for index, candidate_id in enumerate(candidate_ids):
+        store.add_ballot(Ballot("ballot-{0}".format(index), candidate_id, ""), "")
+
+
+class TestTally:
+    def test_counts_and_shares(self):
+        """
+        Checks per-candidate counts, vote shares and ranking.
+        """
+        first, second, third = registry.get_all_candidates()
+        cast_ballots([second.candidate_id] * 3 + [first.candidate_id])
+
+        tally = balloting.compute_election_tally()
+        assert tally.total_votes == 4
+        assert tally.counts == {
+            second.candidate_id: 3,
+            first.candidate_id: 1,
+            third.candidate_id: 0,
+        }
+        assert tally.share(second.candidate_id) == 0.75
+        assert [c.candidate_id for c in tally.top(2)] == [
+            second.candidate_id,
+            first.candidate_id,
+        ]
+
+    def test_ties_are_reported_and_broken_deterministically(self):
+        """
+        Checks that tied leaders are all reported, and that the lowest candidate id wins the tie.
+        """
+        first, second, third = registry.get_all_candidates()
+        cast_ballots([third.candidate_id, second.candidate_id])
+
+        tally = balloting.compute_election_tally()
+        assert [c.candidate_id for c in tally.tied_leaders()] == [
+            second.candidate_id,
+            third.candidate_id,
+        ]
+        assert balloting.compute_election_winner().candidate_id == second.candidate_id
+
+    def test_unregistered_candidates_are_rejected(self):
+        """
+        Checks that ballots for unknown candidates are not counted for anyone.
+        """
+        first, _, _ = registry.get_all_candidates()
+        cast_ballots([first.candidate_id, "999", "-1", "not a candidate"])
+
+        tally = balloting.compute_election_tally()
+        assert tally.total_votes == 1
+        assert tally.rejected == 3
+
+    def test_malformed_candidate_ids_are_rejected(self):
+        """
+        Checks that ids that merely start with, or round to, a registered candidate id are rejected rather than
+        truncated to it, by the national and the precinct tallies alike.
+        """
+        _, second, _ = registry.get_all_candidates()
+        assert second.candidate_id == "2"
+        cast_ballots(["2", "2abc", "2.9", "02", " 2", "2 ", "+2", "2e0", ""])
+
+        tally = balloting.compute_election_tally()
+        assert tally.counts[second.candidate_id] == 1
+        assert tally.rejected == 8
+        precinct_tally = balloting.compute_precinct_tallies()[DEFAULT_PRECINCT]
+        assert precinct_tally.counts[second.candidate_id] == 1
+        assert precinct_tally.rejected == 8
+
+    def test_counting_rules(self):
+        """
+        Checks that a plurality is not enough to win under the majority rule.
+        """
+        first, second, third = registry.get_all_candidates()
+        cast_ballots(
+            [first.candidate_id] * 2 + [second.candidate_id, third.candidate_id]
+        )
+
+        tally = balloting.compute_election_tally()
+        assert tally.winner(CountingRule.PLURALITY).candidate_id == first.candidate_id
+        assert tally.winner(CountingRule.MAJORITY) is None
+
+    def test_batched_loading(self):
+        """
+        Checks that loading in batches smaller than the number of ballots still counts every ballot.
+        """
+        first, _, _ = registry.get_all_candidates()
+        cast_ballots([first.candidate_id] * 10)
+
+        assert compute_tally(batch_size=3).counts[first.candidate_id] == 10
+
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self):
+        VotingStore.refresh_instance()
+        for candidate_name in ["Kathryn Collins", "Aditya Guha", "Rina Harvey"]:
+            registry.register_candidate(candidate_name)
+
+        yield
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from main.api import backend_rest_api, balloting, registry
+from main.objects.ballot import Ballot
+from main.objects.voter import Voter, VoterKey
+from main.store.data_registry import TURNOUT_SERIES_MINUTES, VotingStore
+
+
+def voters(count: int):
+    return [
+        Voter("Voter", str(index), "{0:09d}".format(index)) for index in range(count)
+    ]
+
+
+def cast(store: VotingStore, national_id: str):
+    assert store.cast_ballot_by_key(
+        Ballot("ballot-" + national_id, "1", ""), VoterKey(national_id)
+    )
+
+
+class TestTurnout:
+    @pytest.fixture(autouse=True)
+    def run_around_tests(self, monkeypatch):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        monkeypatch.setattr(backend_rest_api, "_database_seeded", True)
+        yield
+
+    def test_counters_follow_every_voter_write(self):
+        """
+        Checks that the counters are kept up to date by registration, voting, fraud flags and de-registration, and that
+        reading them doesn't touch the voters table
+        """
+        store = VotingStore.get_instance()
+        registered = voters(6)
+        for voter in registered[:4]:
+            registry.register_voter(voter)
+        store.load_fixture([], [voter.get_minimal_voter() for voter in registered[4:]])
+        for voter in registered[:3]:
+            cast(store, voter.national_id)
+        store.add_ballot(Ballot("ballot-3", "1", ""), registered[3].national_id)
+        store.fraud_voter(registered[0].national_id)
+        store.fraud_voter(registered[0].national_id)
+        store.fraud_voter(registered[5].national_id)
+        assert store.get_turnout() == (6, 4, 2)
+
+        registry.de_register_voter(registered[1].national_id)
+        store.delete_voter_by_national_id(registered[5].national_id)
+        report = registry.de_register_voters(
+            [voter.national_id for voter in registered[2:5]], compact=False
+        )
+        assert report.removed == 3
+
+        statements = []
+        store.connection.set_trace_callback(statements.append)
+        turnout = balloting.get_turnout()
+        store.connection.set_trace_callback(None)
+        assert (turnout.registered, turnout.voted, turnout.fraud_flagged) == (1, 1, 1)
+        assert not [statement for statement in statements if "voters" in statement]
+
+    def test_ballots_per_minute(self):
+        """
+        Checks that ballots are counted in the minute they are cast, and that a ring buffer slot left from an earlier
+        lap is started over
+        """
+        store = VotingStore.get_instance()
+        current_minute = int(time.time()) // 60
+        store.connection.execute(
+            """INSERT INTO turnout_by_minute (slot, minute, ballots) VALUES (?, ?, 100)""",
+            (
+                current_minute % TURNOUT_SERIES_MINUTES,
+                current_minute - TURNOUT_SERIES_MINUTES,
+            ),
+        )
+        for voter in voters(3):
+            registry.register_voter(voter)
+            cast(store, voter.national_id)
+
+        now = time.time()
+        turnout = balloting.get_turnout(5, now=now)
+        assert [minute for minute, _ in turnout.ballots_per_minute] == [
+            (int(now) // 60 + offset) * 60 for offset in range(-4, 1)
+        ]
+        # The ballots may have been cast as the minute turned
+        assert sum(ballots for _, ballots in turnout.ballots_per_minute[-2:]) == 3
+        assert sum(ballots for _, ballots in turnout.ballots_per_minute[:-2]) == 0
+
+        with pytest.raises(ValueError):
+            balloting.get_turnout(TURNOUT_SERIES_MINUTES + 1)
+
+    def test_turnout_endpoint(self):
+        client = backend_rest_api.app.test_client()
+        registry.register_voter(voters(1)[0])
+
+        response = client.get("/api/turnout?minutes=3")
+        assert response.status_code == 200
+        body = response.get_json()
+        assert (body["registered"], body["voted"], body["fraud_flagged"]) == (1, 0, 0)
+        assert [entry["ballots"] for entry in body["ballots_per_minute"]] == [0, 0, 0]
+
+        assert client.get("/api/turnout?minutes=0").status_code == 400
+
+    def test_counters_of_older_database_files(self, tmp_path):
+        """
+        Checks that a database file written before the counters existed gets them, counted from its voters and ballots
+        """
+        path = str(tmp_path / "votes.db")
+        store = VotingStore.open_database(path)
+        for voter in voters(3):
+            store.add_voter(voter)
+        cast(store, "000000000")
+        store.fraud_voter("000000001")
+        ballots_by_candidate = store.get_ballots_by_candidate()
+        with store.connection:
+            store.connection.execute("""DROP TABLE turnout""")
+            store.connection.execute("""DROP TABLE ballots_by_candidate""")
+        store.connection.close()
+
+        store = VotingStore.open_database(path)
+        assert store.get_turnout() == (3, 1, 1)
+        assert store.get_ballots_by_candidate() == ballots_by_candidate
+        assert sum(ballots_by_candidate.values()) == 1